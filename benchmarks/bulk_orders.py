@@ -0,0 +1,78 @@
+"""Compare creating N orders with N single POST /api/v1/orders calls against POST /api/v1/orders/batch.
+
+Boots the services like loadtest.py (or uses --gateway-url), registers one user and creates --orders
+orders three ways through the gateway: one call at a time, --concurrency single calls in parallel,
+and in batches of --batch-size. Reports wall time, orders per second and how many were accepted.
+
+    python benchmarks/bulk_orders.py --orders 500 --batch-size 500 --concurrency 16
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import Client, Stack, order_body, scenario_register  # noqa: E402
+
+
+def single(client, token, count, concurrency):
+    def create(_):
+        return client.call('POST', '/api/v1/orders', token, json=order_body()).status_code == 202
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return sum(pool.map(create, range(count)))
+
+
+def batched(client, token, count, batch_size):
+    accepted = 0
+    for start in range(0, count, batch_size):
+        orders = [order_body() for _ in range(min(batch_size, count - start))]
+        response = client.call('POST', '/api/v1/orders/batch', token, json={'orders': orders})
+        if response.status_code == 200:
+            accepted += response.json()['accepted']
+    return accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16, help='parallel single calls in the concurrent run')
+    parser.add_argument('--gateway-url', help='use an already running gateway instead of booting the services')
+    parser.add_argument('--base-port', type=int, default=18180, help='gateway port; the other services use the next four')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--keep-logs', action='store_true')
+    args = parser.parse_args()
+    # Charges finish quickly and the payment queue holds a whole batch, so only the order path is measured.
+    args.gateway_mode, args.payment_delay, args.payment_failure_rate, args.bcrypt_rounds = 'sync', (0.001, 0.005), 0.0, 4
+    os.environ.setdefault('PAYMENT_QUEUE_DEPTH', str(max(args.batch_size, args.concurrency) * 2))
+
+    stack = None if args.gateway_url else Stack(args)
+    try:
+        if stack:
+            stack.start()
+        client = Client(args.gateway_url or stack.gateway_url, max(args.concurrency, 1))
+        scenario_register(client)
+        if not client.users:
+            raise RuntimeError('could not register a user')
+        token = client.token()
+        batched(client, token, min(args.batch_size, 20), args.batch_size)
+        runs = [('single, sequential', lambda: single(client, token, args.orders, 1)),
+                (f'single, {args.concurrency} parallel', lambda: single(client, token, args.orders, args.concurrency)),
+                (f'batch of {args.batch_size}', lambda: batched(client, token, args.orders, args.batch_size))]
+        print(f"{'':>24} {'seconds':>9} {'orders/s':>10} {'accepted':>9}")
+        for label, run in runs:
+            start = time.perf_counter()
+            accepted = run()
+            elapsed = time.perf_counter() - start
+            print(f'{label:>24} {elapsed:9.2f} {args.orders / elapsed:10.0f} {accepted:9d}')
+            time.sleep(1)
+    finally:
+        if stack:
+            stack.stop()
+
+
+if __name__ == '__main__':
+    main()
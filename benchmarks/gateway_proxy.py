@@ -0,0 +1,99 @@
+"""Benchmark the API gateway's pooled upstream client against per-request `requests` calls.
+
+Boots a stub order service and the gateway in-process, then drives GET /api/v1/orders/<id>
+through both proxy implementations and reports throughput and p50/p99 latency.
+
+    python benchmarks/gateway_proxy.py --requests 2000 --concurrency 8
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+import requests
+from flask import Flask, jsonify, g
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'services'))
+sys.path.insert(0, os.path.join(ROOT, 'services', 'api-gateway'))
+
+
+def start_server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.port}'
+
+
+def stub_order_service(delay):
+    stub = Flask('stub-order-service')
+    items = [{'name': f'item-{i}', 'price': 9.99, 'quantity': 2} for i in range(20)]
+
+    @stub.route('/api/v1/orders/<order_id>')
+    def get_order(order_id):
+        if delay:
+            time.sleep(delay)
+        return jsonify({'order_id': order_id, 'items': items, 'total': 399.6, 'status': 'pending', 'created_at': time.time()})
+    return stub
+
+
+def legacy_proxy_request(service_name, path, method='GET', data=None, hedge=False):
+    # The pre-pooling implementation: a fresh connection per call and a JSON decode/encode round trip.
+    import app as gateway
+    response = requests.get(f'{gateway.SERVICES[service_name]}{path}', timeout=10, headers={'X-Request-ID': g.request_id})
+    return jsonify(response.json()), response.status_code
+
+
+def drive(url, total, concurrency, token):
+    session = requests.Session()
+    session.headers['Authorization'] = f'Bearer {token}'
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def one(i):
+        start = time.perf_counter()
+        response = session.get(f'{url}/api/v1/orders/{i}')
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100)
+    return {'rps': total / elapsed, 'p50_ms': cuts[49] * 1000, 'p99_ms': cuts[98] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--upstream-delay-ms', type=float, default=1.0)
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    _, upstream_url = start_server(stub_order_service(args.upstream_delay_ms / 1000))
+    os.environ['ORDER_SERVICE_URL'] = upstream_url
+    # Measure the proxy path itself: no response cache in front of it, and no rate limit on the single benchmark caller.
+    os.environ['CACHE_MAX_BYTES'] = '0'
+    os.environ['RATE_LIMITS'] = ''
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-of-at-least-32-bytes')
+    token = jwt.encode({'user_id': 'bench', 'email': 'bench@example.com', 'exp': time.time() + 3600}, os.environ['JWT_SECRET_KEY'], algorithm='HS256')
+    import app as gateway
+    logging.getLogger().setLevel(logging.WARNING)
+    pooled_proxy_request = gateway.proxy_request
+    _, gateway_url = start_server(gateway.app)
+
+    for mode, impl in (('per-request', legacy_proxy_request), ('pooled', pooled_proxy_request)):
+        gateway.proxy_request = impl
+        drive(gateway_url, min(200, args.requests), args.concurrency, token)
+        result = drive(gateway_url, args.requests, args.concurrency, token)
+        print(f"{mode:>12}: {result['rps']:8.1f} req/s  p50 {result['p50_ms']:6.2f} ms  p99 {result['p99_ms']:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Measure per-request instrumentation overhead and Prometheus series growth, before and after common.instrumentation.
+
+Drives GET /api/v1/orders/<id> with a fresh id per request through three in-process Flask apps: one
+without instrumentation, one with the old hooks (raw request.path labels, time.time(), a synchronous
+JSON access log line per request) and one with RequestMetrics (route-template labels, perf_counter(),
+sampled access log through the queue handler). Reports overhead per request, the number of series
+exported and how long a /metrics scrape takes.
+
+    python benchmarks/instrumentation.py --requests 5000 --sample-rate 0.1
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from flask import Flask, g, jsonify, request
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from pythonjsonlogger import jsonlogger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'services'))
+
+from common.instrumentation import AsyncLogHandler, RequestMetrics, instrument  # noqa: E402
+
+
+def json_handler(stream):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    return handler
+
+
+def order_app(name):
+    app = Flask(name)
+
+    @app.route('/api/v1/orders/<order_id>')
+    def get_order(order_id):
+        return jsonify({'order_id': order_id, 'status': 'pending'})
+    return app
+
+
+def request_metrics(registry):
+    return (Counter('requests_total', 'Total requests', ['method', 'endpoint', 'status_code'], registry=registry),
+            Histogram('request_duration_seconds', 'Latency', ['method', 'endpoint'], registry=registry))
+
+
+def legacy_app(registry, stream):
+    app = order_app('legacy')
+    request_count, request_latency = request_metrics(registry)
+    access = logging.getLogger('legacy-access')
+    access.propagate = False
+    access.addHandler(json_handler(stream))
+    access.setLevel(logging.INFO)
+
+    @app.before_request
+    def before_request():
+        g.start_time = time.time()
+
+    @app.after_request
+    def after_request(response):
+        latency = time.time() - g.start_time
+        request_count.labels(method=request.method, endpoint=request.path, status_code=response.status_code).inc()
+        request_latency.labels(method=request.method, endpoint=request.path).observe(latency)
+        access.info('Request completed', extra={'method': request.method, 'path': request.path, 'status_code': response.status_code, 'latency_ms': round(latency * 1000, 2)})
+        return response
+    return app
+
+
+def instrumented_app(registry, sample_rate):
+    app = order_app('instrumented')
+    instrument(app, RequestMetrics(*request_metrics(registry), access_log=True, sample_rate=sample_rate))
+    return app
+
+
+def drive(app, total):
+    client = app.test_client()
+    start = time.perf_counter()
+    for i in range(total):
+        client.get(f'/api/v1/orders/{i:08d}')
+    return time.perf_counter() - start
+
+
+def series(registry):
+    start = time.perf_counter()
+    exposition = generate_latest(registry).decode()
+    elapsed = time.perf_counter() - start
+    return sum(1 for line in exposition.splitlines() if line and not line.startswith('#')), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--sample-rate', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull:
+        root = logging.getLogger()
+        root.addHandler(AsyncLogHandler(json_handler(devnull)))
+        root.setLevel(logging.INFO)
+        legacy_registry, new_registry = CollectorRegistry(), CollectorRegistry()
+        apps = [('uninstrumented', order_app('bare'), None),
+                ('request.path + sync log', legacy_app(legacy_registry, devnull), legacy_registry),
+                ('url_rule + sampled log', instrumented_app(new_registry, args.sample_rate), new_registry)]
+        for _, app, _ in apps:
+            drive(app, 200)
+        baseline = None
+        print(f"{'':>24} {'us/request':>11} {'overhead us':>12} {'series':>8} {'scrape ms':>10}")
+        for label, app, registry in apps:
+            elapsed = drive(app, args.requests) / args.requests * 1e6
+            baseline = elapsed if baseline is None else baseline
+            count, scrape = series(registry) if registry else (0, 0.0)
+            print(f'{label:>24} {elapsed:11.1f} {elapsed - baseline:12.1f} {count:8d} {scrape * 1000:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
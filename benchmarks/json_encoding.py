@@ -0,0 +1,79 @@
+"""Serialization cost of a 10k-order listing: Flask's standard library JSON against common.fastjson.
+
+Times, as the median of --repeat runs, each step an order listing goes through: encoding the response
+body (jsonify through app.json), decoding it (request parsing, or the gateway reading an upstream body),
+the gateway's decode and re-encode, the per-row dumps/loads of the storage layer, and the NDJSON export.
+
+    python benchmarks/json_encoding.py --orders 10000 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'services'))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from common import fastjson  # noqa: E402
+from common.bootstrap import JSONProvider  # noqa: E402
+
+
+def order(i):
+    return {'order_id': str(uuid.uuid4()), 'items': [{'name': 'Laptop', 'price': 999.99, 'quantity': 1}, {'name': 'Mouse', 'price': 29.99, 'quantity': 2}],
+            'total': 1059.97, 'status': 'paid', 'payment_id': str(uuid.uuid4()), 'user_id': str(uuid.uuid4()), 'created_at': time.time() + i}
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    orders = [order(i) for i in range(args.orders)]
+    listing = {'orders': orders, 'limit': args.orders, 'next_cursor': None}
+    body = stdlib_dumps(listing)
+    rows = [stdlib_dumps(o).decode('utf-8') for o in orders]
+
+    default_app, fast_app = Flask('stdlib'), Flask('fast')
+    default_app.json = DefaultJSONProvider(default_app)
+    fast_app.json = JSONProvider(fast_app)
+
+    def respond(app):
+        with app.app_context():
+            return app.json.response(listing).get_data()
+
+    steps = [
+        ('jsonify listing', lambda: respond(default_app), lambda: respond(fast_app)),
+        ('decode listing', lambda: json.loads(body), lambda: fastjson.loads(body)),
+        ('gateway decode + encode', lambda: stdlib_dumps(json.loads(body)), lambda: fastjson.dumps(fastjson.loads(body))),
+        ('storage dumps per row', lambda: [json.dumps(o, separators=(',', ':')) for o in orders], lambda: [fastjson.dumps(o).decode('utf-8') for o in orders]),
+        ('storage loads per row', lambda: [json.loads(row) for row in rows], lambda: [fastjson.loads(row) for row in rows]),
+        ('ndjson export', lambda: b''.join(stdlib_dumps(o) + b'\n' for o in orders), lambda: b''.join(fastjson.dumps(o) + b'\n' for o in orders)),
+    ]
+    print(f"{args.orders} orders, {len(body) / 1e6:.1f} MB listing, fast encoder: {'orjson' if fastjson.orjson else 'standard library (orjson not installed)'}")
+    print(f"{'':>24} {'stdlib ms':>10} {'fast ms':>9} {'speedup':>8}")
+    for label, stdlib, fast in steps:
+        stdlib_ms, fast_ms = median_ms(stdlib, args.repeat), median_ms(fast, args.repeat)
+        print(f'{label:>24} {stdlib_ms:10.1f} {fast_ms:9.1f} {stdlib_ms / fast_ms:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""End-to-end open-loop load test of the five services behind the API gateway.
+
+Boots auth, order, payment, notification and the gateway locally under gunicorn (or hypercorn for the
+asyncio gateway), registers a pool of users, then fires requests at a fixed arrival rate for
+--duration seconds regardless of how fast the services answer (open loop). Latency is measured from
+each request's scheduled start, so queueing inside the harness counts against the services.
+Throughput, p50/p95/p99 and error rates are reported per route and written as JSON for comparison.
+
+    python benchmarks/loadtest.py --rate 50 --duration 30 --workers 2 --threads 4
+    python benchmarks/loadtest.py --mix checkout=1 --payment-delay 0.05,0.2 --payment-failure-rate 0.1
+    python benchmarks/loadtest.py --gateway-url http://localhost:8080      (an already running stack)
+    python benchmarks/loadtest.py --compare benchmarks/results/before.json benchmarks/results/after.json
+
+A request counts as an error when it raises or returns a status other than the expected one.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = os.path.join(ROOT, 'services')
+GUNICORN_CONF = os.path.join(SERVICES, 'common', 'gunicorn_conf.py')
+# (directory, port offset from --base-port, gateway environment variable pointing at it)
+STACK = [('auth-service', 1, 'AUTH_SERVICE_URL'), ('order-service', 2, 'ORDER_SERVICE_URL'),
+         ('payment-service', 3, 'PAYMENT_SERVICE_URL'), ('notification-service', 4, 'NOTIFICATION_SERVICE_URL')]
+DEFAULT_MIX = 'create_order=30,get_order=25,list_orders=10,login=10,notify=15,checkout=5,register=5'
+SECRET = 'loadtest-secret-key-of-at-least-32-bytes'
+
+
+class Stack:
+    """The five services running as local subprocesses, logging to one file each."""
+
+    def __init__(self, args):
+        self.args = args
+        self.directory = tempfile.mkdtemp(prefix='loadtest-')
+        self.processes = []
+        self.gateway_url = f'http://127.0.0.1:{args.base_port}'
+
+    def environment(self):
+        min_delay, max_delay = self.args.payment_delay
+        env = dict(os.environ, PYTHONPATH=SERVICES, DATA_DIR=os.path.join(self.directory, 'data'), JWT_SECRET_KEY=SECRET,
+                   BCRYPT_ROUNDS=str(self.args.bcrypt_rounds), PAYMENT_MIN_DELAY=str(min_delay), PAYMENT_MAX_DELAY=str(max_delay),
+                   PAYMENT_FAILURE_RATE=str(self.args.payment_failure_rate), ACCESS_LOG_SAMPLE_RATE='0',
+                   RATE_LIMITS=os.getenv('RATE_LIMITS', ''))
+        for name, offset, variable in STACK:
+            env[variable] = f'http://127.0.0.1:{self.args.base_port + offset}'
+        return env
+
+    def command(self, name, port):
+        if name == 'api-gateway' and self.args.gateway_mode == 'async':
+            return ['hypercorn', '--bind', f'127.0.0.1:{port}', '--workers', str(self.args.workers), 'asgi:app']
+        return ['gunicorn', '-c', GUNICORN_CONF, '--bind', f'127.0.0.1:{port}', '--workers', str(self.args.workers), '--threads', str(self.args.threads), 'app:app']
+
+    def start(self):
+        env = self.environment()
+        services = [(name, self.args.base_port + offset) for name, offset, _ in STACK] + [('api-gateway', self.args.base_port)]
+        for name, port in services:
+            log = open(os.path.join(self.directory, f'{name}.log'), 'w')
+            self.processes.append(subprocess.Popen(self.command(name, port), cwd=os.path.join(SERVICES, name), env=env, stdout=log, stderr=subprocess.STDOUT))
+        # Warm-up primes connections to the other services, so everything is started before waiting on /ready.
+        for name, port in services:
+            wait_healthy(f'http://127.0.0.1:{port}/ready', name)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.args.keep_logs:
+            print(f'service logs: {self.directory}')
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def wait_healthy(url, name, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{name} did not become healthy at {url}')
+
+
+class Client:
+    """Thread-safe state shared by the scenarios: the user pool and the ids of created orders."""
+
+    def __init__(self, base_url, concurrency):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.trust_env = False
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        self.users = []
+        self.orders = []
+        self.lock = threading.Lock()
+
+    def call(self, method, path, token=None, **kwargs):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return self.session.request(method, f'{self.base_url}{path}', headers=headers, timeout=30, **kwargs)
+
+    def register(self):
+        email, password = f'load-{uuid.uuid4().hex[:12]}@example.com', 'load-test-password'
+        response = self.call('POST', '/api/v1/auth/register', json={'email': email, 'password': password})
+        return response, (email, password)
+
+    def login(self, email, password):
+        response = self.call('POST', '/api/v1/auth/login', json={'email': email, 'password': password})
+        return response, response.json().get('token') if response.status_code == 200 else None
+
+    def token(self):
+        return random.choice(self.users)[2]
+
+    def remember_order(self, response):
+        if response.status_code == 202:
+            with self.lock:
+                self.orders.append(response.json()['order']['order_id'])
+                if len(self.orders) > 10000:
+                    del self.orders[:5000]
+
+    def order_id(self):
+        with self.lock:
+            return random.choice(self.orders) if self.orders else 'missing'
+
+
+def order_body():
+    return {'items': [{'name': f'item-{i}', 'price': round(random.uniform(1, 100), 2), 'quantity': random.randint(1, 3)} for i in range(random.randint(1, 5))]}
+
+
+# Each scenario returns [(route, response, expected status), ...] for the requests it made.
+def scenario_register(client):
+    response, credentials = client.register()
+    results = [('POST /api/v1/auth/register', response, 201)]
+    if response.status_code == 201:
+        login, token = client.login(*credentials)
+        results.append(('POST /api/v1/auth/login', login, 200))
+        if token:
+            with client.lock:
+                client.users.append((*credentials, token))
+    return results
+
+
+def scenario_login(client):
+    email, password, _ = random.choice(client.users)
+    response, _ = client.login(email, password)
+    return [('POST /api/v1/auth/login', response, 200)]
+
+
+def scenario_create_order(client):
+    response = client.call('POST', '/api/v1/orders', client.token(), json=order_body())
+    client.remember_order(response)
+    return [('POST /api/v1/orders', response, 202)]
+
+
+def scenario_get_order(client):
+    return [('GET /api/v1/orders/<order_id>', client.call('GET', f'/api/v1/orders/{client.order_id()}', client.token()), 200)]
+
+
+def scenario_list_orders(client):
+    return [('GET /api/v1/orders', client.call('GET', '/api/v1/orders?limit=20', client.token()), 200)]
+
+
+def scenario_notify(client):
+    body = {'type': random.choice(['email', 'sms', 'push']), 'recipient': 'load@example.com', 'message': 'Order update'}
+    return [('POST /api/v1/notifications', client.call('POST', '/api/v1/notifications', json=body), 202)]
+
+
+def scenario_checkout(client):
+    """The whole flow for one order: create it, long-poll until payment settles, then notify the customer."""
+    token = client.token()
+    created = client.call('POST', '/api/v1/orders', token, json=order_body())
+    results = [('POST /api/v1/orders', created, 202)]
+    if created.status_code != 202:
+        return results
+    client.remember_order(created)
+    order_id = created.json()['order']['order_id']
+    settled = client.call('GET', f'/api/v1/orders/{order_id}?wait=8', token)
+    results.append(('GET /api/v1/orders/<order_id>?wait', settled, 200))
+    if settled.status_code == 200 and settled.json().get('status') in ('paid', 'payment_failed'):
+        body = {'type': 'email', 'recipient': 'load@example.com', 'message': f"Order {order_id} {settled.json()['status']}"}
+        results.append(('POST /api/v1/notifications', client.call('POST', '/api/v1/notifications', json=body), 202))
+    return results
+
+
+SCENARIOS = {'register': scenario_register, 'login': scenario_login, 'create_order': scenario_create_order, 'get_order': scenario_get_order,
+             'list_orders': scenario_list_orders, 'notify': scenario_notify, 'checkout': scenario_checkout}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_delay(text):
+    low, _, high = text.partition(',')
+    return float(low), float(high or low)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, route, latency, status, ok):
+        with self.lock:
+            self.samples.setdefault(route, []).append((latency, status, ok))
+
+
+def run_scenario(client, recorder, name, scheduled):
+    try:
+        results = SCENARIOS[name](client)
+    except Exception as e:
+        recorder.add(f'scenario {name}', time.perf_counter() - scheduled, type(e).__name__, False)
+        return
+    # Single requests are timed from their scheduled start; the steps of a multi-request scenario by their own
+    # round trip, with the whole scenario (from its scheduled start) recorded as `scenario <name>`.
+    for route, response, expected in results:
+        recorder.add(route, response.elapsed.total_seconds() if len(results) > 1 else time.perf_counter() - scheduled, response.status_code, response.status_code == expected)
+    if len(results) > 1:
+        recorder.add(f'scenario {name}', time.perf_counter() - scheduled, results[-1][1].status_code, all(r.status_code == e for _, r, e in results))
+
+
+def drive(client, recorder, mix, rate, duration, concurrency, arrivals):
+    names, weights = list(mix), list(mix.values())
+    late = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < duration:
+            next_at += random.expovariate(rate) if arrivals == 'poisson' else 1 / rate
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.01:
+                late += 1
+            pool.submit(run_scenario, client, recorder, random.choices(names, weights)[0], next_at)
+    return time.perf_counter() - start, late
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(latency for latency, _, _ in samples)
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+        statuses = {}
+        for _, status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        errors = sum(1 for _, _, ok in samples if not ok)
+        routes[route] = {'requests': len(samples), 'throughput_rps': round(len(samples) / elapsed, 2), 'error_rate': round(errors / len(samples), 4),
+                         'p50_ms': round(cuts[49] * 1000, 2), 'p95_ms': round(cuts[94] * 1000, 2), 'p99_ms': round(cuts[98] * 1000, 2),
+                         'max_ms': round(latencies[-1] * 1000, 2), 'statuses': statuses}
+    return routes
+
+
+def print_routes(routes):
+    print(f"{'route':<40} {'requests':>8} {'rps':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in routes.items():
+        print(f"{route:<40} {r['requests']:8d} {r['throughput_rps']:8.1f} {r['error_rate']:7.1%} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f}")
+
+
+def compare(before_path, after_path):
+    before, after = (json.load(open(path)) for path in (before_path, after_path))
+    print(f"{'route':<40} {'rps':>16} {'p99 ms':>20} {'errors':>16}")
+    for route in sorted(set(before['routes']) | set(after['routes'])):
+        b, a = before['routes'].get(route), after['routes'].get(route)
+        if not b or not a:
+            print(f"{route:<40} {'only in ' + ('after' if a else 'before'):>16}")
+            continue
+        print(f"{route:<40} {b['throughput_rps']:7.1f} -> {a['throughput_rps']:6.1f} {b['p99_ms']:9.1f} -> {a['p99_ms']:8.1f} "
+              f"{b['error_rate']:6.1%} -> {a['error_rate']:6.1%}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=50, help='scenario arrivals per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after warm-up')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of load before measuring')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'scenario weights (default {DEFAULT_MIX})')
+    parser.add_argument('--arrivals', choices=['poisson', 'uniform'], default='poisson')
+    parser.add_argument('--concurrency', type=int, default=256, help='maximum requests in flight from the harness')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--gateway-url', help='load an already running gateway instead of booting the services')
+    parser.add_argument('--base-port', type=int, default=18080, help='gateway port; the other services use the next four')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn/hypercorn workers per service')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--gateway-mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--payment-delay', type=parse_delay, default=(0.1, 0.5), metavar='MIN,MAX', help='simulated charge time in seconds')
+    parser.add_argument('--payment-failure-rate', type=float, default=0.05)
+    parser.add_argument('--bcrypt-rounds', type=int, default=10)
+    parser.add_argument('--output', help='result file (default benchmarks/results/loadtest-<timestamp>.json)')
+    parser.add_argument('--keep-logs', action='store_true', help='keep the booted services\' logs and data')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    random.seed(args.seed)
+
+    stack = None if args.gateway_url else Stack(args)
+    try:
+        if stack:
+            stack.start()
+        client = Client(args.gateway_url or stack.gateway_url, args.concurrency)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: scenario_register(client), range(args.users)))
+        if not client.users:
+            raise RuntimeError('could not register any users')
+        for _ in range(min(args.users, 20)):
+            scenario_create_order(client)
+
+        print(f'warming up for {args.warmup:.0f}s, then {args.rate:g} scenarios/s for {args.duration:.0f}s')
+        drive(client, Recorder(), args.mix, args.rate, args.warmup, args.concurrency, args.arrivals)
+        recorder = Recorder()
+        elapsed, late = drive(client, recorder, args.mix, args.rate, args.duration, args.concurrency, args.arrivals)
+        routes = summarize(recorder, elapsed)
+    finally:
+        if stack:
+            stack.stop()
+
+    print_routes(routes)
+    if late:
+        print(f'warning: {late} arrivals were dispatched late; the harness itself may be saturated')
+    config = {key: value for key, value in vars(args).items() if key not in ('compare', 'keep_logs', 'output')}
+    result = {'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'revision': git_revision(), 'config': config,
+              'elapsed_seconds': round(elapsed, 2), 'late_arrivals': late, 'routes': routes}
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
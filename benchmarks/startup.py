@@ -0,0 +1,154 @@
+"""Measure service start-up: the import time of each app.py and cold start to the first answered request.
+
+Import time is the median over --runs fresh interpreters of `import app`, with the slowest direct imports
+of app.py from `python -X importtime`. Cold start boots the five services like loadtest.py, all at once,
+and polls each until /health (a worker is serving) and /ready (its warm-up has finished) answer 200, then
+times a first registration through the gateway and reports the memory (PSS) of each service's processes.
+With --compare-preload the stack is booted again with GUNICORN_PRELOAD=0 for comparison.
+
+    python benchmarks/startup.py --runs 5 --workers 4 --compare-preload
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import SERVICES, STACK, Stack  # noqa: E402
+
+NAMES = [name for name, _, _ in STACK] + ['api-gateway']
+IMPORT_TIMER = 'import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)'
+
+
+def import_environment():
+    return dict(os.environ, PYTHONPATH=SERVICES, STORAGE_URL='memory://', RATE_LIMIT_STORAGE_URL='memory://')
+
+
+def import_time(name, runs):
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', IMPORT_TIMER], cwd=os.path.join(SERVICES, name), env=import_environment(),
+                                capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.split()[-1]))
+    return statistics.median(timings)
+
+
+def slowest_imports(name, top):
+    """The `top` direct imports of app.py with the largest cumulative import time, as (module, ms)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=os.path.join(SERVICES, name), env=import_environment(),
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        # Nested imports are indented two spaces per level under the module that triggered them.
+        if len(module) - len(module.lstrip()) == 3:
+            modules.append((module.strip(), int(cumulative) / 1000))
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+
+
+def process_tree(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return [pid]
+    return [pid] + [descendant for child in children for descendant in process_tree(child)]
+
+
+def pss_mb(pid):
+    """Proportional set size of a process and its descendants: pages shared by n processes count 1/n each."""
+    total = 0
+    for process in process_tree(pid):
+        try:
+            with open(f'/proc/{process}/smaps_rollup') as f:
+                total += sum(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        except OSError:
+            return None
+    return total / 1024
+
+
+def wait_for(url, timeout):
+    # Once the port is bound, a request sent before any worker is serving waits in the listen backlog.
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if requests.get(url, timeout=timeout).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f'{url} did not answer 200 within {timeout}s')
+
+
+def cold_start(args, preload):
+    stack = Stack(args)
+    env = dict(stack.environment(), GUNICORN_PRELOAD='1' if preload else '0')
+    ports = {name: args.base_port + offset for name, offset, _ in STACK}
+    ports['api-gateway'] = args.base_port
+    processes, results = {}, {name: {} for name in NAMES}
+    started = time.perf_counter()
+
+    def probe(name):
+        url = f'http://127.0.0.1:{ports[name]}'
+        wait_for(f'{url}/health', args.timeout)
+        results[name]['health'] = time.perf_counter() - started
+        wait_for(f'{url}/ready', args.timeout)
+        results[name]['ready'] = time.perf_counter() - started
+
+    try:
+        for name in NAMES:
+            log = open(os.path.join(stack.directory, f'{name}.log'), 'w')
+            processes[name] = subprocess.Popen(stack.command(name, ports[name]), cwd=os.path.join(SERVICES, name), env=env, stdout=log, stderr=subprocess.STDOUT)
+            stack.processes.append(processes[name])
+        with ThreadPoolExecutor(max_workers=len(NAMES)) as pool:
+            list(pool.map(probe, NAMES))
+        request_started = time.perf_counter()
+        response = requests.post(f'{stack.gateway_url}/api/v1/auth/register', json={'email': f'{uuid.uuid4().hex}@startup.test', 'password': 'startup-password'}, timeout=10)
+        first_request = {'status': response.status_code, 'latency': time.perf_counter() - request_started, 'done': time.perf_counter() - started}
+        for name in NAMES:
+            results[name]['pss'] = pss_mb(processes[name].pid)
+    finally:
+        stack.stop()
+    return results, first_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='interpreters timed per service for the import time')
+    parser.add_argument('--top', type=int, default=5, help='slowest direct imports listed per service')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--base-port', type=int, default=18380, help='gateway port; the other services use the next four')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--compare-preload', action='store_true', help='boot the stack a second time without preload_app')
+    parser.add_argument('--keep-logs', action='store_true')
+    args = parser.parse_args()
+    args.gateway_mode, args.payment_delay, args.payment_failure_rate, args.bcrypt_rounds = 'sync', (0.001, 0.005), 0.0, 4
+
+    print(f"{'import':>22} {'ms':>8}   slowest direct imports (cumulative ms)")
+    for name in NAMES:
+        slowest = ', '.join(f'{module} {ms:.0f}' for module, ms in slowest_imports(name, args.top))
+        print(f'{name:>22} {import_time(name, args.runs) * 1000:8.0f}   {slowest}')
+
+    for preload in [True, False] if args.compare_preload else [True]:
+        results, first_request = cold_start(args, preload)
+        print(f"\ncold start, {'preload' if preload else 'no preload'}, {args.workers} workers")
+        print(f"{'':>22} {'/health s':>10} {'/ready s':>10} {'PSS MB':>8}")
+        for name in NAMES:
+            pss = results[name]['pss']
+            print(f"{name:>22} {results[name]['health']:10.2f} {results[name]['ready']:10.2f} {pss if pss is not None else float('nan'):8.1f}")
+        print(f"first register through the gateway: status {first_request['status']}, {first_request['latency'] * 1000:.0f} ms, "
+              f"{first_request['done']:.2f} s after launch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare write and read throughput of the storage backends against the old module-level dicts.
+
+    python benchmarks/storage.py --documents 20000 --batch-size 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'services'))
+
+from common.storage import SQLiteStorage  # noqa: E402
+
+
+def order(i):
+    return {'order_id': str(uuid.uuid4()), 'items': [{'name': 'Laptop', 'price': 999.99, 'quantity': 1}, {'name': 'Mouse', 'price': 29.99, 'quantity': 2}],
+            'total': 1059.97, 'status': 'pending', 'created_at': time.time() + i}
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>28}: {count / elapsed:12,.0f} ops/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+    documents = [order(i) for i in range(args.documents)]
+    keys = [d['order_id'] for d in documents]
+    n = len(documents)
+
+    db = {}
+    timed('dict write', n, lambda: [db.__setitem__(d['order_id'], d) for d in documents])
+    timed('dict read', n, lambda: [db.get(k) for k in keys])
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLiteStorage(os.path.join(directory, 'bench.db'))
+        single = storage.repository('single', fields=('created_at', 'status'))
+        batched = storage.repository('batched', fields=('created_at', 'status'))
+        grouped = storage.repository('grouped', fields=('created_at', 'status'))
+
+        timed('sqlite write (autocommit)', n, lambda: [single.put(d['order_id'], d) for d in documents])
+
+        def put_batches():
+            for i in range(0, n, args.batch_size):
+                batched.put_many((d['order_id'], d) for d in documents[i:i + args.batch_size])
+        timed(f'sqlite put_many ({args.batch_size})', n, put_batches)
+
+        def put_grouped():
+            for i in range(0, n, args.batch_size):
+                with storage.batch():
+                    for d in documents[i:i + args.batch_size]:
+                        grouped.put(d['order_id'], d)
+        timed(f'sqlite batch() ({args.batch_size})', n, put_grouped)
+
+        timed('sqlite read', n, lambda: [single.get(k) for k in keys])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,39 @@
-from flask import Flask, jsonify, request, g
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pythonjsonlogger import jsonlogger
-import logging
+from flask import Response, jsonify, request, g
+from prometheus_client import Counter, Gauge
+import random
 import requests
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from cache import CachePolicy, ResponseCache, etag_matches
+from common import fastjson
+from common.bootstrap import create_service
+from common.events import HEARTBEAT
+from common.tracing import current_traceparent
+from ratelimit import ConcurrencyLimiter, client_ip, limiters_from_env, parse_rate_limits, rate_limiter_from_env, retry_after
+from eventhub import EventStream, hubs_from_env, parse_cursor
+from resilience import CLOSED, STATE_VALUES, breakers_from_env, is_failure, retry_budgets_from_env
+from tokens import TokenCache, authenticate
+from upstream import clients_from_env, forward_headers, passthrough_headers, stream_body
 
-app = Flask(__name__)
+SERVICE = create_service(__name__, 'api-gateway', latency_buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0], access_log=True, echo_request_id=True)
+app = SERVICE.app
 
-logger = logging.getLogger()
-logHandler = logging.StreamHandler()
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s')
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
-logger.setLevel(logging.INFO)
+logger = SERVICE.logger
 
-REQUEST_COUNT = Counter('api_gateway_requests_total', 'Total requests', ['method', 'endpoint', 'status_code'])
-REQUEST_LATENCY = Histogram('api_gateway_request_duration_seconds', 'Latency', ['method', 'endpoint'], buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0])
+REQUEST_METRICS = SERVICE.request_metrics
 UPSTREAM_REQUESTS = Counter('api_gateway_upstream_requests_total', 'Upstream requests', ['service', 'status'])
+TOKEN_CHECKS = Counter('api_gateway_token_checks_total', 'Local JWT verifications', ['result'])
+CACHE_REQUESTS = Counter('api_gateway_cache_requests_total', 'Response cache lookups', ['endpoint', 'result'])
+CACHE_HIT_RATIO = Gauge('api_gateway_cache_hit_ratio', 'Response cache hits / lookups since start')
+CACHE_BYTES = Gauge('api_gateway_cache_bytes', 'Bytes held by the response cache')
+CACHE_ENTRIES = Gauge('api_gateway_cache_entries', 'Responses held by the response cache')
+RATE_LIMITED = Counter('api_gateway_rate_limited_total', 'Requests rejected by the rate limiter', ['endpoint'])
+UPSTREAM_IN_FLIGHT = Gauge('api_gateway_upstream_in_flight', 'In-flight upstream calls in this process', ['service'])
+EVENT_STREAMS = Gauge('api_gateway_event_streams', 'Open client event streams')
+EVENT_STREAM_OVERFLOWS = Counter('api_gateway_event_stream_overflows_total', 'Event streams closed because the client fell behind')
+EVENT_STREAMS_REJECTED = Counter('api_gateway_event_streams_rejected_total', 'Event streams refused because this process holds EVENT_MAX_STREAMS')
+BREAKER_STATE = Gauge('api_gateway_circuit_breaker_state', 'Upstream circuit breaker state (0 closed, 1 half-open, 2 open)', ['service'])
 
 SERVICES = {
     'auth': os.getenv('AUTH_SERVICE_URL', 'http://auth-service'),
@@ -25,94 +41,325 @@ SERVICES = {
     'payment': os.getenv('PAYMENT_SERVICE_URL', 'http://payment-service'),
     'notification': os.getenv('NOTIFICATION_SERVICE_URL', 'http://notification-service')
 }
+UPSTREAMS = clients_from_env(SERVICES)
+TOKENS = TokenCache(os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production'), max_size=int(os.getenv('JWT_CACHE_SIZE', 10000)))
+TRACER = SERVICE.tracer
+FAN_OUT_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('FAN_OUT_WORKERS', 16)))
+GET_RETRIES = int(os.getenv('UPSTREAM_GET_RETRIES', 2))
+RETRY_BACKOFF = float(os.getenv('UPSTREAM_RETRY_BACKOFF_MS', 25)) / 1000
+HEDGE_DELAY = float(os.getenv('HEDGE_DELAY_MS', 100)) / 1000
+HEDGED_ENDPOINTS = set(filter(None, os.getenv('HEDGED_ROUTES', 'get_order,get_payment').split(',')))
+HEDGE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_WORKERS', 32)))
 
-@app.before_request
-def before_request():
-    g.start_time = time.time()
-    g.request_id = request.headers.get('X-Request-ID', str(time.time()))
-
-@app.after_request
-def after_request(response):
-    latency = time.time() - g.start_time
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.path, status_code=response.status_code).inc()
-    REQUEST_LATENCY.labels(method=request.method, endpoint=request.path).observe(latency)
-    logger.info('Request completed', extra={'request_id': g.request_id, 'method': request.method, 'path': request.path, 'status_code': response.status_code, 'latency_ms': round(latency * 1000, 2)})
-    response.headers['X-Request-ID'] = g.request_id
-    return response
+def breaker_changed(service_name, state):
+    BREAKER_STATE.labels(service=service_name).set(STATE_VALUES[state])
+    logger.warning('Circuit breaker state changed', extra={'service': service_name, 'state': state})
+
+BREAKERS = breakers_from_env(SERVICES, breaker_changed)
+RETRY_BUDGETS = retry_budgets_from_env(SERVICES)
+for name in SERVICES:
+    BREAKER_STATE.labels(service=name).set(0)
+
+# endpoint=tokens per second/burst, per caller (JWT user, else client IP); * applies to every other proxied route
+RATE_LIMITS = parse_rate_limits(os.getenv('RATE_LIMITS', 'login=1/10,register=0.2/5,create_order=5/20,create_orders_batch=0.5/5,*=50/100'))
+RATE_LIMITER = rate_limiter_from_env()
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+ADMISSION = limiters_from_env(SERVICES)
+for name, limiter in ADMISSION.items():
+    UPSTREAM_IN_FLIGHT.labels(service=name).set_function(lambda limiter=limiter: limiter.in_flight)
+
+CACHE = ResponseCache(max_bytes=int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)), max_entry_bytes=int(os.getenv('CACHE_MAX_ENTRY_BYTES', 1024 * 1024)))
+CACHE_TERMINAL_TTL = float(os.getenv('CACHE_TERMINAL_TTL', 300))
+CACHED_ROUTES = {
+    'get_order': CachePolicy(float(os.getenv('ORDER_CACHE_TTL', 1)), CACHE_TERMINAL_TTL, ('paid', 'payment_failed')),
+    'get_payment': CachePolicy(float(os.getenv('PAYMENT_CACHE_TTL', 1)), CACHE_TERMINAL_TTL, ('completed', 'failed')),
+}
+CACHE_HIT_RATIO.set_function(CACHE.hit_ratio)
+CACHE_BYTES.set_function(lambda: CACHE.bytes)
+CACHE_ENTRIES.set_function(lambda: len(CACHE.entries))
+
+EVENT_HUBS = hubs_from_env(SERVICES)
+EVENT_BUFFER_SIZE = int(os.getenv('EVENT_BUFFER_SIZE', 1000))
+EVENT_HEARTBEAT = float(os.getenv('EVENT_HEARTBEAT_SECONDS', 15))
+EVENT_STREAM_MAX = float(os.getenv('EVENT_STREAM_MAX_SECONDS', 300))
+# Each stream holds a worker thread here, so by default half of them stay free for other requests and health checks.
+EVENT_STREAM_SLOTS = ConcurrencyLimiter(int(os.getenv('EVENT_MAX_STREAMS', max(1, int(os.getenv('GUNICORN_THREADS', 4)) // 2))))
+
+ROOT_INFO = {'service': 'api-gateway', 'version': '1.0.0', 'endpoints': {'health': '/health', 'ready': '/ready', 'metrics': '/metrics', 'status': '/api/v1/status',
+              'auth': '/api/v1/auth/*', 'orders': '/api/v1/orders/*', 'payments': '/api/v1/payments/*', 'notifications': '/api/v1/notifications/*', 'events': '/api/v1/events'}}
+ROOT_BODY = fastjson.dumps(ROOT_INFO)
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'healthy', 'service': 'api-gateway', 'timestamp': time.time()})
+def prime_upstream(service_name):
+    # A /health round trip leaves a keep-alive connection in the upstream's pool, so the first proxied call skips the TCP handshake.
+    client = UPSTREAMS[service_name]
+    client.session.get(f'{client.base_url}/health', timeout=client.timeout).raise_for_status()
 
-@app.route('/ready', methods=['GET'])
-def ready():
-    return jsonify({'status': 'ready'})
+SERVICE.readiness.add_check('rate limit storage', RATE_LIMITER.storage.ping)
+for name in SERVICES:
+    SERVICE.readiness.add_warm_up(f'{name}-service', lambda name=name: prime_upstream(name))
 
-@app.route('/metrics', methods=['GET'])
-def metrics():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+def close_response(future):
+    if future.exception() is None:
+        future.result().close()
 
-def proxy_request(service_name, path, method='GET', data=None):
-    service_url = SERVICES.get(service_name)
-    if not service_url:
+def send_upstream(service_name, path, method, data, headers, hedge):
+    """Send one upstream call; with hedge, send a second copy if the first has not answered within HEDGE_DELAY and keep whichever answers first."""
+    client = UPSTREAMS[service_name]
+    if not hedge:
+        return client.request(method, path, data=data, headers=headers)
+    first = HEDGE_POOL.submit(client.request, method, path, data=data, headers=headers)
+    if wait([first], timeout=HEDGE_DELAY).done or not RETRY_BUDGETS[service_name].withdraw():
+        return first.result()
+    UPSTREAM_REQUESTS.labels(service=service_name, status='hedged').inc()
+    futures = [first, HEDGE_POOL.submit(client.request, method, path, data=data, headers=headers)]
+    for future in as_completed(futures):
+        if future.exception() is None:
+            for other in futures:
+                if other is not future:
+                    other.add_done_callback(close_response)
+            return future.result()
+    return first.result()
+
+def proxy_request(service_name, path, method='GET', data=None, hedge=False):
+    client = UPSTREAMS.get(service_name)
+    if not client:
         return jsonify({'error': f'Service {service_name} not found'}), 404
-    url = f"{service_url}{path}"
-    try:
-        if method == 'GET':
-            response = requests.get(url, timeout=10, headers={'X-Request-ID': g.request_id})
-        elif method == 'POST':
-            response = requests.post(url, json=data, timeout=10, headers={'X-Request-ID': g.request_id, 'Content-Type': 'application/json'})
-        UPSTREAM_REQUESTS.labels(service=service_name, status='success').inc()
-        return jsonify(response.json()), response.status_code
-    except requests.exceptions.Timeout:
-        UPSTREAM_REQUESTS.labels(service=service_name, status='timeout').inc()
-        return jsonify({'error': f'Service {service_name} timeout'}), 504
-    except requests.exceptions.ConnectionError:
-        UPSTREAM_REQUESTS.labels(service=service_name, status='connection_error').inc()
-        return jsonify({'error': f'Service {service_name} unavailable'}), 503
-    except Exception as e:
-        UPSTREAM_REQUESTS.labels(service=service_name, status='error').inc()
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/v1/auth/register', methods=['POST'])
-def register():
-    return proxy_request('auth', '/api/v1/register', 'POST', request.json)
-
-@app.route('/api/v1/auth/login', methods=['POST'])
-def login():
-    return proxy_request('auth', '/api/v1/login', 'POST', request.json)
+    breaker, budget = BREAKERS[service_name], RETRY_BUDGETS[service_name]
+    content_type = (request.content_type or 'application/json') if data is not None else None
+    with TRACER.span(f'call {service_name}', 'CLIENT', **{'http.method': method}) as span:
+        headers = forward_headers(request.headers, g.request_id, g.get('user_id'), content_type, span.traceparent)
+        budget.deposit()
+        attempts = 1 + (GET_RETRIES if method == 'GET' else 0)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                UPSTREAM_REQUESTS.labels(service=service_name, status='circuit_open').inc()
+                span.set_tag('upstream.status', 'circuit_open')
+                return jsonify({'error': f'Service {service_name} unavailable (circuit open)'}), 503, {'Retry-After': str(breaker.retry_after())}
+            status_code = None
+            try:
+                response = send_upstream(service_name, path, method, data, headers, hedge and breaker.state == CLOSED)
+            except requests.exceptions.Timeout:
+                status, error, code = 'timeout', f'Service {service_name} timeout', 504
+            except requests.exceptions.ConnectionError:
+                status, error, code = 'connection_error', f'Service {service_name} unavailable', 503
+            except Exception as e:
+                status, error, code = 'error', str(e), 500
+            else:
+                status_code = response.status_code
+                status = 'success' if status_code < 500 else 'server_error'
+            failed = is_failure(status_code)
+            breaker.record(not failed)
+            UPSTREAM_REQUESTS.labels(service=service_name, status=status).inc()
+            # Timeouts are not retried: a second full wait is what the breaker and hedging are there to avoid.
+            if status not in ('connection_error', 'server_error') or not failed or attempt == attempts - 1 or not budget.withdraw():
+                break
+            if status == 'server_error':
+                response.close()
+            UPSTREAM_REQUESTS.labels(service=service_name, status='retry').inc()
+            time.sleep(RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.0))
+        span.set_tag('upstream.status', status)
+        if status in ('success', 'server_error'):
+            return Response(stream_body(response), status=response.status_code, headers=passthrough_headers(response))
+        return jsonify({'error': error}), code
 
-@app.route('/api/v1/auth/validate', methods=['GET'])
-def validate_token():
-    return proxy_request('auth', '/api/v1/validate', 'GET')
+def fan_out(calls):
+    """Run several upstream GETs concurrently through each upstream's breaker; calls maps a result key to (service_name, path)."""
+    headers = {'X-Request-ID': g.request_id, 'traceparent': current_traceparent()}
+    def call(service_name, path):
+        breaker = BREAKERS[service_name]
+        if not breaker.allow():
+            UPSTREAM_REQUESTS.labels(service=service_name, status='circuit_open').inc()
+            return {'status_code': None, 'error': f'Service {service_name} unavailable (circuit open)', 'circuit': breaker.state}
+        status_code = None
+        try:
+            response = UPSTREAMS[service_name].request('GET', path, headers=headers)
+            body = response.content
+            status_code = response.status_code
+            result = {'status_code': status_code, 'body': fastjson.loads(body)}
+        except requests.exceptions.Timeout:
+            status, result = 'timeout', {'status_code': None, 'error': f'Service {service_name} timeout'}
+        except requests.exceptions.ConnectionError:
+            status, result = 'connection_error', {'status_code': None, 'error': f'Service {service_name} unavailable'}
+        except Exception as e:
+            status, result = 'error', {'status_code': status_code, 'error': str(e)}
+        else:
+            status = 'success' if status_code < 500 else 'server_error'
+        breaker.record(not is_failure(status_code))
+        UPSTREAM_REQUESTS.labels(service=service_name, status=status).inc()
+        result['circuit'] = breaker.state
+        return result
+    futures = {key: FAN_OUT_POOL.submit(call, service_name, path) for key, (service_name, path) in calls.items()}
+    return {key: future.result() for key, future in futures.items()}
+
+def check_token(auth_header):
+    """Verify the bearer token locally; returns (claims, None) or (None, error message)."""
+    claims, error = authenticate(TOKENS, auth_header)
+    TOKEN_CHECKS.labels(result='valid' if claims else 'rejected').inc()
+    return claims, error
+
+# (endpoint, rule, method, upstream service, upstream path template, requires a valid JWT) - shared with the ASGI app in asgi.py
+ROUTES = [
+    ('register', '/api/v1/auth/register', 'POST', 'auth', '/api/v1/register', False),
+    ('login', '/api/v1/auth/login', 'POST', 'auth', '/api/v1/login', False),
+    ('get_orders', '/api/v1/orders', 'GET', 'order', '/api/v1/orders', True),
+    ('create_order', '/api/v1/orders', 'POST', 'order', '/api/v1/orders', True),
+    ('create_orders_batch', '/api/v1/orders/batch', 'POST', 'order', '/api/v1/orders/batch', True),
+    ('get_order', '/api/v1/orders/<order_id>', 'GET', 'order', '/api/v1/orders/{order_id}', True),
+    ('process_payment', '/api/v1/payments', 'POST', 'payment', '/api/v1/payments', True),
+    ('get_payment', '/api/v1/payments/<payment_id>', 'GET', 'payment', '/api/v1/payments/{payment_id}', True),
+    ('send_notification', '/api/v1/notifications', 'POST', 'notification', '/api/v1/notifications', False),
+    ('send_notifications_bulk', '/api/v1/notifications/bulk', 'POST', 'notification', '/api/v1/notifications/bulk', False),
+]
 
-@app.route('/api/v1/orders', methods=['GET'])
-def get_orders():
-    return proxy_request('order', '/api/v1/orders', 'GET')
+def rate_limit_wait(endpoint, user_id, remote_addr, forwarded_for):
+    """Seconds until the caller may call `endpoint` again, or 0 if this request is within its budget."""
+    limit = RATE_LIMITS.get(endpoint) or RATE_LIMITS.get('*')
+    if not limit:
+        return 0
+    caller = f'user:{user_id}' if user_id else f'ip:{client_ip(remote_addr, forwarded_for, TRUSTED_PROXY_HOPS)}'
+    seconds = RATE_LIMITER.take(f'{endpoint}|{caller}', *limit)
+    if seconds:
+        RATE_LIMITED.labels(endpoint=endpoint).inc()
+    return seconds
 
-@app.route('/api/v1/orders', methods=['POST'])
-def create_order():
-    return proxy_request('order', '/api/v1/orders', 'POST', request.json)
+def rate_limited(seconds):
+    return jsonify({'error': 'Rate limit exceeded'}), 429, {'Retry-After': retry_after(seconds)}
 
-@app.route('/api/v1/orders/<order_id>', methods=['GET'])
-def get_order(order_id):
-    return proxy_request('order', f'/api/v1/orders/{order_id}', 'GET')
+def shed(service_name):
+    UPSTREAM_REQUESTS.labels(service=service_name, status='shed').inc()
+    return jsonify({'error': f'Service {service_name} overloaded'}), 503, {'Retry-After': '1'}
 
-@app.route('/api/v1/payments', methods=['POST'])
-def process_payment():
-    return proxy_request('payment', '/api/v1/payments', 'POST', request.json)
+def streams_full():
+    EVENT_STREAMS_REJECTED.inc()
+    return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': retry_after(EVENT_HEARTBEAT)}
 
-@app.route('/api/v1/payments/<payment_id>', methods=['GET'])
-def get_payment(payment_id):
-    return proxy_request('payment', f'/api/v1/payments/{payment_id}', 'GET')
+def cached_response(entry, result):
+    headers = {'ETag': entry.etag, 'X-Cache': result}
+    if etag_matches(request.headers.get('If-None-Match'), entry.etag):
+        return Response(status=304, headers=headers)
+    return Response(entry.body, status=entry.status, headers=[*entry.headers, *headers.items()])
+
+def invalidate_cache(path, response):
+    """A write drops the cached copies of the path it targeted and of the resource its response points at."""
+    CACHE.invalidate(path)
+    if response.headers.get('Location'):
+        CACHE.invalidate(response.headers['Location'])
+
+def proxy_view(endpoint, service_name, upstream_path, method, protected):
+    hedge = endpoint in HEDGED_ENDPOINTS
+    policy = CACHED_ROUTES.get(endpoint) if method == 'GET' else None
+    def view(**params):
+        if protected:
+            claims, error = check_token(request.headers.get('Authorization'))
+            if error:
+                return jsonify({'error': error}), 401
+            g.user_id = claims['user_id']
+        wait_seconds = rate_limit_wait(endpoint, g.get('user_id'), request.remote_addr, request.headers.get('X-Forwarded-For'))
+        if wait_seconds:
+            return rate_limited(wait_seconds)
+        data = request.get_data() if method == 'POST' else None
+        path = upstream_path.format(**params)
+        # Plain reads go through the cache; a long-poll can only be answered by an entry that will not change.
+        cacheable = policy is not None and set(request.args) <= {'wait'}
+        if cacheable:
+            entry = CACHE.get(path, g.get('user_id'), terminal_only='wait' in request.args)
+            CACHE_REQUESTS.labels(endpoint=endpoint, result='hit' if entry else 'miss').inc()
+            if entry:
+                return cached_response(entry, 'HIT')
+        query_path = f"{path}?{request.query_string.decode('latin-1')}" if request.query_string else path
+        # Long-polls are slow on purpose, so they are never hedged.
+        if not ADMISSION[service_name].acquire():
+            return shed(service_name)
+        try:
+            response = proxy_request(service_name, query_path, method, data, hedge and 'wait' not in request.args)
+        finally:
+            ADMISSION[service_name].release()
+        if not isinstance(response, Response):
+            return response
+        if method != 'GET' and response.status_code < 500:
+            invalidate_cache(path, response)
+        if cacheable and response.status_code == 200:
+            entry = policy.entry(response.status_code, response.headers.items(), response.get_data())
+            CACHE.put(path, g.get('user_id'), entry)
+            return cached_response(entry, 'MISS')
+        return response
+    return view
+
+for endpoint, rule, method, service_name, upstream_path, protected in ROUTES:
+    app.add_url_rule(rule, endpoint, proxy_view(endpoint, service_name, upstream_path, method, protected), methods=[method])
+
+def event_stream_start(endpoint):
+    """(cursor, None) for an events request, or (None, error response) if it is unauthorised, rate limited or has a bad Last-Event-ID."""
+    claims, error = check_token(request.headers.get('Authorization'))
+    if error:
+        return None, (jsonify({'error': error}), 401)
+    wait_seconds = rate_limit_wait(endpoint, claims['user_id'], request.remote_addr, request.headers.get('X-Forwarded-For'))
+    if wait_seconds:
+        return None, rate_limited(wait_seconds)
+    try:
+        return parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('last_event_id')), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+def relay_events(cursor):
+    # Holds a worker thread for the life of the stream; the async mode (asgi.py) holds streams on the event loop instead.
+    deadline = time.monotonic() + EVENT_STREAM_MAX
+    stream = EventStream(EVENT_HUBS, cursor, EVENT_BUFFER_SIZE)
+    EVENT_STREAMS.inc()
+    try:
+        yield 'retry: 1000\n\n'
+        for name, hub in EVENT_HUBS.items():
+            while stream.replay_from(name) is not None:
+                try:
+                    events = hub.backlog_page(stream.replay_from(name), stream.logs[name])
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f'Event backlog from {name} unavailable: {str(e)}')
+                    return
+                if not events:
+                    break
+                yield stream.accept(name, events)
+        while time.monotonic() < deadline:
+            if stream.subscriber.overflowed:
+                EVENT_STREAM_OVERFLOWS.inc()
+                return
+            if not stream.subscriber.ready.wait(EVENT_HEARTBEAT):
+                yield HEARTBEAT
+                continue
+            chunk = stream.accept_live()
+            if chunk:
+                yield chunk
+    finally:
+        stream.close()
+        EVENT_STREAMS.dec()
+
+@app.route('/api/v1/events', methods=['GET'])
+def events():
+    cursor, error = event_stream_start('events')
+    if error:
+        return error
+    if not EVENT_STREAM_SLOTS.acquire(blocking=False):
+        return streams_full()
+    response = Response(relay_events(cursor), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The WSGI server closes the response however the stream ends, even if it never started.
+    response.call_on_close(EVENT_STREAM_SLOTS.release)
+    return response
+
+@app.route('/api/v1/auth/validate', methods=['GET'])
+def validate_token():
+    claims, error = check_token(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'valid': False, 'error': error}), 401
+    return jsonify({'valid': True, 'user_id': claims['user_id'], 'email': claims['email']})
 
-@app.route('/api/v1/notifications', methods=['POST'])
-def send_notification():
-    return proxy_request('notification', '/api/v1/notifications', 'POST', request.json)
+@app.route('/api/v1/status', methods=['GET'])
+def status():
+    results = fan_out({name: (name, '/health') for name in SERVICES})
+    healthy = all(result['status_code'] == 200 for result in results.values())
+    return jsonify({'status': 'healthy' if healthy else 'degraded', 'services': results}), 200 if healthy else 503
 
 @app.route('/', methods=['GET'])
 def root():
-    return jsonify({'service': 'api-gateway', 'version': '1.0.0', 'endpoints': {'health': '/health', 'ready': '/ready', 'metrics': '/metrics', 'auth': '/api/v1/auth/*', 'orders': '/api/v1/orders/*', 'payments': '/api/v1/payments/*', 'notifications': '/api/v1/notifications/*'}})
+    return app.response_class(ROOT_BODY, mimetype='application/json')
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
@@ -0,0 +1,357 @@
+"""Asyncio serving mode for the API gateway.
+
+Serves the same routes as the Flask app in app.py, but on Quart with pooled httpx clients so a single
+worker can hold thousands of in-flight upstream calls:
+
+    hypercorn --bind 0.0.0.0:8080 --workers 2 asgi:app
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+
+import httpx
+import requests
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from quart import Quart, Response, jsonify, request, g
+
+from app import (ADMISSION, BREAKERS, CACHE, CACHE_REQUESTS, CACHED_ROUTES, EVENT_BUFFER_SIZE, EVENT_HEARTBEAT, EVENT_HUBS, EVENT_STREAM_MAX, EVENT_STREAM_OVERFLOWS,
+                 EVENT_STREAMS, EVENT_STREAMS_REJECTED, GET_RETRIES, HEDGE_DELAY, HEDGED_ENDPOINTS, REQUEST_METRICS, RETRY_BACKOFF, RETRY_BUDGETS, TRACER, UPSTREAM_REQUESTS, ROUTES,
+                 RATE_LIMITER, ROOT_BODY, SERVICE, SERVICES, check_token, invalidate_cache, logger, rate_limit_wait)
+from cache import etag_matches
+from common import fastjson
+from common.bootstrap import JSONProvider, health_body, health_prefix, readiness_from_env
+from common.events import HEARTBEAT
+from common.instrumentation import instrument_async
+from common.tracing import current_traceparent, trace_requests_async
+from eventhub import EventStream, parse_cursor
+from ratelimit import ConcurrencyLimiter, retry_after
+from resilience import CLOSED, is_failure
+from upstream import HOP_BY_HOP_HEADERS, forward_headers, upstream_settings
+
+app = Quart(__name__)
+app.json = JSONProvider(app)
+
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_UPSTREAM_POOL_SIZE', 1000))
+# An idle stream here is a suspended coroutine rather than a thread, so the default cap is much higher than in app.py.
+EVENT_STREAM_SLOTS = ConcurrencyLimiter(int(os.getenv('EVENT_MAX_STREAMS', 1000)))
+UPSTREAMS = {}
+HEALTH_PREFIX = health_prefix('api-gateway')
+READINESS = readiness_from_env(SERVICE.readiness.duration_gauge)
+READINESS.add_check('rate limit storage', RATE_LIMITER.storage.ping)
+instrument_async(app, REQUEST_METRICS)
+trace_requests_async(app, TRACER)
+
+
+def prime_upstream(name, loop):
+    # Runs on the warm-up thread; the call goes out on the serving loop so it leaves a connection in that loop's pool.
+    asyncio.run_coroutine_threadsafe(UPSTREAMS[name].get('/health'), loop).result().raise_for_status()
+
+
+@app.before_serving
+async def open_upstreams():
+    # httpx clients bind to the running event loop, so they are created per worker once serving starts.
+    for name, url in SERVICES.items():
+        _, connect_timeout, read_timeout = upstream_settings(name)
+        UPSTREAMS[name] = httpx.AsyncClient(
+            base_url=url,
+            limits=httpx.Limits(max_connections=ASYNC_POOL_SIZE, max_keepalive_connections=min(ASYNC_POOL_SIZE, 100)),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+    loop = asyncio.get_running_loop()
+    for name in SERVICES:
+        READINESS.add_warm_up(f'{name}-service', lambda name=name: prime_upstream(name, loop))
+    READINESS.start()
+
+
+@app.after_serving
+async def close_upstreams():
+    await asyncio.gather(*(client.aclose() for client in UPSTREAMS.values()))
+    UPSTREAMS.clear()
+
+
+@app.before_request
+async def before_request():
+    g.request_id = request.headers.get('X-Request-ID') or str(uuid.uuid4())
+
+
+@app.after_request
+async def after_request(response):
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+@app.route('/health', methods=['GET'])
+async def health():
+    return Response(health_body(HEALTH_PREFIX), mimetype='application/json')
+
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    status, body = READINESS.response()
+    return Response(body, status, mimetype='application/json')
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+async def stream_body(response):
+    try:
+        async for chunk in response.aiter_raw():
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+def discard(task):
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+async def send_upstream(service_name, path, method, data, headers, hedge):
+    """Async counterpart of app.send_upstream(); the losing hedge is cancelled rather than left to finish."""
+    client = UPSTREAMS[service_name]
+
+    def send():
+        return client.send(client.build_request(method, path, content=data, headers=headers), stream=True)
+    if not hedge:
+        return await send()
+    first = asyncio.ensure_future(send())
+    done, _ = await asyncio.wait({first}, timeout=HEDGE_DELAY)
+    if done or not RETRY_BUDGETS[service_name].withdraw():
+        return await first
+    UPSTREAM_REQUESTS.labels(service=service_name, status='hedged').inc()
+    tasks = [first, asyncio.ensure_future(send())]
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        winner = next((task for task in done if task.exception() is None), None)
+        if winner:
+            for task in tasks:
+                if task is not winner:
+                    discard(task)
+            return winner.result()
+    return await first
+
+
+async def proxy_request(service_name, path, method='GET', data=None, hedge=False):
+    if service_name not in UPSTREAMS:
+        return jsonify({'error': f'Service {service_name} not found'}), 404
+    breaker, budget = BREAKERS[service_name], RETRY_BUDGETS[service_name]
+    content_type = (request.content_type or 'application/json') if data is not None else None
+    with TRACER.span(f'call {service_name}', 'CLIENT', **{'http.method': method}) as span:
+        headers = forward_headers(request.headers, g.request_id, g.get('user_id'), content_type, span.traceparent)
+        budget.deposit()
+        attempts = 1 + (GET_RETRIES if method == 'GET' else 0)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                UPSTREAM_REQUESTS.labels(service=service_name, status='circuit_open').inc()
+                span.set_tag('upstream.status', 'circuit_open')
+                return jsonify({'error': f'Service {service_name} unavailable (circuit open)'}), 503, {'Retry-After': str(breaker.retry_after())}
+            status_code = None
+            try:
+                response = await send_upstream(service_name, path, method, data, headers, hedge and breaker.state == CLOSED)
+            except httpx.TimeoutException:
+                status, error, code = 'timeout', f'Service {service_name} timeout', 504
+            except httpx.TransportError:
+                status, error, code = 'connection_error', f'Service {service_name} unavailable', 503
+            except Exception as e:
+                status, error, code = 'error', str(e), 500
+            else:
+                status_code = response.status_code
+                status = 'success' if status_code < 500 else 'server_error'
+            failed = is_failure(status_code)
+            breaker.record(not failed)
+            UPSTREAM_REQUESTS.labels(service=service_name, status=status).inc()
+            if status not in ('connection_error', 'server_error') or not failed or attempt == attempts - 1 or not budget.withdraw():
+                break
+            if status == 'server_error':
+                await response.aclose()
+            UPSTREAM_REQUESTS.labels(service=service_name, status='retry').inc()
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.0))
+        span.set_tag('upstream.status', status)
+        if status in ('success', 'server_error'):
+            headers = [(k, v) for k, v in response.headers.multi_items() if k.lower() not in HOP_BY_HOP_HEADERS]
+            return Response(stream_body(response), status=response.status_code, headers=headers)
+        return jsonify({'error': error}), code
+
+
+async def fan_out(calls):
+    """Run several upstream GETs concurrently through each upstream's breaker; calls maps a result key to (service_name, path)."""
+    headers = {'X-Request-ID': g.request_id, 'traceparent': current_traceparent()}
+
+    async def call(service_name, path):
+        breaker = BREAKERS[service_name]
+        if not breaker.allow():
+            UPSTREAM_REQUESTS.labels(service=service_name, status='circuit_open').inc()
+            return {'status_code': None, 'error': f'Service {service_name} unavailable (circuit open)', 'circuit': breaker.state}
+        status_code = None
+        try:
+            response = await UPSTREAMS[service_name].get(path, headers=headers)
+            status_code = response.status_code
+            result = {'status_code': status_code, 'body': fastjson.loads(response.content)}
+        except httpx.TimeoutException:
+            status, result = 'timeout', {'status_code': None, 'error': f'Service {service_name} timeout'}
+        except httpx.TransportError:
+            status, result = 'connection_error', {'status_code': None, 'error': f'Service {service_name} unavailable'}
+        except Exception as e:
+            status, result = 'error', {'status_code': status_code, 'error': str(e)}
+        else:
+            status = 'success' if status_code < 500 else 'server_error'
+        breaker.record(not is_failure(status_code))
+        UPSTREAM_REQUESTS.labels(service=service_name, status=status).inc()
+        result['circuit'] = breaker.state
+        return result
+    results = await asyncio.gather(*(call(service_name, path) for service_name, path in calls.values()))
+    return dict(zip(calls, results))
+
+
+def cached_response(entry, result):
+    headers = {'ETag': entry.etag, 'X-Cache': result}
+    if etag_matches(request.headers.get('If-None-Match'), entry.etag):
+        return Response(b'', status=304, headers=headers)
+    return Response(entry.body, status=entry.status, headers=[*entry.headers, *headers.items()])
+
+
+def proxy_view(endpoint, service_name, upstream_path, method, protected):
+    hedge = endpoint in HEDGED_ENDPOINTS
+    policy = CACHED_ROUTES.get(endpoint) if method == 'GET' else None
+
+    async def view(**params):
+        if protected:
+            claims, error = check_token(request.headers.get('Authorization'))
+            if error:
+                return jsonify({'error': error}), 401
+            g.user_id = claims['user_id']
+        # Bucket storage is SQLite (blocking, with its periodic purge), so it runs off the event loop.
+        wait_seconds = await asyncio.to_thread(rate_limit_wait, endpoint, g.get('user_id'), request.remote_addr, request.headers.get('X-Forwarded-For'))
+        if wait_seconds:
+            return jsonify({'error': 'Rate limit exceeded'}), 429, {'Retry-After': retry_after(wait_seconds)}
+        data = await request.get_data() if method == 'POST' else None
+        path = upstream_path.format(**params)
+        cacheable = policy is not None and set(request.args) <= {'wait'}
+        if cacheable:
+            entry = CACHE.get(path, g.get('user_id'), terminal_only='wait' in request.args)
+            CACHE_REQUESTS.labels(endpoint=endpoint, result='hit' if entry else 'miss').inc()
+            if entry:
+                return cached_response(entry, 'HIT')
+        query_path = f"{path}?{request.query_string.decode('latin-1')}" if request.query_string else path
+        # The event loop must not block on a slot, so a full upstream sheds at once instead of waiting ADMISSION_WAIT_MS.
+        if not ADMISSION[service_name].acquire(blocking=False):
+            UPSTREAM_REQUESTS.labels(service=service_name, status='shed').inc()
+            return jsonify({'error': f'Service {service_name} overloaded'}), 503, {'Retry-After': '1'}
+        try:
+            response = await proxy_request(service_name, query_path, method, data, hedge and 'wait' not in request.args)
+        finally:
+            ADMISSION[service_name].release()
+        if not isinstance(response, Response):
+            return response
+        if method != 'GET' and response.status_code < 500:
+            invalidate_cache(path, response)
+        if cacheable and response.status_code == 200:
+            entry = policy.entry(response.status_code, response.headers.items(), await response.get_data())
+            CACHE.put(path, g.get('user_id'), entry)
+            return cached_response(entry, 'MISS')
+        return response
+    return view
+
+
+for endpoint, rule, method, service_name, upstream_path, protected in ROUTES:
+    app.add_url_rule(rule, endpoint, proxy_view(endpoint, service_name, upstream_path, method, protected), methods=[method])
+
+
+async def relay_events(cursor):
+    """An idle stream costs one suspended coroutine and its buffer; the hubs' reader threads wake it with call_soon_threadsafe."""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    deadline = time.monotonic() + EVENT_STREAM_MAX
+    # The slot is taken once the body starts, since a generator that never starts never runs its finally.
+    if not EVENT_STREAM_SLOTS.acquire(blocking=False):
+        return
+    try:
+        stream = await asyncio.to_thread(EventStream, EVENT_HUBS, cursor, EVENT_BUFFER_SIZE, lambda: loop.call_soon_threadsafe(ready.set))
+    except BaseException:
+        EVENT_STREAM_SLOTS.release()
+        raise
+    EVENT_STREAMS.inc()
+    try:
+        yield b'retry: 1000\n\n'
+        for name, hub in EVENT_HUBS.items():
+            while stream.replay_from(name) is not None:
+                try:
+                    events = await asyncio.to_thread(hub.backlog_page, stream.replay_from(name), stream.logs[name])
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f'Event backlog from {name} unavailable: {str(e)}')
+                    return
+                if not events:
+                    break
+                yield stream.accept(name, events).encode()
+        while time.monotonic() < deadline:
+            if stream.subscriber.overflowed:
+                EVENT_STREAM_OVERFLOWS.inc()
+                return
+            try:
+                await asyncio.wait_for(ready.wait(), EVENT_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT.encode()
+                continue
+            ready.clear()
+            chunk = stream.accept_live()
+            if chunk:
+                yield chunk.encode()
+    finally:
+        stream.close()
+        EVENT_STREAMS.dec()
+        EVENT_STREAM_SLOTS.release()
+
+
+@app.route('/api/v1/events', methods=['GET'])
+async def events():
+    claims, error = check_token(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': error}), 401
+    wait_seconds = await asyncio.to_thread(rate_limit_wait, 'events', claims['user_id'], request.remote_addr, request.headers.get('X-Forwarded-For'))
+    if wait_seconds:
+        return jsonify({'error': 'Rate limit exceeded'}), 429, {'Retry-After': retry_after(wait_seconds)}
+    try:
+        cursor = parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if EVENT_STREAM_SLOTS.in_flight >= EVENT_STREAM_SLOTS.limit:
+        EVENT_STREAMS_REJECTED.inc()
+        return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': retry_after(EVENT_HEARTBEAT)}
+    response = Response(relay_events(cursor), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Quart cuts responses off after RESPONSE_TIMEOUT (60 s by default); the stream ends itself after EVENT_STREAM_MAX_SECONDS.
+    response.timeout = None
+    return response
+
+
+@app.route('/api/v1/auth/validate', methods=['GET'])
+async def validate_token():
+    claims, error = check_token(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'valid': False, 'error': error}), 401
+    return jsonify({'valid': True, 'user_id': claims['user_id'], 'email': claims['email']})
+
+
+@app.route('/api/v1/status', methods=['GET'])
+async def status():
+    results = await fan_out({name: (name, '/health') for name in SERVICES})
+    healthy = all(result['status_code'] == 200 for result in results.values())
+    return jsonify({'status': 'healthy' if healthy else 'degraded', 'services': results}), 200 if healthy else 503
+
+
+@app.route('/', methods=['GET'])
+async def root():
+    return Response(ROOT_BODY, mimetype='application/json')
+
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 8080))
+    logger.info(f'Starting API Gateway (asyncio) on port {port}')
+    app.run(host='0.0.0.0', port=port)
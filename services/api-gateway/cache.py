@@ -0,0 +1,117 @@
+"""In-memory response cache for read-heavy gateway GETs.
+
+Entries are keyed by upstream path and caller, evicted least-recently-used once the cached bodies
+exceed `max_bytes`, and expire after a per-route TTL. Records that reached a terminal state (a paid
+order, a completed payment) never change again, so they get a much longer TTL.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from common import fastjson
+
+ENTRY_OVERHEAD = 256
+UNCACHED_HEADERS = frozenset(['content-length', 'date', 'etag'])
+
+
+class CacheEntry:
+    __slots__ = ('status', 'headers', 'body', 'etag', 'expires_at', 'terminal', 'size')
+
+    def __init__(self, status, headers, body, ttl, terminal):
+        self.status = status
+        self.headers = [(k, v) for k, v in headers if k.lower() not in UNCACHED_HEADERS]
+        self.body = body
+        self.etag = make_etag(body)
+        self.expires_at = time.monotonic() + ttl
+        self.terminal = terminal
+        self.size = len(body) + sum(len(k) + len(v) for k, v in self.headers) + ENTRY_OVERHEAD
+
+
+class CachePolicy:
+    """How long one route's responses stay cached; `terminal_statuses` are body statuses that get `terminal_ttl`."""
+
+    def __init__(self, ttl, terminal_ttl, terminal_statuses=()):
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self.terminal_statuses = frozenset(terminal_statuses)
+
+    def is_terminal(self, body):
+        try:
+            return fastjson.loads(body).get('status') in self.terminal_statuses
+        except (ValueError, AttributeError):
+            return False
+
+    def entry(self, status, headers, body):
+        terminal = self.is_terminal(body)
+        return CacheEntry(status, headers, body, self.terminal_ttl if terminal else self.ttl, terminal)
+
+
+def make_etag(body):
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.callers = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, caller, terminal_only=False):
+        """Fresh entry for (path, caller), or None; with terminal_only, entries that may still change count as misses."""
+        with self.lock:
+            entry = self.entries.get((path, caller))
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self.remove((path, caller))
+                entry = None
+            if entry is None or (terminal_only and not entry.terminal):
+                self.misses += 1
+                return None
+            self.entries.move_to_end((path, caller))
+            self.hits += 1
+            return entry
+
+    def put(self, path, caller, entry):
+        if entry.size > self.max_entry_bytes or entry.size > self.max_bytes:
+            return
+        with self.lock:
+            key = (path, caller)
+            self.remove(key)
+            self.entries[key] = entry
+            self.callers.setdefault(path, set()).add(caller)
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def invalidate(self, path):
+        """Drop every caller's entry for path."""
+        with self.lock:
+            for caller in list(self.callers.get(path, ())):
+                self.remove((path, caller))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        path, caller = key
+        callers = self.callers[path]
+        callers.discard(caller)
+        if not callers:
+            del self.callers[path]
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,174 @@
+"""Fan-in of the services' event streams for the gateway's GET /api/v1/events.
+
+Each gateway process polls every service's event log (`/api/v1/events?format=json&after=`) on one
+background thread per service, however many clients are connected, and pushes the events into bounded
+per-client buffers. Polling short requests, rather than holding an SSE stream open to each service,
+keeps every gateway worker from pinning a thread in every service.
+The event id sent to clients is a vector of per-service positions (`order@3f9a1c2e4b5d:12,payment@...:40`),
+each a sequence number qualified by the id of the event log it counts in, so a client reconnecting with
+Last-Event-ID first gets what it missed from each service's event log (`/api/v1/events?format=json`) and
+then the live events. A client whose buffer overflows is disconnected and resumes the same way. A
+position in a log other than the one the service serves now (another replica, a replaced volume)
+cannot be resumed, so that service starts live for the client.
+"""
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from common import fastjson
+from common.background import PerProcess
+from common.events import Broadcaster, Subscriber, format_sse
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cursor(value):
+    """{service: (log_id or None, seq)} from a Last-Event-ID such as 'order@3f9a1c2e4b5d:12,payment:40'; raises ValueError."""
+    cursor = {}
+    for part in filter(None, (value or '').split(',')):
+        source, _, seq = part.partition(':')
+        name, _, log_id = source.partition('@')
+        if not seq.isdigit():
+            raise ValueError('Last-Event-ID must look like order@3f9a1c2e4b5d:12,payment@8d2e0b7c6a1f:40')
+        cursor[name] = (log_id or None, int(seq))
+    return cursor
+
+
+def format_cursor(cursor, logs):
+    return ','.join(f'{name}@{logs[name]}:{seq}' if logs.get(name) else f'{name}:{seq}' for name, seq in sorted(cursor.items()))
+
+
+class UpstreamEvents:
+    def __init__(self, name, base_url, connect_timeout=2.0, read_timeout=10.0, poll_interval=0.25, retry=1.0, page_size=500):
+        self.name = name
+        self.url = f"{base_url.rstrip('/')}/api/v1/events"
+        self.timeout = (connect_timeout, read_timeout)
+        self.poll_interval = poll_interval
+        self.retry = retry
+        self.page_size = page_size
+        self.session = requests.Session()
+        self.session.trust_env = False
+        self.broadcaster = Broadcaster()
+        self.last_seq = None
+        self.log_id = None
+        self.positioned = threading.Event()
+        self.started = PerProcess(self.start_reader)
+
+    def start(self):
+        self.started.ensure()
+
+    def start_reader(self):
+        self.broadcaster = Broadcaster()
+        threading.Thread(target=self.read_forever, name=f'events-{self.name}', daemon=True).start()
+
+    def read_forever(self):
+        while True:
+            try:
+                caught_up = self.poll()
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                logger.warning(f'Event poll of {self.name} failed: {str(e)}')
+                time.sleep(self.retry)
+                continue
+            if caught_up:
+                time.sleep(self.poll_interval)
+
+    def poll(self):
+        """Broadcast the next page of the service's events; returns True once there is nothing more to read."""
+        if self.last_seq is None:
+            position = self.page(limit=1)
+            with self.broadcaster.lock:
+                self.last_seq, self.log_id = position['latest_seq'], position.get('log_id')
+            self.positioned.set()
+        page = self.page(after=self.last_seq, limit=self.page_size)
+        if page.get('log_id') != self.log_id:
+            self.switch_log(page.get('log_id'))
+            return False
+        events = page['events']
+        if events:
+            with self.broadcaster.lock:
+                self.broadcaster.broadcast([(self.name, event) for event in events])
+                self.last_seq = events[-1]['seq']
+        return len(events) < self.page_size
+
+    def page(self, **params):
+        response = self.session.get(self.url, params={'format': 'json', **params}, timeout=self.timeout)
+        response.raise_for_status()
+        return fastjson.loads(response.content)
+
+    def switch_log(self, log_id):
+        # The poll reached a different event log (another replica, or a new volume), where our sequence numbers mean
+        # nothing: re-position on it, and end the open streams so their clients resume with ids from the new log.
+        logger.warning(f'Event log of {self.name} changed from {self.log_id} to {log_id}, repositioning')
+        with self.broadcaster.lock:
+            self.last_seq, self.log_id = None, None
+            for subscriber in self.broadcaster.subscribers:
+                subscriber.disconnect()
+
+    def subscribe(self, subscriber):
+        """Add a subscriber; returns the event log id and last sequence number broadcast before it joined (None if the service has not answered yet)."""
+        self.start()
+        # The first stream in a process waits briefly for the reader to learn the service's position, so its ids cover every service.
+        self.positioned.wait(self.timeout[0])
+        with self.broadcaster.lock:
+            self.broadcaster.add(subscriber)
+            return self.log_id, self.last_seq
+
+    def unsubscribe(self, subscriber):
+        self.broadcaster.remove(subscriber)
+
+    def backlog_page(self, after, log_id=None):
+        """The events after `after` in event log `log_id`; empty if the service now serves another log."""
+        page = self.page(after=after, limit=self.page_size)
+        if log_id is not None and page.get('log_id') != log_id:
+            return []
+        return page['events']
+
+
+class EventStream:
+    """One client's merged stream: each service's backlog after the client's cursor, then the live events."""
+
+    def __init__(self, hubs, cursor, buffer_size, wake=None):
+        self.hubs = hubs
+        self.subscriber = Subscriber(buffer_size, wake)
+        positions = {name: hub.subscribe(self.subscriber) for name, hub in hubs.items()}
+        self.logs = {name: log_id for name, (log_id, _) in positions.items()}
+        self.live_from = {name: live_from for name, (_, live_from) in positions.items()}
+        # A position in another log is dropped, so that service starts live.
+        self.cursor = {name: seq for name, (log_id, seq) in cursor.items()
+                       if name in hubs and (log_id is None or self.logs[name] is None or log_id == self.logs[name])}
+        # A service missing from the cursor starts live, and its position goes into every id sent from now on.
+        for name, live_from in self.live_from.items():
+            if name not in self.cursor and live_from is not None:
+                self.cursor[name] = live_from
+
+    def replay_from(self, name):
+        """The sequence number to fetch the next backlog page after, or None once `name` has caught up with the live stream."""
+        after, live_from = self.cursor.get(name), self.live_from[name]
+        return after if after is not None and (live_from is None or after < live_from) else None
+
+    def accept(self, name, events):
+        """SSE text for the events not yet sent to this client, advancing its cursor."""
+        chunks = []
+        for event in events:
+            if event['seq'] is None or event['seq'] <= self.cursor.get(name, -1):
+                continue
+            self.cursor[name] = event['seq']
+            chunks.append(format_sse(format_cursor(self.cursor, self.logs), event['type'], event['data']))
+        return ''.join(chunks)
+
+    def accept_live(self):
+        return ''.join(self.accept(name, [event]) for name, event in self.subscriber.drain())
+
+    def close(self):
+        for hub in self.hubs.values():
+            hub.unsubscribe(self.subscriber)
+
+
+def hubs_from_env(services):
+    names = filter(None, os.getenv('EVENT_SOURCES', 'order,payment,notification').split(','))
+    read_timeout = float(os.getenv('EVENT_UPSTREAM_READ_TIMEOUT', 10))
+    poll_interval = float(os.getenv('EVENT_POLL_INTERVAL_MS', 250)) / 1000
+    return {name: UpstreamEvents(name, services[name], read_timeout=read_timeout, poll_interval=poll_interval) for name in names}
@@ -0,0 +1,95 @@
+"""Gateway load protection: per-caller token buckets and per-upstream concurrency limits.
+
+Token buckets live in a common.storage Storage so every gunicorn worker on the pod draws from the same
+bucket. The default is SQLite on tmpfs (/dev/shm), where taking a token is one short BEGIN IMMEDIATE
+transaction; `RATE_LIMIT_STORAGE_URL=memory://` keeps per-process buckets instead.
+"""
+import math
+import os
+import threading
+import time
+
+from common.background import Periodic, purge_expired
+from common.storage import open_storage
+
+
+class TokenBuckets:
+    def __init__(self, storage, purge_interval=60):
+        self.storage = storage
+        self.buckets = storage.repository('rate_limit_buckets', fields=('full_at',))
+        self.lock = threading.Lock()
+        self.purger = Periodic('rate-limit-purge', self.purge, purge_interval)
+
+    def take(self, key, rate, burst, cost=1):
+        """Spend `cost` tokens from the bucket; returns 0 if allowed, else the seconds until enough tokens accrue."""
+        self.purger.ensure()
+        now = time.time()
+        with self.lock, self.storage.batch():
+            bucket = self.buckets.get(key)
+            tokens = burst if bucket is None else min(burst, bucket['tokens'] + (now - bucket['updated']) * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            tokens -= cost
+            self.buckets.put(key, {'key': key, 'tokens': tokens, 'updated': now, 'full_at': now + (burst - tokens) / rate})
+        return 0
+
+    def purge(self):
+        # A bucket that has refilled completely is the same as no bucket, so it can be dropped.
+        purge_expired(self.buckets, 'full_at', {'full_at': (None, time.time())},
+                      lambda bucket: self.buckets.delete_if(bucket['key'], full_at=bucket['full_at']))
+
+
+def parse_rate_limits(spec):
+    """Parse 'login=2/10,*=50/100' (endpoint=tokens per second/burst; * is the default) into {endpoint: (rate, burst)}."""
+    limits = {}
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, _, limit = part.partition('=')
+        rate, _, burst = limit.partition('/')
+        limits[endpoint.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+def client_ip(remote_addr, forwarded_for, trusted_hops=0):
+    """The caller's address: remote_addr, or the X-Forwarded-For entry added by the outermost of `trusted_hops` proxies."""
+    if trusted_hops and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',')]
+        return hops[max(len(hops) - trusted_hops, 0)]
+    return remote_addr or 'unknown'
+
+
+def retry_after(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+
+class ConcurrencyLimiter:
+    """Caps this process's in-flight calls to one upstream (or its open event streams); a caller that gets no slot within `wait` seconds is shed."""
+
+    def __init__(self, limit, wait=0.0):
+        self.limit = limit
+        self.wait = wait
+        self.slots = threading.BoundedSemaphore(limit)
+        self.count_lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self, blocking=True):
+        if not (self.slots.acquire(timeout=self.wait) if blocking and self.wait > 0 else self.slots.acquire(blocking=False)):
+            return False
+        with self.count_lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self.count_lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+
+def rate_limiter_from_env():
+    default_url = 'sqlite:////dev/shm/api-gateway-ratelimit.db' if os.path.isdir('/dev/shm') else 'memory://'
+    return TokenBuckets(open_storage('api-gateway', os.getenv('RATE_LIMIT_STORAGE_URL', default_url)))
+
+
+def limiters_from_env(services):
+    wait = float(os.getenv('ADMISSION_WAIT_MS', 50)) / 1000
+    return {name: ConcurrencyLimiter(int(os.getenv(f'{name.upper()}_SERVICE_MAX_IN_FLIGHT', os.getenv('UPSTREAM_MAX_IN_FLIGHT', 100))), wait)
+            for name in services}
@@ -0,0 +1,127 @@
+"""Per-upstream failure handling for the gateway: circuit breakers and retry budgets.
+
+Both are plain thread-safe objects shared by the WSGI (app.py) and ASGI (asgi.py) proxies.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+# Statuses that mean the upstream itself is unavailable; any other response (even a 500 a bad request body caused) is an answer.
+UNAVAILABLE_STATUSES = frozenset((502, 503, 504))
+
+
+def is_failure(status_code):
+    """Whether a call counts against the breaker: no response at all (connection error, timeout) or an unavailable status."""
+    return status_code is None or status_code in UNAVAILABLE_STATUSES
+
+
+class CircuitBreaker:
+    """Opens after too many failures (see is_failure) in a sliding window of recent calls.
+
+    While open, calls fail fast. After `open_seconds` the breaker lets up to `half_open_probes`
+    calls through: if they all succeed it closes again, and any failure re-opens it.
+    """
+
+    def __init__(self, name, window=20, min_calls=10, failure_ratio=0.5, open_seconds=10.0, half_open_probes=3, on_state_change=None):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.on_state_change = on_state_change
+        self.outcomes = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+
+    def transition(self, state):
+        self.state = state
+        self.outcomes.clear()
+        self.probes_in_flight = self.probe_successes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if self.on_state_change:
+            self.on_state_change(self.name, state)
+
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self.transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def record(self, success):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight -= 1
+                if not success:
+                    self.transition(OPEN)
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= self.half_open_probes:
+                        self.transition(CLOSED)
+                return
+            if self.state == OPEN:
+                return
+            self.outcomes.append(success)
+            if len(self.outcomes) >= self.min_calls and self.outcomes.count(False) / len(self.outcomes) >= self.failure_ratio:
+                self.transition(OPEN)
+
+    def retry_after(self):
+        return max(1, int(self.open_seconds - (time.monotonic() - self.opened_at) + 0.999))
+
+
+class RetryBudget:
+    """Token bucket that caps retries (and hedges) at `ratio` of requests, plus `min_per_second`.
+
+    Every request deposits `ratio` tokens; every retry spends one. During an outage this keeps
+    retries from multiplying the load on an upstream that is already struggling.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=5.0, max_tokens=50.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def breakers_from_env(services, on_state_change=None):
+    return {name: CircuitBreaker(
+        name,
+        window=int(os.getenv('BREAKER_WINDOW', 20)),
+        min_calls=int(os.getenv('BREAKER_MIN_CALLS', 10)),
+        failure_ratio=float(os.getenv('BREAKER_FAILURE_RATIO', 0.5)),
+        open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', 10)),
+        half_open_probes=int(os.getenv('BREAKER_HALF_OPEN_PROBES', 3)),
+        on_state_change=on_state_change,
+    ) for name in services}
+
+
+def retry_budgets_from_env(services):
+    return {name: RetryBudget(ratio=float(os.getenv('RETRY_BUDGET_RATIO', 0.2)), min_per_second=float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', 5))) for name in services}
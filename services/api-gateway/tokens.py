@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+
+from common.bootstrap import lazy_import
+
+jwt = lazy_import('jwt')
+
+
+class TokenCache:
+    """Verifies HS256 JWTs locally and keeps decoded claims in a bounded LRU keyed by token.
+
+    Entries are dropped once their `exp` claim passes, so a cached token never outlives the token itself.
+    """
+
+    def __init__(self, secret, max_size=10000, algorithms=('HS256',)):
+        self.secret = secret
+        self.max_size = max_size
+        self.algorithms = list(algorithms)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def verify(self, token):
+        """Return the token's claims, or raise jwt.InvalidTokenError (ExpiredSignatureError once `exp` passes)."""
+        with self.lock:
+            claims = self.entries.get(token)
+            if claims is not None:
+                if claims['exp'] > time.time():
+                    self.entries.move_to_end(token)
+                    return claims
+                del self.entries[token]
+                raise jwt.ExpiredSignatureError('Signature has expired')
+        claims = jwt.decode(token, self.secret, algorithms=self.algorithms, options={'require': ['exp']})
+        with self.lock:
+            self.entries[token] = claims
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return claims
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def authenticate(cache, auth_header):
+    """Return (claims, None) for a valid bearer token, or (None, error message)."""
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, 'No token provided'
+    try:
+        return cache.verify(auth_header[len('Bearer '):]), None
+    except jwt.ExpiredSignatureError:
+        return None, 'Token expired'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token'
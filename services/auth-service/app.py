@@ -1,71 +1,141 @@
-from flask import Flask, jsonify, request, g
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pythonjsonlogger import jsonlogger
-import logging
-import jwt
-import bcrypt
+from flask import jsonify, request
+from prometheus_client import Counter, Histogram
+import multiprocessing
+import threading
 import time
 import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import hashing
+from common.bootstrap import create_service, lazy_import
+from common.storage import open_storage
 
-app = Flask(__name__)
+jwt = lazy_import('jwt')
+
+SERVICE = create_service(__name__, 'auth-service')
+app = SERVICE.app
 app.config['SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 
-logger = logging.getLogger()
-logHandler = logging.StreamHandler()
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s')
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
-logger.setLevel(logging.INFO)
+logger = SERVICE.logger
 
-REQUEST_COUNT = Counter('auth_service_requests_total', 'Total requests', ['method', 'endpoint', 'status_code'])
-REQUEST_LATENCY = Histogram('auth_service_request_duration_seconds', 'Latency', ['method', 'endpoint'])
 AUTH_ATTEMPTS = Counter('auth_service_auth_attempts_total', 'Auth attempts', ['type', 'result'])
+HASH_POOL_WAIT = Histogram('auth_service_hash_pool_wait_seconds', 'Time bcrypt jobs wait for a pool process', ['operation'], buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0])
+HASH_DURATION = Histogram('auth_service_hash_duration_seconds', 'bcrypt hash/check time inside the pool', ['operation'], buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5])
+
+STORAGE = open_storage('auth-service')
+TRACER = SERVICE.tracer
+USERS_DB = STORAGE.repository('users')
+
+HASH_POOL_SIZE = int(os.getenv('HASH_POOL_SIZE', 2))
+HASH_QUEUE_DEPTH = int(os.getenv('HASH_QUEUE_DEPTH', HASH_POOL_SIZE * 4))
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 10))
+HASH_RETRY_AFTER = os.getenv('HASH_RETRY_AFTER', '1')
+# Pinned in config rather than calibrated per process: workers on different hardware would otherwise disagree and rehash each other's hashes.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+if os.getenv('BCRYPT_TARGET_MS'):
+    recommended_rounds = hashing.calibrate_rounds(float(os.getenv('BCRYPT_TARGET_MS')))
+    if recommended_rounds != BCRYPT_ROUNDS:
+        logger.info(f"BCRYPT_ROUNDS={recommended_rounds} would hash in about {os.getenv('BCRYPT_TARGET_MS')} ms on this machine; using {BCRYPT_ROUNDS}")
+
+class HashPoolBusy(Exception):
+    pass
+
+hash_slots = threading.BoundedSemaphore(HASH_POOL_SIZE + HASH_QUEUE_DEPTH)
+hash_pool_lock = threading.Lock()
+hash_pool = None
+
+def get_hash_pool():
+    # Created on first use so each gunicorn worker owns its pool; spawned processes import only hashing.py.
+    global hash_pool
+    with hash_pool_lock:
+        if hash_pool is None:
+            hash_pool = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context('spawn'))
+        return hash_pool
+
+def submit_hash(fn, *args):
+    if not hash_slots.acquire(blocking=False):
+        raise HashPoolBusy()
+    try:
+        future = get_hash_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        global hash_pool
+        hash_slots.release()
+        with hash_pool_lock:
+            hash_pool = None
+        raise
+    future.add_done_callback(lambda _: hash_slots.release())
+    return future
 
-USERS_DB = {}
+def observe_hash(operation, submitted, started, finished):
+    HASH_POOL_WAIT.labels(operation=operation).observe(max(started - submitted, 0))
+    HASH_DURATION.labels(operation=operation).observe(finished - started)
 
-@app.before_request
-def before_request():
-    g.start_time = time.time()
-    g.request_id = request.headers.get('X-Request-ID', str(uuid.uuid4()))
+def run_hash(operation, fn, *args):
+    submitted = time.time()
+    try:
+        with TRACER.span(f'bcrypt {operation}', rounds=BCRYPT_ROUNDS):
+            result, started, finished = submit_hash(fn, *args).result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        raise HashPoolBusy()
+    observe_hash(operation, submitted, started, finished)
+    return result
 
-@app.after_request
-def after_request(response):
-    latency = time.time() - g.start_time
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.path, status_code=response.status_code).inc()
-    REQUEST_LATENCY.labels(method=request.method, endpoint=request.path).observe(latency)
-    return response
+def rehash_in_background(email, password):
+    submitted = time.time()
+    def store(future):
+        if future.exception():
+            logger.warning(f'Password rehash failed for {email}: {future.exception()}')
+            return
+        password_hash, started, finished = future.result()
+        observe_hash('rehash', submitted, started, finished)
+        user = USERS_DB.get(email)
+        if user:
+            user['password_hash'] = password_hash.decode('utf-8')
+            USERS_DB.put(email, user)
+    try:
+        submit_hash(hashing.hash_password, password, BCRYPT_ROUNDS).add_done_callback(store)
+    except HashPoolBusy:
+        pass
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'healthy', 'service': 'auth-service', 'timestamp': time.time()})
+def busy_response(attempt_type):
+    AUTH_ATTEMPTS.labels(type=attempt_type, result='overloaded').inc()
+    return jsonify({'error': 'Service busy, retry later'}), 503, {'Retry-After': HASH_RETRY_AFTER}
 
-@app.route('/ready', methods=['GET'])
-def ready():
-    return jsonify({'status': 'ready'})
+def start_hash_pool():
+    # Each pool process is a fresh interpreter that imports bcrypt; starting them now keeps that off the first logins.
+    for future in [submit_hash(hashing.hash_rounds, b'$2b$04$') for _ in range(HASH_POOL_SIZE)]:
+        future.result(timeout=HASH_TIMEOUT)
 
-@app.route('/metrics', methods=['GET'])
-def metrics():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+SERVICE.readiness.add_check('storage', STORAGE.ping)
+SERVICE.readiness.add_warm_up('hash pool', start_hash_pool)
+
+def valid_credentials(data):
+    # Malformed JSON parses to None here, so it gets the same 400 as a missing field instead of reaching the 500 handler.
+    return isinstance(data, dict) and isinstance(data.get('email'), str) and isinstance(data.get('password'), str) and data['email'] and data['password']
 
 @app.route('/api/v1/register', methods=['POST'])
 def register():
     try:
-        data = request.json
-        if not data or 'email' not in data or 'password' not in data:
+        data = request.get_json(silent=True)
+        if not valid_credentials(data):
             AUTH_ATTEMPTS.labels(type='register', result='invalid_request').inc()
             return jsonify({'error': 'Email and password required'}), 400
         email = data['email']
         password = data['password']
-        if email in USERS_DB:
+        if USERS_DB.get(email) is not None:
             AUTH_ATTEMPTS.labels(type='register', result='user_exists').inc()
             return jsonify({'error': 'User already exists'}), 409
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        password_hash = run_hash('hash', hashing.hash_password, password, BCRYPT_ROUNDS)
         user_id = str(uuid.uuid4())
-        USERS_DB[email] = {'id': user_id, 'email': email, 'password_hash': password_hash, 'created_at': time.time()}
+        if not USERS_DB.add(email, {'id': user_id, 'email': email, 'password_hash': password_hash.decode('utf-8'), 'created_at': time.time()}):
+            AUTH_ATTEMPTS.labels(type='register', result='user_exists').inc()
+            return jsonify({'error': 'User already exists'}), 409
         AUTH_ATTEMPTS.labels(type='register', result='success').inc()
         logger.info(f'User registered: {email}')
         return jsonify({'message': 'User registered successfully', 'user_id': user_id}), 201
+    except HashPoolBusy:
+        return busy_response('register')
     except Exception as e:
         AUTH_ATTEMPTS.labels(type='register', result='error').inc()
         logger.error(f'Registration error: {str(e)}')
@@ -74,8 +144,8 @@ def register():
 @app.route('/api/v1/login', methods=['POST'])
 def login():
     try:
-        data = request.json
-        if not data or 'email' not in data or 'password' not in data:
+        data = request.get_json(silent=True)
+        if not valid_credentials(data):
             AUTH_ATTEMPTS.labels(type='login', result='invalid_request').inc()
             return jsonify({'error': 'Email and password required'}), 400
         email = data['email']
@@ -84,13 +154,19 @@ def login():
         if not user:
             AUTH_ATTEMPTS.labels(type='login', result='user_not_found').inc()
             return jsonify({'error': 'Invalid credentials'}), 401
-        if not bcrypt.checkpw(password.encode('utf-8'), user['password_hash']):
+        password_hash = user['password_hash'].encode('utf-8')
+        if not run_hash('check', hashing.check_password, password, password_hash):
             AUTH_ATTEMPTS.labels(type='login', result='wrong_password').inc()
             return jsonify({'error': 'Invalid credentials'}), 401
+        # Only ever upgraded, so lowering BCRYPT_ROUNDS (or a node with an older config) never weakens stored hashes.
+        if hashing.hash_rounds(password_hash) < BCRYPT_ROUNDS:
+            rehash_in_background(email, password)
         token = jwt.encode({'user_id': user['id'], 'email': email, 'exp': time.time() + 3600}, app.config['SECRET_KEY'], algorithm='HS256')
         AUTH_ATTEMPTS.labels(type='login', result='success').inc()
         logger.info(f'User logged in: {email}')
         return jsonify({'message': 'Login successful', 'token': token, 'user_id': user['id']})
+    except HashPoolBusy:
+        return busy_response('login')
     except Exception as e:
         AUTH_ATTEMPTS.labels(type='login', result='error').inc()
         logger.error(f'Login error: {str(e)}')
@@ -0,0 +1,52 @@
+"""bcrypt work that runs inside the hashing process pool.
+
+Kept separate from app.py so pool processes only import bcrypt, not the Flask app. Each function
+returns the wall-clock time it started and finished so the caller can split pool wait from hash time.
+Run it on the target hardware to pick BCRYPT_ROUNDS:
+
+    python hashing.py 250
+"""
+import math
+import sys
+import time
+
+import bcrypt
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+
+def hash_password(password, rounds):
+    started = time.time()
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+    return password_hash, started, time.time()
+
+
+def check_password(password, password_hash):
+    started = time.time()
+    matches = bcrypt.checkpw(password.encode('utf-8'), password_hash)
+    return matches, started, time.time()
+
+
+def hash_rounds(password_hash):
+    """The cost factor stored in a bcrypt hash such as b'$2b$12$...'."""
+    return int(password_hash.split(b'$')[2])
+
+
+def calibrate_rounds(target_ms, min_rounds=10, probe_rounds=8, samples=3):
+    """Pick the bcrypt cost whose hash time is closest to target_ms on this machine.
+
+    Each extra round doubles the work, so one timing at probe_rounds is enough to extrapolate.
+    """
+    timings = []
+    for _ in range(samples):
+        _, started, finished = hash_password('calibration', probe_rounds)
+        timings.append(finished - started)
+    probe_ms = max(min(timings) * 1000, 0.001)
+    rounds = probe_rounds + round(math.log2(target_ms / probe_ms))
+    return max(min_rounds, MIN_ROUNDS, min(rounds, MAX_ROUNDS))
+
+
+if __name__ == '__main__':
+    target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 250
+    print(f'BCRYPT_ROUNDS={calibrate_rounds(target_ms)}')
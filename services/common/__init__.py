@@ -0,0 +1 @@
+"""Code shared by every service; copied next to each app.py in the service images."""
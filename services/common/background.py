@@ -0,0 +1,69 @@
+"""Per-process background work: lazily started threads and periodic purges of expired records.
+
+Threads do not survive a fork, so every component that runs one (log listener, span exporter, event
+tailer, dispatchers, warm-up) starts it on first use in each (gunicorn worker) process through a
+PerProcess. Stores that expire records purge them from a Periodic thread rather than on whichever
+request happens to cross the purge interval.
+
+    self.started = PerProcess(self.start_threads)
+    self.started.ensure()   # cheap after the first call in a process
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PerProcess:
+    """Runs `start()` once in each process that calls ensure(); a start that raises is retried on the next call."""
+
+    def __init__(self, start):
+        self.start = start
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def __bool__(self):
+        return self.pid == os.getpid()
+
+    def ensure(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.start()
+            self.pid = os.getpid()
+
+
+class Periodic:
+    """Calls `fn()` on a daemon thread every `interval` seconds, starting at once; started by ensure() in each process."""
+
+    def __init__(self, name, fn, interval):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.started = PerProcess(lambda: threading.Thread(target=self.run_forever, name=name, daemon=True).start())
+
+    def ensure(self):
+        self.started.ensure()
+
+    def run_forever(self):
+        while True:
+            try:
+                self.fn()
+            except Exception:
+                logger.exception(f'{self.name} failed')
+            time.sleep(self.interval)
+
+
+def purge_expired(repository, order_by, ranges, delete, page_size=500):
+    """Call delete(record) for every record in `repository` matching `ranges`, walking them a page at a time."""
+    after = None
+    while True:
+        expired, after = repository.page(order_by, page_size, after=after, ranges=ranges)
+        for record in expired:
+            delete(record)
+        if after is None:
+            return
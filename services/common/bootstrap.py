@@ -0,0 +1,231 @@
+"""Service bootstrap shared by the Flask services: the app factory, readiness with warm-up, and lazy imports.
+
+create_service() builds the Flask app with JSON logging, request metrics, tracing, X-Request-ID handling
+and the /health, /ready and /metrics endpoints. /ready answers 503 until the service's warm-up steps
+(priming connection pools, starting pool processes, finishing lazy imports) have run in the worker, then
+runs only local checks such as a storage ping, so an unreachable downstream keeps new pods out of rotation
+without taking running ones out with it.
+
+    SERVICE = create_service(__name__, 'order-service')
+    app, logger = SERVICE.app, SERVICE.logger
+    SERVICE.readiness.add_check('storage', STORAGE.ping)
+    SERVICE.readiness.add_warm_up('payment-service', prime_payment_pool)
+
+The module-level app is built once at import, so gunicorn can load it in the master (preload_app) and
+fork workers that share its memory; see common/gunicorn_conf.py.
+"""
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+from flask.json.provider import DefaultJSONProvider
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from common import fastjson
+from common.background import PerProcess
+from common.instrumentation import RequestMetrics, configure_logging, instrument
+from common.tracing import trace_requests, tracer_from_env
+
+LAZY_MODULES = []
+
+logger = logging.getLogger(__name__)
+
+
+def lazy_import(name):
+    """Return module `name`, executing it on first attribute access instead of now.
+
+    Python 3.11's LazyLoader is not thread-safe, so warm-up and the gunicorn master finish these
+    imports with load_lazy_modules() before a worker takes traffic.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    LAZY_MODULES.append(module)
+    return module
+
+
+def load_lazy_modules():
+    for module in LAZY_MODULES:
+        # Any attribute access runs the deferred import.
+        module.__name__
+
+
+class JSONProvider(DefaultJSONProvider):
+    """app.json for Flask and Quart through common.fastjson: jsonify() bodies and request.json / get_json().
+
+    Keys are not sorted. Calls that pass json.dumps/loads options get the standard library provider.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        return super().dumps(obj, **kwargs) if kwargs else fastjson.dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return super().loads(s, **kwargs) if kwargs else fastjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(fastjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+
+def health_prefix(service_name):
+    """The /health body up to its timestamp, serialized once; health_body() completes it per request."""
+    return fastjson.dumps({'status': 'healthy', 'service': service_name})[:-1] + b',"timestamp":'
+
+
+def health_body(prefix):
+    return prefix + repr(time.time()).encode('ascii') + b'}'
+
+
+class Readiness:
+    """Warm-up steps that must succeed once per worker process, then cheap checks run on every /ready.
+
+    Warm-up runs on a background thread started by the first request or gunicorn's post_worker_init,
+    retrying failed steps every `retry_interval` seconds. After `timeout` seconds the process reports
+    ready anyway and logs the steps that never succeeded, so one missing dependency cannot keep a
+    service out of rotation forever.
+    """
+
+    def __init__(self, retry_interval=1.0, timeout=60.0, duration_gauge=None):
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.duration_gauge = duration_gauge
+        self.checks = {}
+        self.warm_ups = {}
+        self.pending = {}
+        self.warm = False
+        self.started = PerProcess(self.start_warm_up)
+        self.ready_body = None
+
+    def add_check(self, name, check):
+        self.checks[name] = check
+
+    def add_warm_up(self, name, step):
+        self.warm_ups[name] = step
+
+    def start(self):
+        # Warm-up primes per-process resources (pools, threads), so each gunicorn worker runs its own.
+        self.started.ensure()
+
+    def start_warm_up(self):
+        self.warm = False
+        self.pending = {name: 'pending' for name in self.warm_ups}
+        threading.Thread(target=self.warm_up, name='warm-up', daemon=True).start()
+
+    def warm_up(self):
+        started = time.perf_counter()
+        while True:
+            failures = {}
+            for name in self.pending:
+                try:
+                    self.warm_ups[name]()
+                except Exception as e:
+                    failures[name] = str(e)
+            # Replaced rather than mutated, since /ready copies it from request threads.
+            self.pending = failures
+            elapsed = time.perf_counter() - started
+            if not self.pending or elapsed >= self.timeout:
+                break
+            time.sleep(self.retry_interval)
+        if self.pending:
+            logger.warning('Warm-up timed out, reporting ready', extra={'pending': self.pending})
+        else:
+            logger.info(f'Warm-up finished in {elapsed:.3f}s')
+        if self.duration_gauge is not None:
+            self.duration_gauge.set(elapsed)
+        self.warm = True
+
+    def status(self):
+        """(ready, {name: 'ok' or the failure}) for this process."""
+        self.start()
+        if not self.warm:
+            return False, dict(self.pending)
+        results = {}
+        for name, check in self.checks.items():
+            try:
+                check()
+                results[name] = 'ok'
+            except Exception as e:
+                results[name] = str(e)
+        return all(result == 'ok' for result in results.values()), results
+
+    def response(self):
+        """(status code, JSON body) for /ready; the body of a passing run never changes, so it is serialized once."""
+        ok, checks = self.status()
+        if not ok:
+            return 503, fastjson.dumps({'status': 'not_ready', 'checks': checks})
+        if self.ready_body is None:
+            self.ready_body = fastjson.dumps({'status': 'ready', 'checks': checks})
+        return 200, self.ready_body
+
+
+def readiness_from_env(duration_gauge=None):
+    readiness = Readiness(float(os.getenv('WARM_UP_RETRY_SECONDS', 1)), float(os.getenv('WARM_UP_TIMEOUT_SECONDS', 60)), duration_gauge)
+    readiness.add_warm_up('imports', load_lazy_modules)
+    return readiness
+
+
+class Service:
+    def __init__(self, app, logger, request_metrics, tracer, readiness):
+        self.app = app
+        self.logger = logger
+        self.request_metrics = request_metrics
+        self.tracer = tracer
+        self.readiness = readiness
+
+
+def create_service(import_name, service_name, latency_buckets=None, access_log=False, echo_request_id=False):
+    """Build the Flask app and the instrumentation every service shares; metric names are prefixed with service_name."""
+    from flask import Flask, g, request
+
+    prefix = service_name.replace('-', '_')
+    app = Flask(import_name)
+    app.json = JSONProvider(app)
+    service_logger = configure_logging()
+    request_count = Counter(f'{prefix}_requests_total', 'Total requests', ['method', 'endpoint', 'status_code'])
+    latency_kwargs = {'buckets': latency_buckets} if latency_buckets else {}
+    request_latency = Histogram(f'{prefix}_request_duration_seconds', 'Latency', ['method', 'endpoint'], **latency_kwargs)
+    request_metrics = RequestMetrics(request_count, request_latency, access_log=access_log)
+    tracer = tracer_from_env(service_name)
+    readiness = readiness_from_env(Gauge(f'{prefix}_warm_up_duration_seconds', 'Time this worker took to warm up'))
+    app.extensions['readiness'] = readiness
+
+    instrument(app, request_metrics)
+    trace_requests(app, tracer)
+
+    @app.before_request
+    def before_request():
+        readiness.start()
+        g.request_id = request.headers.get('X-Request-ID') or str(uuid.uuid4())
+
+    if echo_request_id:
+        @app.after_request
+        def after_request(response):
+            response.headers['X-Request-ID'] = g.request_id
+            return response
+
+    health_start = health_prefix(service_name)
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return app.response_class(health_body(health_start), mimetype='application/json')
+
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        status, body = readiness.response()
+        return app.response_class(body, status, mimetype='application/json')
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+    return Service(app, service_logger, request_metrics, tracer, readiness)
@@ -0,0 +1,242 @@
+"""State-change events: a persisted event log per service, served as Server-Sent Events.
+
+Services publish their state transitions (`order.paid`, `payment.completed`, ...) to an EventLog kept
+in their Storage, so events written by any gunicorn worker reach subscribers on every worker, and a
+client that reconnects with `Last-Event-ID` resumes where it left off. Each process runs one tailer
+thread, started on the first subscription, that reads new events from the log and fans them out to
+its subscribers. Subscriber buffers are bounded: a subscriber that falls behind is disconnected and
+resumes from the log on reconnect, so nothing is lost and a slow reader cannot grow memory. Sequence
+numbers only mean something within one log, so each log has a random id, stored with it, that readers
+compare before resuming from a sequence number (`X-Event-Log-ID`, and `log_id` in JSON pages).
+
+    EVENTS = event_log_from_env(STORAGE)
+    EVENTS.publish('order.paid', {'order_id': order_id, 'status': 'paid'})
+    app.add_url_rule('/api/v1/events', 'events', events_view(EVENTS))
+"""
+import collections
+import logging
+import os
+import threading
+import time
+import uuid
+
+from common import fastjson
+from common.background import Periodic, PerProcess, purge_expired
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {fastjson.dumps(data).decode('utf-8')}\n\n"
+
+
+HEARTBEAT = ': keep-alive\n\n'
+
+
+class Subscriber:
+    """A bounded buffer of events for one stream; `wake` is called after every push (thread-safe)."""
+
+    def __init__(self, max_buffer, wake=None):
+        self.events = collections.deque()
+        self.max_buffer = max_buffer
+        self.overflowed = False
+        self.ready = threading.Event()
+        self.wake = wake or self.ready.set
+
+    def push(self, event):
+        if len(self.events) >= self.max_buffer:
+            self.overflowed = True
+        else:
+            self.events.append(event)
+        self.wake()
+
+    def disconnect(self):
+        # The stream ends as if it had overflowed; the client resumes from its Last-Event-ID.
+        self.overflowed = True
+        self.wake()
+
+    def drain(self):
+        self.ready.clear()
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+
+class Broadcaster:
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.RLock()
+
+    def add(self, subscriber):
+        with self.lock:
+            self.subscribers.add(subscriber)
+
+    def remove(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def broadcast(self, events):
+        with self.lock:
+            for subscriber in self.subscribers:
+                for event in events:
+                    subscriber.push(event)
+
+
+class EventLog:
+    def __init__(self, storage, retention=3600, poll_interval=0.1, buffer_size=1000, page_size=500, purge_interval=60):
+        self.storage = storage
+        self.events = storage.repository('events', fields=('seq', 'time'))
+        self.meta = storage.repository('event_log')
+        self.id = None
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.buffer_size = buffer_size
+        self.page_size = page_size
+        self.publish_lock = threading.Lock()
+        self.broadcaster = Broadcaster()
+        self.changed = threading.Event()
+        self.tailing = PerProcess(self.start_tailer)
+        self.purger = Periodic('event-purge', self.purge, purge_interval)
+        self.cursor = 0
+
+    def log_id(self):
+        if self.id is None:
+            self.meta.add('id', {'log_id': uuid.uuid4().hex[:12]})
+            self.id = self.meta.get('id')['log_id']
+        return self.id
+
+    def last_seq(self):
+        events, _ = self.events.page('seq', 1, descending=True)
+        return events[0]['seq'] if events else 0
+
+    def publish(self, event_type, data):
+        self.publish_many([(event_type, data)])
+
+    def publish_many(self, events):
+        """Append (type, data) events in one transaction; sequence numbers are assigned under the storage's write lock.
+
+        Call it inside the storage.batch() that records the state change, so events commit in the same order as the changes.
+        """
+        if not events:
+            return
+        now = time.time()
+        with self.storage.batch(), self.publish_lock:
+            last = self.last_seq()
+            records = [{'seq': last + i, 'type': event_type, 'data': data, 'time': now} for i, (event_type, data) in enumerate(events, 1)]
+            self.events.put_many((f"{record['seq']:020d}", record) for record in records)
+        self.changed.set()
+        self.purger.ensure()
+
+    def read_after(self, seq, limit=None):
+        events, _ = self.events.page('seq', limit or self.page_size, ranges={'seq': (seq + 1, None)})
+        return events
+
+    def purge(self):
+        # The newest event is always kept so sequence numbers keep increasing after a quiet period.
+        ranges = {'time': (None, time.time() - self.retention), 'seq': (None, self.last_seq())}
+        purge_expired(self.events, 'time', ranges, lambda event: self.events.delete(f"{event['seq']:020d}"))
+
+    def start(self):
+        self.tailing.ensure()
+
+    def start_tailer(self):
+        self.broadcaster = Broadcaster()
+        self.cursor = self.last_seq()
+        threading.Thread(target=self.tail_forever, name='event-tailer', daemon=True).start()
+
+    def tail_forever(self):
+        # Local publishes wake the tailer at once; events written by other workers are picked up within poll_interval.
+        # A failed read (storage briefly unavailable) is retried with a growing delay: the thread is never restarted.
+        failures = 0
+        while True:
+            self.changed.wait(min(self.poll_interval * 2 ** failures, 5.0))
+            self.changed.clear()
+            try:
+                self.tail()
+                failures = 0
+            except Exception:
+                failures += 1
+                logger.exception(f'Event tailer failed (attempt {failures}), retrying')
+
+    def tail(self):
+        events = self.read_after(self.cursor)
+        while events:
+            with self.broadcaster.lock:
+                self.broadcaster.broadcast(events)
+                self.cursor = events[-1]['seq']
+            events = self.read_after(self.cursor) if len(events) == self.page_size else []
+
+    def subscribe(self):
+        """A Subscriber that receives every event after the returned sequence number."""
+        self.start()
+        subscriber = Subscriber(self.buffer_size)
+        with self.broadcaster.lock:
+            self.broadcaster.add(subscriber)
+            return subscriber, self.cursor
+
+    def backlog(self, after, until):
+        """Yield the stored events with after < seq <= until, a page at a time."""
+        while after < until:
+            events = [event for event in self.read_after(after) if event['seq'] <= until]
+            if not events:
+                return
+            yield from events
+            after = events[-1]['seq']
+
+    def unsubscribe(self, subscriber):
+        self.broadcaster.remove(subscriber)
+
+
+def event_stream(log, after, heartbeat=15.0, max_duration=300.0):
+    """Yield SSE text for the log's events after `after` until the subscriber overflows or max_duration passes."""
+    subscriber, live_from = log.subscribe()
+    deadline = time.monotonic() + max_duration
+    try:
+        yield 'retry: 1000\n\n'
+        # Events up to live_from were broadcast before this subscriber joined, so a resuming client gets them from the log.
+        if after is not None:
+            for event in log.backlog(after, live_from):
+                yield format_sse(event['seq'], event['type'], event['data'])
+        while not subscriber.overflowed and time.monotonic() < deadline:
+            if not subscriber.ready.wait(heartbeat):
+                yield HEARTBEAT
+                continue
+            for event in subscriber.drain():
+                yield format_sse(event['seq'], event['type'], event['data'])
+    finally:
+        log.unsubscribe(subscriber)
+
+
+def parse_last_event_id(value):
+    """The sequence number in a Last-Event-ID header or `after` parameter; raises ValueError."""
+    if value is None or value == '':
+        return None
+    seq = int(value)
+    if seq < 0:
+        raise ValueError('Last-Event-ID must be a non-negative integer')
+    return seq
+
+
+def events_view(log, heartbeat=None, max_duration=None):
+    """Flask view for GET /api/v1/events: an SSE stream, or with ?format=json one page of events after ?after=."""
+    from flask import Response, jsonify, request
+    heartbeat = float(os.getenv('EVENT_HEARTBEAT_SECONDS', 15)) if heartbeat is None else heartbeat
+    max_duration = float(os.getenv('EVENT_STREAM_MAX_SECONDS', 300)) if max_duration is None else max_duration
+
+    def events():
+        try:
+            after = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('after'))
+            limit = max(1, min(int(request.args.get('limit', log.page_size)), log.page_size))
+        except ValueError:
+            return jsonify({'error': 'Last-Event-ID, after and limit must be non-negative integers'}), 400
+        if request.args.get('format') == 'json':
+            page = log.read_after(after or 0, limit)
+            return jsonify({'events': page, 'latest_seq': log.last_seq(), 'log_id': log.log_id()})
+        return Response(event_stream(log, after, heartbeat, max_duration), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Event-Log-ID': log.log_id()})
+    return events
+
+
+def event_log_from_env(storage):
+    return EventLog(storage, retention=float(os.getenv('EVENT_RETENTION_SECONDS', 3600)), buffer_size=int(os.getenv('EVENT_BUFFER_SIZE', 1000)))
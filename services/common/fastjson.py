@@ -0,0 +1,36 @@
+"""JSON encoding shared by the services: orjson when it is installed, the standard library otherwise.
+
+dumps() returns compact UTF-8 bytes, ready to send or store, and loads() takes str or bytes. Values
+orjson refuses (integers beyond 64 bits, NaN written by the standard library) fall back to `json`,
+so either encoder reads what the other wrote.
+
+    body = dumps({'orders': orders})
+    order = loads(response.content)
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlib_dumps(obj, default=None):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=default).encode('utf-8')
+
+
+if orjson is not None:
+    def dumps(obj, default=None):
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return stdlib_dumps(obj, default)
+
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+else:
+    dumps = stdlib_dumps
+    loads = json.loads
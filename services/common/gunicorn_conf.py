@@ -0,0 +1,30 @@
+"""gunicorn settings shared by the Flask services: `gunicorn -c common/gunicorn_conf.py app:app`.
+
+The app is imported once in the master (preload_app) and workers are forked from it, so module-level
+state (the Flask app, compiled routes, imported libraries) is shared copy-on-write instead of being
+rebuilt by every worker. Per-process resources (pools, threads, SQLite connections) are created after
+the fork; each worker starts its warm-up as soon as it is initialised rather than on its first request.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before the first fork.
+    from common.bootstrap import load_lazy_modules
+    load_lazy_modules()
+    # Objects that survive to here are never freed; freezing them keeps the workers' garbage collector
+    # from writing to (and so copying) the pages they live on.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    readiness = getattr(worker.wsgi, 'extensions', {}).get('readiness')
+    if readiness is not None:
+        readiness.start()
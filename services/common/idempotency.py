@@ -0,0 +1,108 @@
+"""Idempotency-Key handling for POST endpoints.
+
+The first request carrying a key claims it in the service's storage and runs normally; its response is
+then stored for `ttl` seconds. Repeats replay the stored response without redoing the work, and
+duplicates that arrive while the first is still running wait for it and replay its response
+(coalescing). Because the records live in Storage, every gunicorn worker shares them. Keys are scoped
+to the caller (the gateway's verified X-User-ID), so two users picking the same key never share a record.
+"""
+import functools
+import hashlib
+import time
+
+from flask import Response, jsonify, make_response, request
+
+from common.background import Periodic, purge_expired
+from common.longpoll import ChangeNotifier
+
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Retry-After')
+
+
+class IdempotencyStore:
+    def __init__(self, storage, counter, ttl=86400, in_flight_timeout=60, wait_timeout=10, purge_interval=60):
+        self.records = storage.repository('idempotency_keys', fields=('expires_at',))
+        self.counter = counter
+        self.ttl = ttl
+        self.in_flight_timeout = in_flight_timeout
+        self.wait_timeout = wait_timeout
+        self.purger = Periodic('idempotency-purge', self.purge, purge_interval)
+        self.changes = ChangeNotifier()
+
+    def claim(self, key, fingerprint):
+        """Return (outcome, record); outcome is miss, hit, coalesced, mismatch or timeout."""
+        self.purger.ensure()
+        while True:
+            now = time.time()
+            claim = {'key': key, 'state': 'in_flight', 'fingerprint': fingerprint, 'expires_at': now + self.in_flight_timeout}
+            if self.records.add(key, claim):
+                return self.outcome('miss', None)
+            record = self.records.get(key)
+            if record is None:
+                continue
+            if record['expires_at'] <= now:
+                if self.records.put_if(key, claim, expires_at=record['expires_at']):
+                    return self.outcome('miss', None)
+                continue
+            if record['fingerprint'] != fingerprint:
+                return self.outcome('mismatch', record)
+            if record['state'] == 'done':
+                return self.outcome('hit', record)
+            record = self.changes.wait_for(lambda: self.records.get(key), lambda r: r['state'] == 'done', self.wait_timeout)
+            if record is None:
+                # The original request failed and released the key; try to claim it ourselves.
+                continue
+            return self.outcome('coalesced' if record['state'] == 'done' else 'timeout', record)
+
+    def outcome(self, result, record):
+        self.counter.labels(result=result).inc()
+        return result, record
+
+    def complete(self, key, fingerprint, response):
+        headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+        record = {'key': key, 'state': 'done', 'fingerprint': fingerprint, 'expires_at': time.time() + self.ttl,
+                  'status': response.status_code, 'headers': headers, 'body': response.get_data(as_text=True)}
+        self.records.put(key, record)
+        self.changes.notify()
+
+    def release(self, key):
+        self.records.delete(key)
+        self.changes.notify()
+
+    def purge(self):
+        purge_expired(self.records, 'expires_at', {'expires_at': (None, time.time())},
+                      lambda record: self.records.delete_if(record['key'], expires_at=record['expires_at']))
+
+
+def idempotent(store):
+    """Decorate a Flask view so requests carrying an Idempotency-Key header run at most once per key."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > 255:
+                return jsonify({'error': 'Idempotency-Key must be at most 255 characters'}), 400
+            user_id = request.headers.get('X-User-ID', '')
+            scoped_key = f'{request.method} {request.path} {user_id} {key}'
+            fingerprint = hashlib.sha256(user_id.encode('utf-8') + b'\n' + request.get_data()).hexdigest()
+            outcome, record = store.claim(scoped_key, fingerprint)
+            if outcome == 'mismatch':
+                return jsonify({'error': 'Idempotency-Key was already used with a different request'}), 422
+            if outcome == 'timeout':
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409, {'Retry-After': '1'}
+            if outcome in ('hit', 'coalesced'):
+                return Response(record['body'], status=record['status'], headers={**record['headers'], 'Idempotent-Replayed': 'true'})
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                store.release(scoped_key)
+                raise
+            # Server errors are not remembered, so a retry gets a fresh attempt.
+            if response.status_code >= 500:
+                store.release(scoped_key)
+            else:
+                store.complete(scoped_key, fingerprint, response)
+            return response
+        return wrapper
+    return decorator
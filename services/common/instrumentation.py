@@ -0,0 +1,116 @@
+"""Request metrics and logging shared by the services.
+
+Request metrics are labelled with the matched route template (`/api/v1/orders/<order_id>`) rather than
+the raw path, so the number of time series stays fixed however many ids are requested, and latency is
+measured with the monotonic perf_counter(). Log records go through a queue to a background thread, and
+per-request access log lines are sampled (errors and slow requests are always logged).
+
+    logger = configure_logging()
+    REQUEST_METRICS = RequestMetrics(REQUEST_COUNT, REQUEST_LATENCY)
+    instrument(app, REQUEST_METRICS)
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+from pythonjsonlogger import jsonlogger
+
+from common.background import PerProcess
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Queue records for a background thread that formats and writes them; drops records when the queue is full."""
+
+    def __init__(self, handler, max_queue=10000):
+        super().__init__(queue.Queue(max_queue))
+        self.handler = handler
+        self.max_queue = max_queue
+        self.listener = None
+        self.dropped = 0
+        self.started = PerProcess(self.start_listener)
+
+    def start(self):
+        self.started.ensure()
+
+    def start_listener(self):
+        self.queue = queue.Queue(self.max_queue)
+        self.listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def enqueue(self, record):
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=logging.INFO):
+    """Send the root logger's JSON records to stdout through an AsyncLogHandler and return the root logger."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    logger = logging.getLogger()
+    logger.addHandler(AsyncLogHandler(handler, max_queue=int(os.getenv('LOG_QUEUE_SIZE', 10000))))
+    logger.setLevel(level)
+    return logger
+
+
+class RequestMetrics:
+    """Records one finished request on the service's request counter and latency histogram.
+
+    With access_log, it also logs `sample_rate` of requests to the `access` logger, plus every request
+    that failed with a 5xx or took at least `slow_seconds`.
+    """
+
+    def __init__(self, request_count, request_latency, access_log=False, sample_rate=None, slow_seconds=None):
+        self.request_count = request_count
+        self.request_latency = request_latency
+        self.access_logger = logging.getLogger('access') if access_log else None
+        self.sample_rate = float(os.getenv('ACCESS_LOG_SAMPLE_RATE', 0.1)) if sample_rate is None else sample_rate
+        self.slow_seconds = float(os.getenv('ACCESS_LOG_SLOW_SECONDS', 1.0)) if slow_seconds is None else slow_seconds
+
+    def record(self, request, status_code, started, request_id=None):
+        latency = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        self.request_count.labels(method=request.method, endpoint=route, status_code=status_code).inc()
+        self.request_latency.labels(method=request.method, endpoint=route).observe(latency)
+        if self.access_logger and (status_code >= 500 or latency >= self.slow_seconds or random.random() < self.sample_rate):
+            self.access_logger.info('Request completed', extra={'request_id': request_id, 'method': request.method, 'path': request.path, 'route': route,
+                                                                'status_code': status_code, 'latency_ms': round(latency * 1000, 2)})
+
+
+def instrument(app, metrics):
+    """Record every request of a Flask app on `metrics`."""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if 'request_started' in g:
+            metrics.record(request, response.status_code, g.request_started, g.get('request_id'))
+        return response
+
+
+def instrument_async(app, metrics):
+    """instrument() for a Quart app; the hooks are coroutines so Quart does not push them onto a thread pool."""
+    from quart import g, request
+
+    @app.before_request
+    async def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    async def record_request(response):
+        if 'request_started' in g:
+            metrics.record(request, response.status_code, g.request_started, g.get('request_id'))
+        return response
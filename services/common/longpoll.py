@@ -0,0 +1,37 @@
+"""Long-poll support: block a request until a stored document changes or a timeout passes."""
+import threading
+import time
+
+
+class ChangeNotifier:
+    """Wakes waiting requests when this process updates a document.
+
+    Waiters also re-read storage every `interval` seconds, so updates made by other gunicorn workers
+    are picked up too, just less promptly.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.condition = threading.Condition()
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_for(self, fetch, done, timeout):
+        """Return fetch() once done(document) is true, the document is gone, or `timeout` seconds pass."""
+        deadline = time.monotonic() + timeout
+        document = fetch()
+        while document is not None and not done(document):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self.condition:
+                self.condition.wait(min(self.interval, remaining))
+            document = fetch()
+        return document
+
+
+def wait_seconds(args, maximum):
+    """The `wait` query parameter clamped to [0, maximum]; raises ValueError if it is not a number."""
+    return max(0.0, min(float(args.get('wait', 0)), maximum))
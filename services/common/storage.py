@@ -0,0 +1,349 @@
+"""Pluggable document storage shared by the services.
+
+Each service opens one Storage and asks it for named repositories of JSON documents. The default
+backend is an embedded SQLite database in WAL mode, so every gunicorn worker on a pod sees the same
+data and it survives restarts. A networked store can be swapped in by implementing Storage and
+Repository and adding its scheme to open_storage().
+
+    STORAGE_URL=sqlite:///data/order-service.db   (default, relative to the working directory)
+    STORAGE_URL=sqlite:////var/lib/orders.db      (absolute path)
+    STORAGE_URL=memory://                         (per-process dicts, for tests and benchmarks)
+"""
+import base64
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from common import fastjson
+
+
+def dumps(document):
+    return fastjson.dumps(document).decode('utf-8')
+
+
+loads = fastjson.loads
+
+
+def encode_cursor(position):
+    """Opaque, URL-safe token for a (sort value, key) position returned by Repository.page()."""
+    return base64.urlsafe_b64encode(dumps(list(position)).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); raises ValueError for a malformed cursor."""
+    try:
+        value, key = loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    # Anything else would reach the query as a comparison that fails, or matches nothing sensible.
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)) or not isinstance(key, str):
+        raise ValueError('Invalid cursor')
+    return value, key
+
+
+def split_page(rows, limit):
+    """Trim rows of (sort value, key, ...) fetched with limit + 1 and return them with the next position."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1][0], rows[-1][1])
+
+
+class Repository:
+    """A keyed collection of JSON documents.
+
+    `fields` names top-level document fields that the backend may store alongside the document
+    (and index) so they can be filtered and ordered on without decoding every row. `indexes` lists
+    the composite secondary indexes to build over those fields (one per field by default).
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, document):
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """Store an iterable of (key, document) pairs in one batch."""
+        raise NotImplementedError
+
+    def add(self, key, document):
+        """Store the document only if the key is new; returns False if it already existed."""
+        raise NotImplementedError
+
+    def put_if(self, key, document, **expected):
+        """Replace the stored document only if its stored fields still equal `expected`; returns whether it did."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_if(self, key, **expected):
+        """Delete the document only if its stored fields still equal `expected`; returns whether it did."""
+        raise NotImplementedError
+
+    def values(self):
+        """Iterate over every document in insertion order."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def page(self, order_by, limit, after=None, descending=False, equals=None, ranges=None):
+        """One keyset page of documents ordered by (order_by, key).
+
+        Returns (documents, next_position); next_position is the (value, key) to pass back as
+        `after` for the following page, or None on the last page. `equals` maps fields to required
+        values and `ranges` maps fields to (low, high) bounds, inclusive low and exclusive high,
+        either of which may be None.
+        """
+        raise NotImplementedError
+
+
+class Storage:
+    def repository(self, name, fields=(), indexes=None):
+        raise NotImplementedError
+
+    @contextmanager
+    def batch(self):
+        """Group the writes made by this thread inside the block into a single commit."""
+        yield
+
+    def ping(self):
+        """Raise if the backend cannot be read; used by readiness checks."""
+
+
+class MemoryRepository(Repository):
+    def __init__(self, name, fields=(), indexes=None):
+        self.name = name
+        self.fields = tuple(fields)
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.documents.get(key)
+
+    def put(self, key, document):
+        self.documents[key] = document
+
+    def put_many(self, items):
+        with self.lock:
+            self.documents.update(items)
+
+    def add(self, key, document):
+        with self.lock:
+            if key in self.documents:
+                return False
+            self.documents[key] = document
+            return True
+
+    def put_if(self, key, document, **expected):
+        with self.lock:
+            current = self.documents.get(key)
+            if current is None or any(current.get(field) != value for field, value in expected.items()):
+                return False
+            self.documents[key] = document
+            return True
+
+    def delete(self, key):
+        self.documents.pop(key, None)
+
+    def delete_if(self, key, **expected):
+        with self.lock:
+            current = self.documents.get(key)
+            if current is None or any(current.get(field) != value for field, value in expected.items()):
+                return False
+            del self.documents[key]
+            return True
+
+    def values(self):
+        return iter(list(self.documents.values()))
+
+    def count(self):
+        return len(self.documents)
+
+    def page(self, order_by, limit, after=None, descending=False, equals=None, ranges=None):
+        rows = []
+        for key, document in list(self.documents.items()):
+            if any(document.get(field) != value for field, value in (equals or {}).items()):
+                continue
+            if any((low is not None and document.get(field) < low) or (high is not None and document.get(field) >= high)
+                   for field, (low, high) in (ranges or {}).items()):
+                continue
+            position = (document.get(order_by), key)
+            if after is not None and (position <= tuple(after) if not descending else position >= tuple(after)):
+                continue
+            rows.append((position[0], key, document))
+        rows.sort(key=lambda row: (row[0], row[1]), reverse=descending)
+        rows, position = split_page(rows[:limit + 1], limit)
+        return [document for _, _, document in rows], position
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.repositories = {}
+
+    def repository(self, name, fields=(), indexes=None):
+        if name not in self.repositories:
+            self.repositories[name] = MemoryRepository(name, fields, indexes)
+        return self.repositories[name]
+
+
+class SQLiteStorage(Storage):
+    """One SQLite file in WAL mode with a connection per thread (and per process after a fork).
+
+    Statements are built once per repository, so sqlite3's per-connection statement cache reuses the
+    prepared statements on every call. Single writes autocommit; put_many() and batch() wrap their
+    writes in one BEGIN IMMEDIATE ... COMMIT.
+    """
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection().execute('PRAGMA journal_mode=WAL')
+
+    def connection(self):
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=256)
+            conn.execute(f'PRAGMA busy_timeout={self.busy_timeout_ms}')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn, local.pid, local.depth = conn, os.getpid(), 0
+        return local.conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        local = self.local
+        if local.depth:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            local.depth = 0
+
+    batch = transaction
+
+    def ping(self):
+        self.connection().execute('PRAGMA schema_version').fetchone()
+
+    def repository(self, name, fields=(), indexes=None):
+        return SQLiteRepository(self, name, fields, indexes)
+
+
+class SQLiteRepository(Repository):
+    def __init__(self, storage, name, fields=(), indexes=None):
+        self.storage = storage
+        self.name = name
+        self.fields = tuple(fields)
+        indexes = [(field,) for field in self.fields] if indexes is None else indexes
+        columns = ''.join(f', {field}' for field in self.fields)
+        placeholders = ', ?' * len(self.fields)
+        with storage.transaction() as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, data TEXT NOT NULL{columns})')
+            existing = {row[1] for row in conn.execute(f'PRAGMA table_info({name})')}
+            for field in self.fields:
+                if field not in existing:
+                    conn.execute(f'ALTER TABLE {name} ADD COLUMN {field}')
+            # Every index ends in the primary key so keyset pagination on (field, key) never sorts.
+            for index in indexes:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{name}_{'_'.join(index)} ON {name} ({', '.join(index)}, key)")
+        self.get_sql = f'SELECT data FROM {name} WHERE key = ?'
+        self.put_sql = f'INSERT OR REPLACE INTO {name} (key, data{columns}) VALUES (?, ?{placeholders})'
+        self.add_sql = f'INSERT OR IGNORE INTO {name} (key, data{columns}) VALUES (?, ?{placeholders})'
+        self.delete_sql = f'DELETE FROM {name} WHERE key = ?'
+        self.values_sql = f'SELECT data FROM {name} ORDER BY rowid'
+        self.count_sql = f'SELECT COUNT(*) FROM {name}'
+
+    def row(self, key, document):
+        return (key, dumps(document), *(document.get(field) for field in self.fields))
+
+    def get(self, key):
+        found = self.storage.connection().execute(self.get_sql, (key,)).fetchone()
+        return loads(found[0]) if found else None
+
+    def put(self, key, document):
+        self.storage.connection().execute(self.put_sql, self.row(key, document))
+
+    def put_many(self, items):
+        with self.storage.transaction() as conn:
+            conn.executemany(self.put_sql, (self.row(key, document) for key, document in items))
+
+    def add(self, key, document):
+        return self.storage.connection().execute(self.add_sql, self.row(key, document)).rowcount == 1
+
+    def check_fields(self, fields):
+        for field in fields:
+            if field not in self.fields:
+                raise ValueError(f'{self.name}.{field} is not a stored field')
+
+    def put_if(self, key, document, **expected):
+        self.check_fields(expected)
+        assignments = ''.join(f', {field} = ?' for field in self.fields)
+        conditions = ''.join(f' AND {field} = ?' for field in expected)
+        sql = f'UPDATE {self.name} SET data = ?{assignments} WHERE key = ?{conditions}'
+        params = (dumps(document), *(document.get(field) for field in self.fields), key, *expected.values())
+        return self.storage.connection().execute(sql, params).rowcount == 1
+
+    def delete(self, key):
+        self.storage.connection().execute(self.delete_sql, (key,))
+
+    def delete_if(self, key, **expected):
+        self.check_fields(expected)
+        conditions = ''.join(f' AND {field} = ?' for field in expected)
+        return self.storage.connection().execute(f'DELETE FROM {self.name} WHERE key = ?{conditions}', (key, *expected.values())).rowcount == 1
+
+    def values(self):
+        for (data,) in self.storage.connection().execute(self.values_sql):
+            yield loads(data)
+
+    def count(self):
+        return self.storage.connection().execute(self.count_sql).fetchone()[0]
+
+    def page(self, order_by, limit, after=None, descending=False, equals=None, ranges=None):
+        self.check_fields((order_by, *(equals or {}), *(ranges or {})))
+        clauses, params = [], []
+        for field, value in (equals or {}).items():
+            clauses.append(f'{field} = ?')
+            params.append(value)
+        for field, (low, high) in (ranges or {}).items():
+            if low is not None:
+                clauses.append(f'{field} >= ?')
+                params.append(low)
+            if high is not None:
+                clauses.append(f'{field} < ?')
+                params.append(high)
+        if after is not None:
+            clauses.append(f"({order_by}, key) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        sql = f'SELECT {order_by}, key, data FROM {self.name} {where} ORDER BY {order_by} {direction}, key {direction} LIMIT ?'
+        rows = self.storage.connection().execute(sql, (*params, limit + 1)).fetchall()
+        rows, position = split_page(rows, limit)
+        return [loads(data) for _, _, data in rows], position
+
+
+def open_storage(service_name, url=None):
+    url = url or os.getenv('STORAGE_URL') or f"sqlite:///{os.getenv('DATA_DIR', 'data')}/{service_name}.db"
+    if url.startswith('memory://'):
+        return MemoryStorage()
+    if url.startswith('sqlite:///'):
+        return SQLiteStorage(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported STORAGE_URL: {url}')
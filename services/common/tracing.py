@@ -0,0 +1,247 @@
+"""W3C Trace Context propagation and lightweight spans.
+
+Every request joins the trace named by its `traceparent` header (or starts one) and runs inside a
+server span; calls to other services open client spans and pass their `traceparent` on. Finished
+spans are observed on the `trace_span_duration_seconds` histogram, which the Grafana dashboard uses
+for per-hop latency, and sampled spans are exported in batches by a background thread as Zipkin v2
+JSON (accepted by Zipkin, Jaeger and the OpenTelemetry collector's zipkin receiver):
+
+    TRACE_EXPORT_URL=http://otel-collector:9411/api/v2/spans   (POST one JSON array per batch)
+    TRACE_EXPORT_FILE=/tmp/spans.jsonl                          (one JSON span per line)
+"""
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+
+from prometheus_client import Histogram
+
+from common import fastjson
+from common.background import PerProcess
+
+SPAN_DURATION = Histogram('trace_span_duration_seconds', 'Span durations by service and span name', ['service', 'span', 'kind'],
+                          buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0])
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+CURRENT_SPAN = contextvars.ContextVar('current_span', default=None)
+logger = logging.getLogger(__name__)
+
+
+def parse_traceparent(header):
+    """Return (trace_id, parent_span_id, sampled) from a traceparent header, or None if it is missing or invalid."""
+    match = TRACEPARENT.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'kind', 'trace_id', 'span_id', 'parent_id', 'sampled', 'tags', 'timestamp', 'started', 'token')
+
+    def __init__(self, tracer, name, kind, trace_id, parent_id, sampled, tags):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.tags = tags
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.token = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_tag(self, key, value):
+        self.tags[key] = str(value)
+
+    def end(self):
+        self.tracer.finish(self, time.perf_counter() - self.started)
+
+    def __enter__(self):
+        self.token = CURRENT_SPAN.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None:
+            self.set_tag('error', exc_type.__name__)
+        CURRENT_SPAN.reset(self.token)
+        self.end()
+
+
+class SpanExporter:
+    """Buffers finished spans and writes them in batches from a background thread; drops spans when the buffer is full."""
+
+    def __init__(self, url=None, path=None, batch_size=512, interval=2.0, max_queue=8192, timeout=2.0):
+        self.url = url
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.queue = queue.Queue(max_queue)
+        self.started = PerProcess(self.start_exporter)
+        self.dropped = 0
+
+    def start(self):
+        self.started.ensure()
+
+    def start_exporter(self):
+        self.queue = queue.Queue(self.max_queue)
+        threading.Thread(target=self.export_forever, name='span-exporter', daemon=True).start()
+        atexit.register(self.flush)
+
+    def export(self, span):
+        self.start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def export_forever(self):
+        while True:
+            self.write(self.next_batch())
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        spans = [zipkin_span(span, duration) for span, duration in batch]
+        try:
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.writelines(fastjson.dumps(span).decode('utf-8') + '\n' for span in spans)
+            if self.url:
+                body = fastjson.dumps(spans)
+                urllib.request.urlopen(urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'}), timeout=self.timeout).close()
+        except Exception as e:
+            logger.warning(f'Dropped {len(spans)} spans: {e}')
+
+
+def zipkin_span(span, duration):
+    document = {'traceId': span.trace_id, 'id': span.span_id, 'name': span.name, 'timestamp': int(span.timestamp * 1e6),
+                'duration': max(int(duration * 1e6), 1), 'localEndpoint': {'serviceName': span.tracer.service_name}, 'tags': span.tags}
+    if span.parent_id:
+        document['parentId'] = span.parent_id
+    if span.kind != 'INTERNAL':
+        document['kind'] = span.kind
+    return document
+
+
+class Tracer:
+    def __init__(self, service_name, exporter=None, sample_rate=1.0):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start_span(self, name, kind='INTERNAL', parent=None, **tags):
+        """Start a span under `parent` (a Span, a traceparent header value, or None for the current span)."""
+        if parent is None:
+            parent = CURRENT_SPAN.get()
+        if isinstance(parent, Span):
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        elif parent and parse_traceparent(parent):
+            trace_id, parent_id, sampled = parse_traceparent(parent)
+        else:
+            trace_id, parent_id, sampled = '%032x' % random.getrandbits(128), None, random.random() < self.sample_rate
+        return Span(self, name, kind, trace_id, parent_id, sampled, {key: str(value) for key, value in tags.items()})
+
+    def span(self, name, kind='INTERNAL', parent=None, **tags):
+        """Context manager form of start_span(); the span is the current span inside the block."""
+        return self.start_span(name, kind, parent, **tags)
+
+    def finish(self, span, duration):
+        SPAN_DURATION.labels(service=self.service_name, span=span.name, kind=span.kind).observe(duration)
+        if span.sampled and self.exporter is not None:
+            self.exporter.export((span, duration))
+
+
+def current_traceparent():
+    span = CURRENT_SPAN.get()
+    return span.traceparent if span is not None else None
+
+
+def tracer_from_env(service_name):
+    url, path = os.getenv('TRACE_EXPORT_URL'), os.getenv('TRACE_EXPORT_FILE')
+    exporter = SpanExporter(url=url, path=path, batch_size=int(os.getenv('TRACE_EXPORT_BATCH_SIZE', 512)),
+                            interval=float(os.getenv('TRACE_EXPORT_INTERVAL', 2.0))) if url or path else None
+    return Tracer(service_name, exporter, sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 1.0)))
+
+
+def server_span_name(request):
+    return f'{request.method} {request.url_rule.rule if request.url_rule is not None else "<unmatched>"}'
+
+
+def trace_requests(app, tracer):
+    """Run every request of a Flask app in a server span continuing the caller's traceparent."""
+    from flask import g, request
+
+    @app.before_request
+    def start_server_span():
+        g.span = tracer.start_span(server_span_name(request), 'SERVER', request.headers.get('traceparent'), **{'http.method': request.method})
+        g.span.token = CURRENT_SPAN.set(g.span)
+
+    @app.after_request
+    def tag_status(response):
+        if 'span' in g:
+            g.span.set_tag('http.status_code', response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_server_span(exc):
+        span = g.pop('span', None)
+        if span is not None:
+            if exc is not None:
+                span.set_tag('error', type(exc).__name__)
+            CURRENT_SPAN.reset(span.token)
+            span.end()
+
+
+def trace_requests_async(app, tracer):
+    """trace_requests() for a Quart app; each request runs in its own task, so the current span needs no reset."""
+    from quart import g, request
+
+    @app.before_request
+    async def start_server_span():
+        g.span = tracer.start_span(server_span_name(request), 'SERVER', request.headers.get('traceparent'), **{'http.method': request.method})
+        CURRENT_SPAN.set(g.span)
+
+    @app.after_request
+    async def tag_status(response):
+        if 'span' in g:
+            g.span.set_tag('http.status_code', response.status_code)
+        return response
+
+    @app.teardown_request
+    async def end_server_span(exc):
+        span = g.pop('span', None)
+        if span is not None:
+            if exc is not None:
+                span.set_tag('error', type(exc).__name__)
+            span.end()
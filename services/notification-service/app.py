@@ -1,75 +1,170 @@
-from flask import Flask, jsonify, request, g
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pythonjsonlogger import jsonlogger
-import logging
+from flask import jsonify, request
+from prometheus_client import Counter, Gauge, Histogram
 import time
 import os
+import random
 import uuid
+from dispatcher import Dispatcher
+from common.background import Periodic
+from common.bootstrap import create_service
+from common.events import event_log_from_env, events_view
+from common.storage import decode_cursor, encode_cursor, open_storage
 
-app = Flask(__name__)
+SERVICE = create_service(__name__, 'notification-service')
+app = SERVICE.app
 
-logger = logging.getLogger()
-logHandler = logging.StreamHandler()
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s')
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
-logger.setLevel(logging.INFO)
+logger = SERVICE.logger
 
-REQUEST_COUNT = Counter('notification_service_requests_total', 'Total requests', ['method', 'endpoint', 'status_code'])
-REQUEST_LATENCY = Histogram('notification_service_request_duration_seconds', 'Latency', ['method', 'endpoint'])
-NOTIFICATIONS_SENT = Counter('notification_service_notifications_total', 'Notifications sent', ['type', 'status'])
+NOTIFICATIONS_SENT = Counter('notification_service_notifications_total', 'Dispatched notifications by outcome (sent, dead_lettered)', ['type', 'status'])
+NOTIFICATIONS_QUEUED = Counter('notification_service_notifications_queued_total', 'Notifications accepted onto the queue, or rejected because it was full', ['type', 'status'])
+QUEUE_DEPTH = Gauge('notification_service_queue_depth', 'Notifications waiting in the dispatch queue, including scheduled retries')
+BATCH_SIZE = Histogram('notification_service_batch_size', 'Notifications per dispatched batch', ['type'], buckets=[1, 2, 5, 10, 25, 50, 100, 250])
+DISPATCH_LATENCY = Histogram('notification_service_dispatch_latency_seconds', 'Time from enqueue to sent', ['type'], buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0])
 
-NOTIFICATIONS_DB = {}
+STORAGE = open_storage('notification-service')
+TRACER = SERVICE.tracer
+NOTIFICATIONS_DB = STORAGE.repository('notifications', fields=('type', 'status', 'created_at', 'queued_at'),
+                                      indexes=[('type',), ('status', 'created_at'), ('status', 'queued_at')])
+EVENTS = event_log_from_env(STORAGE)
 
-@app.before_request
-def before_request():
-    g.start_time = time.time()
-    g.request_id = request.headers.get('X-Request-ID', str(uuid.uuid4()))
+SEND_LATENCY = float(os.getenv('NOTIFICATION_SEND_LATENCY', 0.05))
+FAILURE_RATE = float(os.getenv('NOTIFICATION_FAILURE_RATE', 0.0))
+BULK_MAX = int(os.getenv('NOTIFICATION_BULK_MAX', 1000))
+RETRY_AFTER = os.getenv('NOTIFICATION_RETRY_AFTER', '1')
+# Well past the longest a live worker keeps a notification queued (every retry's backoff included).
+RECOVER_AFTER = float(os.getenv('NOTIFICATION_RECOVER_AFTER', 300))
 
-@app.after_request
-def after_request(response):
-    latency = time.time() - g.start_time
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.path, status_code=response.status_code).inc()
-    REQUEST_LATENCY.labels(method=request.method, endpoint=request.path).observe(latency)
-    return response
+def send_batch(notification_type, notifications):
+    """Deliver one batch through the provider; returns the notifications that failed."""
+    BATCH_SIZE.labels(type=notification_type).observe(len(notifications))
+    # Batches mix notifications from many requests, so each one starts its own trace.
+    with TRACER.span('send batch', 'CLIENT', type=notification_type, size=len(notifications)):
+        time.sleep(SEND_LATENCY)
+    return [n for n in notifications if random.random() < FAILURE_RATE]
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'healthy', 'service': 'notification-service', 'timestamp': time.time()})
+def publish_notifications(notifications):
+    EVENTS.publish_many([(f"notification.{n['status']}", {'notification_id': n['notification_id'], 'type': n['type'], 'status': n['status']}) for n in notifications])
 
-@app.route('/ready', methods=['GET'])
-def ready():
-    return jsonify({'status': 'ready'})
+def store_outcome(notifications, status):
+    now = time.time()
+    for notification in notifications:
+        notification.update({'status': status, 'updated_at': now})
+        NOTIFICATIONS_SENT.labels(type=notification['type'], status=status).inc()
+        if status == 'sent':
+            DISPATCH_LATENCY.labels(type=notification['type']).observe(now - notification['queued_at'])
+    with STORAGE.batch():
+        NOTIFICATIONS_DB.put_many((n['notification_id'], n) for n in notifications)
+        publish_notifications(notifications)
+    if status == 'dead_lettered':
+        logger.warning(f"Notifications dead-lettered: {[n['notification_id'] for n in notifications]}")
 
-@app.route('/metrics', methods=['GET'])
-def metrics():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+DISPATCHER = Dispatcher(send_batch, lambda items: store_outcome(items, 'sent'), lambda items: store_outcome(items, 'dead_lettered'),
+                        workers=int(os.getenv('NOTIFICATION_DISPATCHERS', 4)),
+                        max_queue=int(os.getenv('NOTIFICATION_QUEUE_MAX', 10000)),
+                        batch_size=int(os.getenv('NOTIFICATION_BATCH_SIZE', 50)),
+                        batch_wait=float(os.getenv('NOTIFICATION_BATCH_WAIT', 0.05)),
+                        max_attempts=int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5)),
+                        backoff_base=float(os.getenv('NOTIFICATION_BACKOFF_BASE', 0.5)))
+QUEUE_DEPTH.set_function(DISPATCHER.depth)
+SERVICE.readiness.add_check('storage', STORAGE.ping)
+
+def recover_queued():
+    """Re-queue notifications stored as queued for over RECOVER_AFTER: their worker exited, or recording the outcome failed."""
+    cutoff, after = time.time() - RECOVER_AFTER, None
+    while True:
+        stale, after = NOTIFICATIONS_DB.page('queued_at', 500, after=after, equals={'status': 'queued'}, ranges={'queued_at': (None, cutoff)})
+        # Claimed by moving queued_at, so another worker's sweep skips them.
+        claimed = []
+        for notification in stale:
+            claim = dict(notification, queued_at=time.time())
+            if NOTIFICATIONS_DB.put_if(notification['notification_id'], claim, status='queued', queued_at=notification['queued_at']):
+                claimed.append(claim)
+        if claimed:
+            logger.warning(f'Re-queueing {len(claimed)} stale notifications')
+            # With the queue full, the claimed rows stay queued and are picked up again after another RECOVER_AFTER.
+            if not DISPATCHER.submit([dict(n) for n in claimed]):
+                return
+        if after is None:
+            return
+
+RECOVERY = Periodic('notification-recovery', recover_queued, float(os.getenv('NOTIFICATION_RECOVER_INTERVAL', 60)))
+SERVICE.readiness.add_warm_up('dispatcher', DISPATCHER.start)
+SERVICE.readiness.add_warm_up('queued notifications', RECOVERY.ensure)
+
+def new_notification(data):
+    if not isinstance(data, dict) or 'type' not in data or 'recipient' not in data:
+        raise ValueError('Type and recipient required')
+    now = time.time()
+    return {'notification_id': str(uuid.uuid4()), 'type': data['type'], 'recipient': data['recipient'], 'status': 'queued', 'attempts': 0, 'created_at': now, 'queued_at': now}
+
+def enqueue(notifications):
+    """Persist and queue the notifications; returns an error response when the queue is full."""
+    # Published before dispatch, so subscribers never see 'sent' ahead of 'queued'.
+    with STORAGE.batch():
+        NOTIFICATIONS_DB.put_many((n['notification_id'], n) for n in notifications)
+        publish_notifications(notifications)
+    # The dispatcher mutates its items, so it gets copies of what was stored.
+    if not DISPATCHER.submit([dict(n) for n in notifications]):
+        for notification in notifications:
+            NOTIFICATIONS_DB.delete(notification['notification_id'])
+            NOTIFICATIONS_QUEUED.labels(type=notification['type'], status='rejected').inc()
+        publish_notifications([dict(n, status='rejected') for n in notifications])
+        return jsonify({'error': 'Notification queue full, retry later'}), 503, {'Retry-After': RETRY_AFTER}
+    for notification in notifications:
+        NOTIFICATIONS_QUEUED.labels(type=notification['type'], status='queued').inc()
+    return None
+
+app.add_url_rule('/api/v1/events', 'events', events_view(EVENTS))
 
 @app.route('/api/v1/notifications', methods=['POST'])
 def send_notification():
     try:
-        data = request.json
-        if not data or 'type' not in data or 'recipient' not in data:
-            return jsonify({'error': 'Type and recipient required'}), 400
-        notification_type = data['type']
-        recipient = data['recipient']
-        notification_id = str(uuid.uuid4())
-        time.sleep(0.05)
-        notification = {
-            'notification_id': notification_id,
-            'type': notification_type,
-            'recipient': recipient,
-            'status': 'sent',
-            'created_at': time.time()
-        }
-        NOTIFICATIONS_DB[notification_id] = notification
-        NOTIFICATIONS_SENT.labels(type=notification_type, status='sent').inc()
-        logger.info(f'Notification sent: {notification_id} type={notification_type}')
-        return jsonify({'message': 'Notification sent', 'notification': notification}), 201
+        try:
+            notification = new_notification(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        rejected = enqueue([notification])
+        if rejected:
+            return rejected
+        logger.info(f"Notification queued: {notification['notification_id']} type={notification['type']}")
+        return jsonify({'message': 'Notification queued', 'notification': notification}), 202
     except Exception as e:
         logger.error(f'Error sending notification: {str(e)}')
         return jsonify({'error': 'Failed to send notification'}), 500
 
+@app.route('/api/v1/notifications/bulk', methods=['POST'])
+def send_notifications_bulk():
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('notifications'), list) or not data['notifications']:
+            return jsonify({'error': 'notifications list required'}), 400
+        if len(data['notifications']) > BULK_MAX:
+            return jsonify({'error': f'At most {BULK_MAX} notifications per request'}), 413
+        notifications = []
+        for index, item in enumerate(data['notifications']):
+            try:
+                notifications.append(new_notification(item))
+            except ValueError as e:
+                return jsonify({'error': str(e), 'index': index}), 400
+        rejected = enqueue(notifications)
+        if rejected:
+            return rejected
+        logger.info(f'Notifications queued: {len(notifications)}')
+        return jsonify({'message': 'Notifications queued', 'count': len(notifications), 'queued': [n['notification_id'] for n in notifications]}), 202
+    except Exception as e:
+        logger.error(f'Error queueing notifications: {str(e)}')
+        return jsonify({'error': 'Failed to queue notifications'}), 500
+
+@app.route('/api/v1/notifications/dead-letter', methods=['GET'])
+def get_dead_letters():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    notifications, position = NOTIFICATIONS_DB.page('created_at', limit, after=after, equals={'status': 'dead_lettered'})
+    return jsonify({'notifications': notifications, 'next_cursor': encode_cursor(position) if position else None})
+
 @app.route('/api/v1/notifications/<notification_id>', methods=['GET'])
 def get_notification(notification_id):
     notification = NOTIFICATIONS_DB.get(notification_id)
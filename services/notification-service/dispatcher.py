@@ -0,0 +1,122 @@
+"""In-process notification queue drained in per-type batches by a pool of dispatcher threads.
+
+Failed sends are retried with exponential backoff and dead-lettered after `max_attempts`.
+"""
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+
+from common.background import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    def __init__(self, send_batch, on_sent, on_dead_letter, workers=4, max_queue=10000, batch_size=50, batch_wait=0.05,
+                 max_attempts=5, backoff_base=0.5, backoff_max=30.0):
+        """send_batch(type, items) returns the items that failed; on_sent/on_dead_letter receive lists of items."""
+        self.send_batch = send_batch
+        self.on_sent = on_sent
+        self.on_dead_letter = on_dead_letter
+        self.workers = workers
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.retries = []
+        self.retry_sequence = itertools.count()
+        self.retry_condition = threading.Condition()
+        self.submit_lock = threading.Lock()
+        self.started = PerProcess(self.start_threads)
+
+    def start(self):
+        self.started.ensure()
+
+    def start_threads(self):
+        for i in range(self.workers):
+            threading.Thread(target=self.dispatch_forever, name=f'notification-dispatcher-{i}', daemon=True).start()
+        threading.Thread(target=self.retry_forever, name='notification-retry', daemon=True).start()
+
+    def depth(self):
+        return self.queue.qsize() + len(self.retries)
+
+    def submit(self, items):
+        """Queue every item or none of them; returns False when the queue lacks room (backpressure)."""
+        self.start()
+        with self.submit_lock:
+            if self.max_queue - self.queue.qsize() < len(items):
+                return False
+            for item in items:
+                item['queued_at'] = time.time()
+                self.queue.put_nowait(item)
+        return True
+
+    def next_batch(self):
+        """Block for one item, then gather more for up to batch_wait seconds, grouped by type."""
+        first = self.queue.get()
+        batches = {first['type']: [first]}
+        count, deadline = 1, time.monotonic() + self.batch_wait
+        while count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batches.setdefault(item['type'], []).append(item)
+            count += 1
+        return batches
+
+    def dispatch_forever(self):
+        while True:
+            for notification_type, items in self.next_batch().items():
+                self.dispatch(notification_type, items)
+
+    def dispatch(self, notification_type, items):
+        try:
+            failed = self.send_batch(notification_type, items)
+        except Exception:
+            failed = items
+        failed_ids = {id(item) for item in failed}
+        sent = [item for item in items if id(item) not in failed_ids]
+        if sent:
+            self.record(self.on_sent, sent)
+        dead = []
+        for item in failed:
+            item['attempts'] = item.get('attempts', 0) + 1
+            if item['attempts'] >= self.max_attempts:
+                dead.append(item)
+            else:
+                self.schedule_retry(item)
+        if dead:
+            self.record(self.on_dead_letter, dead)
+
+    def record(self, callback, items):
+        # A callback that raises (storage unavailable) must not end the dispatcher thread with the rest of the batch
+        # unhandled; the items are logged and left to the owner's recovery of what it still has recorded as queued.
+        try:
+            callback(items)
+        except Exception:
+            logger.exception(f'Recording the outcome of {len(items)} notifications failed')
+
+    def schedule_retry(self, item):
+        delay = min(self.backoff_base * 2 ** (item['attempts'] - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+        with self.retry_condition:
+            heapq.heappush(self.retries, (time.monotonic() + delay, next(self.retry_sequence), item))
+            self.retry_condition.notify()
+
+    def retry_forever(self):
+        while True:
+            with self.retry_condition:
+                while not self.retries or self.retries[0][0] > time.monotonic():
+                    timeout = self.retries[0][0] - time.monotonic() if self.retries else None
+                    self.retry_condition.wait(timeout)
+                _, _, item = heapq.heappop(self.retries)
+            # Retries take precedence over backpressure: they were already accepted once.
+            self.queue.put(item)
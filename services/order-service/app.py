@@ -1,90 +1,285 @@
-from flask import Flask, jsonify, request, g
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pythonjsonlogger import jsonlogger
-import logging
+from flask import Response, jsonify, request, g
+from prometheus_client import Counter, Histogram
 import requests
+import hashlib
 import time
 import os
 import uuid
+from common import fastjson
+from common.bootstrap import create_service
+from common.events import event_log_from_env, events_view
+from common.idempotency import IdempotencyStore, idempotent
+from common.longpoll import ChangeNotifier, wait_seconds
+from common.storage import decode_cursor, encode_cursor, open_storage
 
-app = Flask(__name__)
+SERVICE = create_service(__name__, 'order-service')
+app = SERVICE.app
 
-logger = logging.getLogger()
-logHandler = logging.StreamHandler()
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s')
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
-logger.setLevel(logging.INFO)
+logger = SERVICE.logger
 
-REQUEST_COUNT = Counter('order_service_requests_total', 'Total requests', ['method', 'endpoint', 'status_code'])
-REQUEST_LATENCY = Histogram('order_service_request_duration_seconds', 'Latency', ['method', 'endpoint'])
+IDEMPOTENCY_REQUESTS = Counter('order_service_idempotency_requests_total', 'Idempotency-Key lookups', ['result'])
 ORDER_CREATED = Counter('order_service_orders_created_total', 'Orders created', ['status'])
 ORDER_VALUE = Histogram('order_service_order_value_dollars', 'Order value', buckets=[10, 50, 100, 250, 500, 1000, 5000])
 
-ORDERS_DB = {}
+STORAGE = open_storage('order-service')
+TRACER = SERVICE.tracer
+ORDERS_DB = STORAGE.repository('orders', fields=('created_at', 'status'), indexes=[('created_at',), ('status', 'created_at')])
+IDEMPOTENCY = IdempotencyStore(STORAGE, IDEMPOTENCY_REQUESTS, ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)))
+EVENTS = event_log_from_env(STORAGE)
+ORDER_PAGE_DEFAULT = int(os.getenv('ORDER_PAGE_DEFAULT', 50))
+ORDER_PAGE_MAX = int(os.getenv('ORDER_PAGE_MAX', 500))
+ORDER_EXPORT_BATCH = int(os.getenv('ORDER_EXPORT_BATCH', 500))
+ORDER_BATCH_MAX = int(os.getenv('ORDER_BATCH_MAX', 500))
+ORDER_CHANGES = ChangeNotifier()
 PAYMENT_SERVICE_URL = os.getenv('PAYMENT_SERVICE_URL', 'http://payment-service')
+ORDER_SERVICE_URL = os.getenv('ORDER_SERVICE_URL', 'http://order-service')
+PAYMENT_ENQUEUE_TIMEOUT = float(os.getenv('PAYMENT_ENQUEUE_TIMEOUT', 2))
+LONG_POLL_MAX = float(os.getenv('LONG_POLL_MAX', 8))
+PENDING_STATUSES = ('pending', 'payment_initiated')
+ORDER_STATUS_FOR_PAYMENT = {'completed': 'paid', 'failed': 'payment_failed'}
+payment_session = requests.Session()
 
-@app.before_request
-def before_request():
-    g.start_time = time.time()
-    g.request_id = request.headers.get('X-Request-ID', str(uuid.uuid4()))
+def prime_payment_pool():
+    # A /health round trip leaves a keep-alive connection in the pool, so the first order skips the TCP handshake.
+    payment_session.get(f'{PAYMENT_SERVICE_URL}/health', timeout=PAYMENT_ENQUEUE_TIMEOUT).raise_for_status()
 
-@app.after_request
-def after_request(response):
-    latency = time.time() - g.start_time
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.path, status_code=response.status_code).inc()
-    REQUEST_LATENCY.labels(method=request.method, endpoint=request.path).observe(latency)
-    return response
+SERVICE.readiness.add_check('storage', STORAGE.ping)
+SERVICE.readiness.add_warm_up('payment-service', prime_payment_pool)
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'healthy', 'service': 'order-service', 'timestamp': time.time()})
+def order_query(args):
+    """Translate listing query parameters into Repository.page() keyword arguments; raises ValueError."""
+    query = {'order_by': 'created_at', 'descending': args.get('order', 'desc') != 'asc', 'equals': {}, 'ranges': {}}
+    if args.get('order', 'desc') not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    if args.get('status'):
+        query['equals']['status'] = args['status']
+    created_after, created_before = args.get('created_after'), args.get('created_before')
+    if created_after or created_before:
+        query['ranges']['created_at'] = (float(created_after) if created_after else None, float(created_before) if created_before else None)
+    if args.get('cursor'):
+        query['after'] = decode_cursor(args['cursor'])
+    return query
 
-@app.route('/ready', methods=['GET'])
-def ready():
-    return jsonify({'status': 'ready'})
+def export_orders(query):
+    while True:
+        orders, query['after'] = ORDERS_DB.page(limit=ORDER_EXPORT_BATCH, **query)
+        yield b''.join(fastjson.dumps(order) + b'\n' for order in orders)
+        if query['after'] is None:
+            return
 
-@app.route('/metrics', methods=['GET'])
-def metrics():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+def publish_orders(orders):
+    EVENTS.publish_many([(f"order.{order['status']}", {'order_id': order['order_id'], 'status': order['status'], 'total': order['total'],
+                                                       'payment_id': order.get('payment_id')}) for order in orders])
+
+app.add_url_rule('/api/v1/events', 'events', events_view(EVENTS))
 
 @app.route('/api/v1/orders', methods=['GET'])
 def get_orders():
-    return jsonify({'orders': list(ORDERS_DB.values()), 'total': len(ORDERS_DB)})
+    try:
+        query = order_query(request.args)
+        limit = min(int(request.args.get('limit', ORDER_PAGE_DEFAULT)), ORDER_PAGE_MAX)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response(export_orders(query), mimetype='application/x-ndjson')
+    orders, position = ORDERS_DB.page(limit=limit, **query)
+    return jsonify({'orders': orders, 'limit': limit, 'next_cursor': encode_cursor(position) if position else None})
 
 @app.route('/api/v1/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
-    order = ORDERS_DB.get(order_id)
+    try:
+        wait = wait_seconds(request.args, LONG_POLL_MAX)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    order = ORDER_CHANGES.wait_for(lambda: ORDERS_DB.get(order_id), lambda o: o['status'] not in PENDING_STATUSES, wait)
     if not order:
         return jsonify({'error': 'Order not found'}), 404
     return jsonify(order)
 
+def fail_payments(orders):
+    """Mark pending orders payment_failed when payment-service queued nothing for them; returns the orders as stored."""
+    failed = []
+    with STORAGE.batch():
+        for order in orders:
+            updated = dict(order, status='payment_failed')
+            failed.append(updated if ORDERS_DB.put_if(order['order_id'], updated, status='pending') else None)
+        publish_orders([order for order in failed if order])
+    ORDER_CHANGES.notify()
+    return [order or ORDERS_DB.get(original['order_id']) for order, original in zip(failed, orders)]
+
+def start_payment(order):
+    """Enqueue the order's payment job and link the order to it; the outcome arrives on the payment callback.
+
+    Returns (order, retry_after): retry_after is set when payment-service refused the job, and the order is then payment_failed.
+    """
+    order_id = order['order_id']
+    body = {'order_id': order_id, 'amount': order['total'], 'currency': 'USD', 'callback_url': f'{ORDER_SERVICE_URL}/api/v1/orders/{order_id}/payment-callback'}
+    try:
+        with TRACER.span('call payment', 'CLIENT') as span:
+            headers = {'X-Request-ID': g.request_id, 'traceparent': span.traceparent, 'Prefer': 'respond-async', 'Idempotency-Key': f'order-{order_id}'}
+            payment_response = payment_session.post(f'{PAYMENT_SERVICE_URL}/api/v1/payments', json=body, headers=headers, timeout=PAYMENT_ENQUEUE_TIMEOUT)
+            span.set_tag('http.status_code', payment_response.status_code)
+        if payment_response.status_code != 202:
+            logger.warning(f'Payment not accepted for order {order_id}: status={payment_response.status_code}')
+            return fail_payments([order])[0], payment_response.headers.get('Retry-After', '1')
+        initiated = dict(order, status='payment_initiated', payment_id=fastjson.loads(payment_response.content)['payment']['payment_id'])
+        with STORAGE.batch():
+            if ORDERS_DB.put_if(order_id, initiated, status='pending'):
+                publish_orders([initiated])
+                return initiated, None
+        # The payment callback won the race and already recorded the outcome.
+        return ORDERS_DB.get(order_id), None
+    except requests.exceptions.ConnectionError as e:
+        # Nothing reached payment-service.
+        logger.warning(f'Payment call failed: {str(e)}')
+        return fail_payments([order])[0], '1'
+    except Exception as e:
+        # The job may have been queued (a read timeout), so the order stays pending for its callback.
+        logger.warning(f'Payment call failed: {str(e)}')
+        return order, None
+
+def start_payments(orders):
+    """start_payment() for many orders with one batched payment-service call; returns (order as updated, retry_after) pairs."""
+    callback = f'{ORDER_SERVICE_URL}/api/v1/orders/{{}}/payment-callback'
+    body = {'payments': [{'order_id': order['order_id'], 'amount': order['total'], 'currency': 'USD', 'callback_url': callback.format(order['order_id'])} for order in orders]}
+    try:
+        with TRACER.span('call payment batch', 'CLIENT', orders=len(orders)) as span:
+            # Like start_payment's per-order key: a repeated call for the same orders replays the first one's jobs instead of charging twice.
+            batch_key = hashlib.sha256(','.join(order['order_id'] for order in orders).encode()).hexdigest()[:32]
+            headers = {'X-Request-ID': g.request_id, 'traceparent': span.traceparent, 'Idempotency-Key': f'orders-{batch_key}'}
+            payment_response = payment_session.post(f'{PAYMENT_SERVICE_URL}/api/v1/payments/batch', json=body, headers=headers, timeout=PAYMENT_ENQUEUE_TIMEOUT)
+            span.set_tag('http.status_code', payment_response.status_code)
+        retry_after = payment_response.headers.get('Retry-After', '1')
+        if payment_response.status_code != 200:
+            logger.warning(f'Payment batch not accepted: status={payment_response.status_code} orders={len(orders)}')
+            return [(order, retry_after) for order in fail_payments(orders)]
+        results = fastjson.loads(payment_response.content)['results']
+    except requests.exceptions.ConnectionError as e:
+        logger.warning(f'Payment batch call failed: {str(e)}')
+        return [(order, '1') for order in fail_payments(orders)]
+    except Exception as e:
+        # The jobs may have been queued (a read timeout), so the orders stay pending for their callbacks.
+        logger.warning(f'Payment batch call failed: {str(e)}')
+        return [(order, None) for order in orders]
+    updated = []
+    with STORAGE.batch():
+        for order, result in zip(orders, results):
+            if result['status'] != 202:
+                updated.append(order)
+                continue
+            initiated = dict(order, status='payment_initiated', payment_id=result['payment']['payment_id'])
+            updated.append(initiated if ORDERS_DB.put_if(order['order_id'], initiated, status='pending') else None)
+        publish_orders([order for order in updated if order and order['status'] == 'payment_initiated'])
+    refused = iter(fail_payments([order for order, result in zip(orders, results) if result['status'] != 202]))
+    # None marks an order whose payment callback already landed; re-read those outside the write transaction.
+    return [(next(refused), retry_after) if result['status'] != 202 else (order or ORDERS_DB.get(original['order_id']), None)
+            for order, original, result in zip(updated, orders, results)]
+
+@app.route('/api/v1/orders/<order_id>/payment-callback', methods=['POST'])
+def payment_callback(order_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'payment_id' not in data or data.get('status') not in ORDER_STATUS_FOR_PAYMENT:
+        return jsonify({'error': 'payment_id and a final payment status required'}), 400
+    while True:
+        order = ORDERS_DB.get(order_id)
+        if not order:
+            return jsonify({'error': 'Order not found'}), 404
+        if order.get('payment_id') not in (None, data['payment_id']):
+            return jsonify({'error': 'Payment does not belong to this order'}), 409
+        if order['status'] not in PENDING_STATUSES:
+            return jsonify(order)
+        updated = dict(order, status=ORDER_STATUS_FOR_PAYMENT[data['status']], payment_id=data['payment_id'])
+        with STORAGE.batch():
+            if ORDERS_DB.put_if(order_id, updated, status=order['status']):
+                publish_orders([updated])
+                break
+    ORDER_CHANGES.notify()
+    logger.info(f"Order {order_id} {updated['status']} payment={data['payment_id']}")
+    return jsonify(updated)
+
+def order_total(items):
+    return sum(item.get('price', 0) * item.get('quantity', 1) for item in items)
+
 @app.route('/api/v1/orders', methods=['POST'])
+@idempotent(IDEMPOTENCY)
 def create_order():
     try:
-        data = request.json
-        if not data or 'items' not in data:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
             return jsonify({'error': 'Items required'}), 400
+        try:
+            total = order_total(items)
+        except (AttributeError, TypeError):
+            return jsonify({'error': 'Invalid items'}), 400
         order_id = str(uuid.uuid4())
-        total = sum(item.get('price', 0) * item.get('quantity', 1) for item in data['items'])
-        order = {'order_id': order_id, 'items': data['items'], 'total': total, 'status': 'pending', 'created_at': time.time()}
-        ORDERS_DB[order_id] = order
+        order = {'order_id': order_id, 'items': items, 'total': total, 'status': 'pending', 'created_at': time.time()}
+        with STORAGE.batch():
+            ORDERS_DB.put(order_id, order)
+            publish_orders([order])
         ORDER_CREATED.labels(status='pending').inc()
         ORDER_VALUE.observe(total)
         logger.info(f'Order created: {order_id} total={total}')
-        try:
-            payment_response = requests.post(f"{PAYMENT_SERVICE_URL}/api/v1/payments", json={'order_id': order_id, 'amount': total, 'currency': 'USD'}, headers={'X-Request-ID': g.request_id}, timeout=10)
-            if payment_response.status_code == 201:
-                order['status'] = 'payment_initiated'
-                order['payment_id'] = payment_response.json().get('payment_id')
-        except Exception as e:
-            logger.warning(f'Payment call failed: {str(e)}')
-        return jsonify({'message': 'Order created successfully', 'order': order}), 201
+        order, retry_after = start_payment(order)
+        if retry_after:
+            return jsonify({'error': 'Payment service unavailable, retry later', 'order': order}), 503, {'Retry-After': retry_after, 'Location': f'/api/v1/orders/{order_id}'}
+        return jsonify({'message': 'Order accepted', 'order': order}), 202, {'Location': f'/api/v1/orders/{order_id}'}
     except Exception as e:
         ORDER_CREATED.labels(status='failed').inc()
         logger.error(f'Error creating order: {str(e)}')
         return jsonify({'error': 'Failed to create order'}), 500
 
+@app.route('/api/v1/orders/batch', methods=['POST'])
+@idempotent(IDEMPOTENCY)
+def create_orders_batch():
+    """Create many orders at once; results[i] is {'status': 202, 'order': ...}, {'status': 400, 'error': ...}, or
+    {'status': 503, 'error': ..., 'order': ..., 'retry_after': ...} if payment-service refused its payment, for orders[i]."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('orders'), list) or not data['orders']:
+        return jsonify({'error': 'orders required'}), 400
+    if len(data['orders']) > ORDER_BATCH_MAX:
+        return jsonify({'error': f'At most {ORDER_BATCH_MAX} orders per batch'}), 400
+    results, orders, now = [], [], time.time()
+    for index, order_data in enumerate(data['orders']):
+        items = order_data.get('items') if isinstance(order_data, dict) else None
+        if not items or not isinstance(items, list):
+            results.append({'index': index, 'status': 400, 'error': 'Items required'})
+            continue
+        try:
+            total = order_total(items)
+        except (AttributeError, TypeError):
+            results.append({'index': index, 'status': 400, 'error': 'Invalid items'})
+            continue
+        order = {'order_id': str(uuid.uuid4()), 'items': items, 'total': total, 'status': 'pending', 'created_at': now}
+        orders.append(order)
+        results.append({'index': index, 'status': 202, 'order': order})
+    try:
+        with STORAGE.batch():
+            ORDERS_DB.put_many([(order['order_id'], order) for order in orders])
+            publish_orders(orders)
+    except Exception as e:
+        ORDER_CREATED.labels(status='failed').inc(len(orders))
+        logger.error(f'Error creating order batch: {str(e)}')
+        return jsonify({'error': 'Failed to create orders'}), 500
+    for order in orders:
+        ORDER_CREATED.labels(status='pending').inc()
+        ORDER_VALUE.observe(order['total'])
+    logger.info(f'Order batch created: {len(orders)} of {len(results)} orders')
+    started = iter(start_payments(orders) if orders else [])
+    retry_afters = []
+    for result in results:
+        if result['status'] == 202:
+            result['order'], retry_after = next(started)
+            if retry_after:
+                seconds = int(retry_after) if retry_after.isdigit() else 1
+                result.update(status=503, error='Payment service unavailable, retry later', retry_after=seconds)
+                retry_afters.append(seconds)
+    accepted = sum(result['status'] == 202 for result in results)
+    headers = {'Retry-After': str(max(retry_afters))} if retry_afters else {}
+    return jsonify({'results': results, 'accepted': accepted, 'rejected': len(results) - accepted}), 200, headers
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8082))
     logger.info(f'Starting Order Service on port {port}')
@@ -1,80 +1,205 @@
-from flask import Flask, jsonify, request, g
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from pythonjsonlogger import jsonlogger
-import logging
+from flask import jsonify, request, g
+from prometheus_client import Counter, Histogram
+import requests
+import threading
 import time
 import os
 import uuid
 import random
+from concurrent.futures import ThreadPoolExecutor
+from common.background import Periodic
+from common.bootstrap import create_service
+from common.events import event_log_from_env, events_view
+from common.idempotency import IdempotencyStore, idempotent
+from common.longpoll import ChangeNotifier, wait_seconds
+from common.storage import open_storage
+from common.tracing import current_traceparent
 
-app = Flask(__name__)
+SERVICE = create_service(__name__, 'payment-service')
+app = SERVICE.app
 
-logger = logging.getLogger()
-logHandler = logging.StreamHandler()
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s')
-logHandler.setFormatter(formatter)
-logger.addHandler(logHandler)
-logger.setLevel(logging.INFO)
+logger = SERVICE.logger
 
-REQUEST_COUNT = Counter('payment_service_requests_total', 'Total requests', ['method', 'endpoint', 'status_code'])
-REQUEST_LATENCY = Histogram('payment_service_request_duration_seconds', 'Latency', ['method', 'endpoint'])
+IDEMPOTENCY_REQUESTS = Counter('payment_service_idempotency_requests_total', 'Idempotency-Key lookups', ['result'])
 PAYMENT_PROCESSED = Counter('payment_service_payments_total', 'Payments processed', ['status', 'currency'])
 PAYMENT_AMOUNT = Histogram('payment_service_payment_amount_dollars', 'Payment amount', buckets=[10, 50, 100, 250, 500, 1000, 5000])
 
-PAYMENTS_DB = {}
+STORAGE = open_storage('payment-service')
+TRACER = SERVICE.tracer
+PAYMENTS_DB = STORAGE.repository('payments', fields=('order_id', 'created_at', 'status', 'queued_at'), indexes=[('order_id',), ('created_at',), ('status', 'queued_at')])
+IDEMPOTENCY = IdempotencyStore(STORAGE, IDEMPOTENCY_REQUESTS, ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)))
+PAYMENT_CHANGES = ChangeNotifier()
+EVENTS = event_log_from_env(STORAGE)
 
-@app.before_request
-def before_request():
-    g.start_time = time.time()
-    g.request_id = request.headers.get('X-Request-ID', str(uuid.uuid4()))
+PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', 8))
+PAYMENT_QUEUE_DEPTH = int(os.getenv('PAYMENT_QUEUE_DEPTH', 100))
+PAYMENT_RETRY_AFTER = os.getenv('PAYMENT_RETRY_AFTER', '1')
+CALLBACK_ATTEMPTS = int(os.getenv('PAYMENT_CALLBACK_ATTEMPTS', 3))
+LONG_POLL_MAX = float(os.getenv('LONG_POLL_MAX', 8))
+PAYMENT_BATCH_MAX = int(os.getenv('PAYMENT_BATCH_MAX', 500))
+# Well past the longest a live worker keeps a payment queued or charging (callback retries included).
+PAYMENT_RECOVER_AFTER = float(os.getenv('PAYMENT_RECOVER_AFTER', 300))
+# The charge is simulated: it takes a random time in [PAYMENT_MIN_DELAY, PAYMENT_MAX_DELAY] and fails at PAYMENT_FAILURE_RATE.
+PAYMENT_MIN_DELAY = float(os.getenv('PAYMENT_MIN_DELAY', 0.1))
+PAYMENT_MAX_DELAY = float(os.getenv('PAYMENT_MAX_DELAY', 0.5))
+PAYMENT_FAILURE_RATE = float(os.getenv('PAYMENT_FAILURE_RATE', 0.05))
+PAYMENT_POOL = ThreadPoolExecutor(max_workers=PAYMENT_WORKERS, thread_name_prefix='payment')
+payment_slots = threading.BoundedSemaphore(PAYMENT_WORKERS + PAYMENT_QUEUE_DEPTH)
+callback_session = requests.Session()
+callback_session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=PAYMENT_WORKERS))
 
-@app.after_request
-def after_request(response):
-    latency = time.time() - g.start_time
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.path, status_code=response.status_code).inc()
-    REQUEST_LATENCY.labels(method=request.method, endpoint=request.path).observe(latency)
-    return response
+SERVICE.readiness.add_check('storage', STORAGE.ping)
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'healthy', 'service': 'payment-service', 'timestamp': time.time()})
+def publish_payments(payments):
+    EVENTS.publish_many([(f"payment.{payment['status']}", {key: payment[key] for key in ('payment_id', 'order_id', 'status', 'amount', 'currency')})
+                         for payment in payments])
 
-@app.route('/ready', methods=['GET'])
-def ready():
-    return jsonify({'status': 'ready'})
+app.add_url_rule('/api/v1/events', 'events', events_view(EVENTS))
 
-@app.route('/metrics', methods=['GET'])
-def metrics():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+def charge(payment):
+    processing_time = random.uniform(PAYMENT_MIN_DELAY, PAYMENT_MAX_DELAY)
+    with TRACER.span('charge'):
+        time.sleep(processing_time)
+    success = random.random() >= PAYMENT_FAILURE_RATE
+    status = 'completed' if success else 'failed'
+    payment.update({'status': status, 'processing_time': round(processing_time, 3), 'completed_at': time.time()})
+    with STORAGE.batch():
+        PAYMENTS_DB.put(payment['payment_id'], payment)
+        publish_payments([payment])
+    PAYMENT_CHANGES.notify()
+    PAYMENT_PROCESSED.labels(status=status, currency=payment['currency']).inc()
+    PAYMENT_AMOUNT.observe(payment['amount'])
+    logger.info(f"Payment {status}: {payment['payment_id']} amount={payment['amount']}")
+    return success
+
+def send_callback(payment, callback_url, request_id):
+    body = {'payment_id': payment['payment_id'], 'order_id': payment['order_id'], 'status': payment['status']}
+    for attempt in range(CALLBACK_ATTEMPTS):
+        try:
+            with TRACER.span('call order callback', 'CLIENT', attempt=attempt + 1) as span:
+                response = callback_session.post(callback_url, json=body, headers={'X-Request-ID': request_id, 'traceparent': span.traceparent}, timeout=5)
+                span.set_tag('http.status_code', response.status_code)
+            if response.status_code < 500:
+                return
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Payment callback failed: {payment['payment_id']} attempt={attempt + 1} error={str(e)}")
+        time.sleep(0.5 * 2 ** attempt)
+    logger.error(f"Payment callback abandoned: {payment['payment_id']} url={callback_url}")
+
+def process_payment_job(payment, request_id, traceparent):
+    # Runs on a pool thread, so the trace is continued from the enqueuing request's span explicitly.
+    try:
+        with TRACER.span('payment job', parent=traceparent):
+            charge(payment)
+            if payment.get('callback_url'):
+                send_callback(payment, payment['callback_url'], request_id)
+    except Exception as e:
+        logger.error(f"Error processing payment job {payment['payment_id']}: {str(e)}")
+
+def queued(payment, callback_url):
+    # Stored with the payment, so a payment whose worker exited can be picked up again (see recover_processing).
+    payment['queued_at'] = payment['created_at']
+    if callback_url:
+        payment['callback_url'] = callback_url
+    return payment
+
+def enqueue_payment(payment, request_id, traceparent):
+    """Hand the payment to the worker pool; returns False when the pool and its queue are full."""
+    if not payment_slots.acquire(blocking=False):
+        return False
+    future = PAYMENT_POOL.submit(process_payment_job, payment, request_id, traceparent)
+    future.add_done_callback(lambda _: payment_slots.release())
+    return True
+
+def recover_processing():
+    """Re-submit payments still processing PAYMENT_RECOVER_AFTER after they were queued: the worker that held them exited."""
+    cutoff, after = time.time() - PAYMENT_RECOVER_AFTER, None
+    while True:
+        stale, after = PAYMENTS_DB.page('queued_at', 100, after=after, equals={'status': 'processing'}, ranges={'queued_at': (None, cutoff)})
+        for payment in stale:
+            # Claimed by moving queued_at, so another worker's sweep skips it. The charge is keyed by payment_id, and the
+            # callback then moves the order on as it would have.
+            claim = dict(payment, queued_at=time.time())
+            if not PAYMENTS_DB.put_if(payment['payment_id'], claim, status='processing', queued_at=payment['queued_at']):
+                continue
+            logger.warning(f"Re-submitting stale payment {payment['payment_id']}")
+            # With the pool full, the claimed payment stays processing and is picked up again after another PAYMENT_RECOVER_AFTER.
+            if not enqueue_payment(claim, str(uuid.uuid4()), None):
+                return
+        if after is None:
+            return
+
+RECOVERY = Periodic('payment-recovery', recover_processing, float(os.getenv('PAYMENT_RECOVER_INTERVAL', 60)))
+SERVICE.readiness.add_warm_up('processing payments', RECOVERY.ensure)
 
 @app.route('/api/v1/payments', methods=['POST'])
+@idempotent(IDEMPOTENCY)
 def create_payment():
     try:
-        data = request.json
-        if not data or 'amount' not in data or 'order_id' not in data:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'amount' not in data or 'order_id' not in data:
             return jsonify({'error': 'Amount and order_id required'}), 400
-        amount = data['amount']
-        currency = data.get('currency', 'USD')
-        order_id = data['order_id']
         payment_id = str(uuid.uuid4())
-        processing_time = random.uniform(0.1, 0.5)
-        time.sleep(processing_time)
-        success = random.random() < 0.95
-        status = 'completed' if success else 'failed'
-        payment = {'payment_id': payment_id, 'order_id': order_id, 'amount': amount, 'currency': currency, 'status': status, 'processing_time': round(processing_time, 3), 'created_at': time.time()}
-        PAYMENTS_DB[payment_id] = payment
-        PAYMENT_PROCESSED.labels(status=status, currency=currency).inc()
-        PAYMENT_AMOUNT.observe(amount)
-        logger.info(f'Payment {status}: {payment_id} amount={amount}')
+        payment = {'payment_id': payment_id, 'order_id': data['order_id'], 'amount': data['amount'], 'currency': data.get('currency', 'USD'), 'status': 'processing', 'created_at': time.time()}
+        # Callers that send "Prefer: respond-async" get a 202 straight away; the charge runs on the worker pool.
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            queued(payment, data.get('callback_url'))
+            # Published before the job is queued, so subscribers never see the outcome ahead of 'processing'.
+            with STORAGE.batch():
+                PAYMENTS_DB.put(payment_id, payment)
+                publish_payments([payment])
+            if not enqueue_payment(dict(payment), g.request_id, current_traceparent()):
+                PAYMENTS_DB.delete(payment_id)
+                publish_payments([dict(payment, status='rejected')])
+                return jsonify({'error': 'Payment queue full, retry later'}), 503, {'Retry-After': PAYMENT_RETRY_AFTER}
+            return jsonify({'message': 'Payment accepted', 'payment': payment}), 202, {'Location': f'/api/v1/payments/{payment_id}'}
+        success = charge(payment)
         status_code = 201 if success else 402
-        return jsonify({'message': f'Payment {status}', 'payment': payment}), status_code
+        return jsonify({'message': f"Payment {payment['status']}", 'payment': payment}), status_code
     except Exception as e:
         logger.error(f'Error processing payment: {str(e)}')
         return jsonify({'error': 'Payment failed'}), 500
 
+@app.route('/api/v1/payments/batch', methods=['POST'])
+@idempotent(IDEMPOTENCY)
+def create_payments_batch():
+    """Accept many payments for asynchronous processing; results[i] is the 202, 400 or 503 outcome of payments[i]."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('payments'), list) or not data['payments']:
+        return jsonify({'error': 'payments required'}), 400
+    if len(data['payments']) > PAYMENT_BATCH_MAX:
+        return jsonify({'error': f'At most {PAYMENT_BATCH_MAX} payments per batch'}), 400
+    results, accepted, now = [], [], time.time()
+    for index, item in enumerate(data['payments']):
+        if not isinstance(item, dict) or 'amount' not in item or 'order_id' not in item:
+            results.append({'index': index, 'status': 400, 'error': 'Amount and order_id required'})
+            continue
+        payment = {'payment_id': str(uuid.uuid4()), 'order_id': item['order_id'], 'amount': item['amount'], 'currency': item.get('currency', 'USD'), 'status': 'processing', 'created_at': now}
+        accepted.append(queued(payment, item.get('callback_url')))
+        results.append({'index': index, 'status': 202, 'payment': payment})
+    with STORAGE.batch():
+        PAYMENTS_DB.put_many([(payment['payment_id'], payment) for payment in accepted])
+        publish_payments(accepted)
+    full = [payment['payment_id'] for payment in accepted if not enqueue_payment(dict(payment), g.request_id, current_traceparent())]
+    if full:
+        with STORAGE.batch():
+            for payment_id in full:
+                PAYMENTS_DB.delete(payment_id)
+        rejected = set(full)
+        publish_payments([dict(payment, status='rejected') for payment in accepted if payment['payment_id'] in rejected])
+        for result in results:
+            if result['status'] == 202 and result['payment']['payment_id'] in rejected:
+                result.update(status=503, error='Payment queue full, retry later')
+                del result['payment']
+    return jsonify({'results': results, 'accepted': len(accepted) - len(full), 'rejected': len(results) - len(accepted) + len(full)}), 200, {'Retry-After': PAYMENT_RETRY_AFTER} if full else {}
+
 @app.route('/api/v1/payments/<payment_id>', methods=['GET'])
 def get_payment(payment_id):
-    payment = PAYMENTS_DB.get(payment_id)
+    try:
+        wait = wait_seconds(request.args, LONG_POLL_MAX)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    payment = PAYMENT_CHANGES.wait_for(lambda: PAYMENTS_DB.get(payment_id), lambda p: p['status'] != 'processing', wait)
     if not payment:
         return jsonify({'error': 'Payment not found'}), 404
     return jsonify(payment)
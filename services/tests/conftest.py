@@ -0,0 +1,34 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SERVICES = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVICES, os.path.join(SERVICES, 'api-gateway')]
+
+from common.storage import open_storage  # noqa: E402
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    url = 'memory://' if request.param == 'memory' else f"sqlite:///{tmp_path / 'test.db'}"
+    return open_storage('test', url)
+
+
+@pytest.fixture(scope='session')
+def load_service():
+    """Import services/<name>/app.py once per session, as module `<name>.app` (every service's module is called app)."""
+    loaded = {}
+
+    def load(name):
+        if name not in loaded:
+            os.environ.setdefault('STORAGE_URL', 'memory://')
+            directory = os.path.join(SERVICES, name)
+            sys.path.insert(0, directory)
+            spec = importlib.util.spec_from_file_location(f'{name}.app', os.path.join(directory, 'app.py'))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            loaded[name] = module
+        return loaded[name]
+    return load
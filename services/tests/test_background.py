@@ -0,0 +1,27 @@
+import pytest
+
+from common.background import PerProcess, purge_expired
+
+
+def test_per_process_starts_once_and_retries_a_failed_start():
+    calls = []
+
+    def start():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise RuntimeError('first start fails')
+
+    started = PerProcess(start)
+    with pytest.raises(RuntimeError):
+        started.ensure()
+    assert not started
+    started.ensure()
+    started.ensure()
+    assert calls == [0, 1] and started
+
+
+def test_purge_expired_deletes_every_match_across_pages(storage):
+    records = storage.repository('records', fields=('expires_at',))
+    records.put_many((f'k{i:03d}', {'key': f'k{i:03d}', 'expires_at': i}) for i in range(120))
+    purge_expired(records, 'expires_at', {'expires_at': (None, 100)}, lambda record: records.delete(record['key']), page_size=7)
+    assert sorted(record['expires_at'] for record in records.values()) == list(range(100, 120))
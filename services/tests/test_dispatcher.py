@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def notifications(load_service):
+    return load_service('notification-service')
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_failing_callback_does_not_stop_the_dispatcher(notifications):
+    sent, calls = [], []
+
+    def on_sent(items):
+        calls.append(len(items))
+        if len(calls) == 1:
+            raise RuntimeError('storage unavailable')
+        sent.extend(item['id'] for item in items)
+    dispatcher = notifications.Dispatcher(lambda notification_type, items: [], on_sent, lambda items: None, workers=1, batch_wait=0)
+    dispatcher.submit([{'id': 1, 'type': 'email'}])
+    wait_for(lambda: calls)
+    dispatcher.submit([{'id': 2, 'type': 'email'}])
+    # The single dispatcher thread survived the failure.
+    wait_for(lambda: sent == [2])
+
+
+def test_stale_queued_notifications_are_recovered_once(notifications, monkeypatch):
+    stale = notifications.new_notification({'type': 'email', 'recipient': 'a@example.com'})
+    stale['queued_at'] -= notifications.RECOVER_AFTER + 1
+    fresh = notifications.new_notification({'type': 'email', 'recipient': 'b@example.com'})
+    notifications.NOTIFICATIONS_DB.put_many([(stale['notification_id'], stale), (fresh['notification_id'], fresh)])
+    submitted = []
+    monkeypatch.setattr(notifications.DISPATCHER, 'submit', lambda items: submitted.extend(items) or True)
+    notifications.recover_queued()
+    notifications.recover_queued()
+    assert [n['notification_id'] for n in submitted] == [stale['notification_id']]
+    assert notifications.NOTIFICATIONS_DB.get(stale['notification_id'])['queued_at'] > stale['queued_at']
+
+
+def test_batches_are_grouped_by_type(notifications):
+    batches, sent = [], []
+    dispatcher = notifications.Dispatcher(lambda notification_type, items: batches.append((notification_type, [i['id'] for i in items])) or [],
+                                          sent.extend, lambda items: None, workers=1, batch_wait=0.05)
+    dispatcher.submit([{'id': 1, 'type': 'email'}, {'id': 2, 'type': 'sms'}, {'id': 3, 'type': 'email'}])
+    wait_for(lambda: len(sent) == 3)
+    assert sorted(batches) == [('email', [1, 3]), ('sms', [2])]
+
+
+def test_failed_sends_are_retried_until_they_succeed(notifications):
+    sent, failures = [], []
+
+    def flaky_send(notification_type, items):
+        failed = [item for item in items if item['id'] == 'flaky' and len(failures) < 2]
+        failures.extend(failed)
+        return failed
+    dispatcher = notifications.Dispatcher(flaky_send, sent.extend, lambda items: pytest.fail('dead-lettered'), workers=1, batch_wait=0,
+                                          max_attempts=3, backoff_base=0.01)
+    dispatcher.submit([{'id': 'flaky', 'type': 'email'}, {'id': 'fine', 'type': 'email'}])
+    wait_for(lambda: len(sent) == 2)
+    assert [(item['id'], item.get('attempts', 0)) for item in sent] == [('fine', 0), ('flaky', 2)]
+    assert dispatcher.depth() == 0
+
+
+def test_exhausted_retries_are_dead_lettered(notifications):
+    dead = []
+    dispatcher = notifications.Dispatcher(lambda notification_type, items: items, lambda items: pytest.fail('sent'), dead.extend,
+                                          workers=1, batch_wait=0, max_attempts=3, backoff_base=0.01)
+    dispatcher.submit([{'id': 1, 'type': 'email'}])
+    wait_for(lambda: dead)
+    assert dead[0]['attempts'] == 3
+
+
+def test_send_exceptions_count_as_failed_sends(notifications):
+    dead = []
+
+    def broken_send(notification_type, items):
+        raise ConnectionError('provider down')
+    dispatcher = notifications.Dispatcher(broken_send, lambda items: None, dead.extend, workers=1, batch_wait=0, max_attempts=2, backoff_base=0.01)
+    dispatcher.submit([{'id': 1, 'type': 'email'}, {'id': 2, 'type': 'email'}])
+    wait_for(lambda: len(dead) == 2)
+
+
+def test_full_queue_rejects_the_whole_submission(notifications):
+    # No dispatcher threads, so submitted items stay queued.
+    dispatcher = notifications.Dispatcher(lambda notification_type, items: [], lambda items: None, lambda items: None, workers=0, max_queue=2)
+    assert not dispatcher.submit([{'id': n, 'type': 'email'} for n in range(3)])
+    assert dispatcher.depth() == 0
+    assert dispatcher.submit([{'id': n, 'type': 'email'} for n in range(2)])
+    assert dispatcher.depth() == 2
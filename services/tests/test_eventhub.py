@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from common.events import Subscriber
+from eventhub import UpstreamEvents
+
+
+@pytest.fixture
+def notifications(load_service):
+    """notification-service's event log, served over HTTP on a local port."""
+    service = load_service('notification-service')
+    server = make_server('127.0.0.1', 0, service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield service.EVENTS, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_hub_polls_the_event_page_after_its_position(notifications):
+    log, url = notifications
+    log.publish('notification.queued', {'notification_id': 'before'})
+    hub = UpstreamEvents('notification', url, page_size=2)
+    subscriber = Subscriber(10)
+    hub.broadcaster.add(subscriber)
+    assert hub.poll()
+    # Events already in the log when the hub positioned itself are not broadcast.
+    assert subscriber.drain() == [] and hub.log_id == log.log_id()
+    start = hub.last_seq
+    for n in range(3):
+        log.publish('notification.sent', {'notification_id': f'n{n}'})
+    # A full page means more may be waiting, so the reader polls again at once.
+    assert not hub.poll()
+    assert hub.poll()
+    assert [event['data']['notification_id'] for _, event in subscriber.drain()] == ['n0', 'n1', 'n2']
+    assert hub.last_seq == start + 3
+
+
+def test_hub_disconnects_streams_when_the_log_changes(notifications):
+    log, url = notifications
+    hub = UpstreamEvents('notification', url)
+    hub.poll()
+    subscriber = Subscriber(10)
+    hub.broadcaster.add(subscriber)
+    hub.log_id = 'another-log'
+    assert not hub.poll()
+    # The open streams end, so their clients resume with ids from the new log.
+    assert subscriber.overflowed and hub.last_seq is None
+    hub.poll()
+    assert hub.log_id == log.log_id()
@@ -0,0 +1,18 @@
+from common.events import EventLog
+
+
+def test_tailer_survives_failed_reads(storage):
+    log = EventLog(storage, poll_interval=0.01)
+    read_after, failures = log.read_after, []
+
+    def flaky_read_after(seq, limit=None):
+        if len(failures) < 2:
+            failures.append(seq)
+            raise RuntimeError('storage unavailable')
+        return read_after(seq, limit)
+    log.read_after = flaky_read_after
+    subscriber, live_from = log.subscribe()
+    log.publish('order.paid', {'order_id': 'o-1'})
+    assert subscriber.ready.wait(2)
+    assert len(failures) == 2
+    assert [(event['seq'], event['type']) for event in subscriber.drain()] == [(live_from + 1, 'order.paid')]
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import pytest
+
+import app as gateway
+import asgi
+from cache import ResponseCache
+from resilience import CLOSED, OPEN, CircuitBreaker
+
+
+class StubService(BaseHTTPRequestHandler):
+    """Answers every call with the server's `status` and its `bodies` entry for the path (else {'status': status}),
+    plus a Location header if `location` is set, recording what it was sent."""
+
+    def reply(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.calls.append((self.command, self.path, body))
+        payload = json.dumps(self.server.bodies.get(self.path, {'status': self.server.status})).encode()
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if self.server.location:
+            self.send_header('Location', self.server.location)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = reply
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_service(monkeypatch):
+    """stub_service(name) replaces upstream `name` with a local StubService, behind a fresh breaker that opens after two failures."""
+    servers = []
+
+    def start(name):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubService)
+        server.status, server.bodies, server.location, server.calls = 200, {}, None, []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setattr(gateway.UPSTREAMS[name], 'base_url', f'http://127.0.0.1:{server.server_port}')
+        # The ASGI app builds its clients from SERVICES when it starts serving.
+        monkeypatch.setitem(gateway.SERVICES, name, f'http://127.0.0.1:{server.server_port}')
+        monkeypatch.setitem(gateway.BREAKERS, name, CircuitBreaker(name, window=4, min_calls=2, failure_ratio=0.5))
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def upstream(stub_service):
+    return stub_service('notification')
+
+
+def proxied(server):
+    # The gateway's readiness warm-up also sends /health here; only proxied calls matter.
+    return [call for call in server.calls if call[1] != '/health']
+
+
+@pytest.fixture
+def client():
+    return gateway.app.test_client()
+
+
+def test_client_caused_500s_leave_the_breaker_closed(upstream, client):
+    upstream.status = 500
+    for body in (b'{not json', b'', b'[1, 2', b'"text"'):
+        response = client.post('/api/v1/notifications', data=body, content_type='application/json')
+        assert response.status_code == 500
+    assert len(proxied(upstream)) == 4
+    assert gateway.BREAKERS['notification'].state == CLOSED
+
+
+def test_unavailable_upstream_opens_the_breaker(upstream, client):
+    upstream.status = 503
+    for _ in range(2):
+        assert client.post('/api/v1/notifications', json={'user_id': 'u'}).status_code == 503
+    assert gateway.BREAKERS['notification'].state == OPEN
+    response = client.post('/api/v1/notifications', json={'user_id': 'u'})
+    assert response.status_code == 503 and 'circuit open' in response.get_json()['error']
+    assert len(proxied(upstream)) == 2
+
+
+def test_fan_out_goes_through_the_breaker(upstream):
+    upstream.status = 502
+    with gateway.app.test_request_context():
+        gateway.g.request_id = 'fan-out'
+        results = [gateway.fan_out({'notification': ('notification', '/health')})['notification'] for _ in range(3)]
+    assert [result['status_code'] for result in results] == [502, 502, None]
+    assert results[-1]['circuit'] == OPEN and 'circuit open' in results[-1]['error']
+
+
+def bearer(user_id):
+    token = jwt.encode({'user_id': user_id, 'email': f'{user_id}@example.com', 'exp': time.time() + 60}, gateway.TOKENS.secret, algorithm='HS256')
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def orders(stub_service, monkeypatch):
+    """A stub order-service holding a paid order o-1, behind an empty response cache."""
+    monkeypatch.setattr(gateway, 'CACHE', ResponseCache())
+    server = stub_service('order')
+    server.bodies['/api/v1/orders/o-1'] = {'order_id': 'o-1', 'status': 'paid'}
+    return server
+
+
+def test_cache_serves_repeat_reads_per_user(orders, client):
+    first = client.get('/api/v1/orders/o-1', headers=bearer('alice'))
+    second = client.get('/api/v1/orders/o-1', headers=bearer('alice'))
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert second.get_json() == {'order_id': 'o-1', 'status': 'paid'} and second.headers['ETag'] == first.headers['ETag']
+    # Entries are keyed by caller, so another user's read goes upstream.
+    assert client.get('/api/v1/orders/o-1', headers=bearer('bob')).headers['X-Cache'] == 'MISS'
+    assert len(proxied(orders)) == 2
+
+
+def test_cache_answers_a_matching_if_none_match_with_304(orders, client):
+    etag = client.get('/api/v1/orders/o-1', headers=bearer('alice')).headers['ETag']
+    response = client.get('/api/v1/orders/o-1', headers=dict(bearer('alice'), **{'If-None-Match': etag}))
+    assert response.status_code == 304 and response.data == b'' and response.headers['ETag'] == etag
+    assert client.get('/api/v1/orders/o-1', headers=dict(bearer('alice'), **{'If-None-Match': '"other"'})).status_code == 200
+
+
+def test_writes_invalidate_the_resource_they_point_at(orders, client):
+    client.get('/api/v1/orders/o-1', headers=bearer('alice'))
+    client.get('/api/v1/orders/o-1', headers=bearer('bob'))
+    orders.status, orders.location = 202, '/api/v1/orders/o-1'
+    assert client.post('/api/v1/orders', json={'items': [{'price': 1}]}, headers=bearer('alice')).status_code == 202
+    orders.status, orders.location = 200, None
+    # Every caller's copy is dropped, not just the writer's.
+    assert client.get('/api/v1/orders/o-1', headers=bearer('alice')).headers['X-Cache'] == 'MISS'
+    assert client.get('/api/v1/orders/o-1', headers=bearer('bob')).headers['X-Cache'] == 'MISS'
+
+
+ALICE, BOB = bearer('alice'), bearer('bob')
+# The same calls go to both gateways; each answer is compared as (status, JSON body, selected headers).
+CALLS = [
+    ('GET', '/', {}, None),
+    ('GET', '/api/v1/auth/validate', ALICE, None),
+    ('GET', '/api/v1/auth/validate', {}, None),
+    ('GET', '/api/v1/auth/validate', {'Authorization': 'Bearer not-a-jwt'}, None),
+    ('GET', '/api/v1/orders/o-1', {}, None),
+    ('GET', '/api/v1/orders/o-1', ALICE, None),
+    ('GET', '/api/v1/orders/o-1', ALICE, None),
+    ('GET', '/api/v1/orders/o-1', BOB, None),
+    ('GET', '/api/v1/orders/o-2', ALICE, None),
+    ('POST', '/api/v1/notifications', {}, b'{not json'),
+    ('GET', '/api/v1/events', ALICE | {'Last-Event-ID': 'order:x'}, None),
+]
+COMPARED_HEADERS = ('Content-Type', 'X-Cache', 'ETag', 'Retry-After')
+
+
+@pytest.fixture
+def stubs(stub_service):
+    """Stub order- and notification-services: orders o-1 and o-2, and a notification-service that answers 500."""
+    orders, notifications = stub_service('order'), stub_service('notification')
+    orders.bodies['/api/v1/orders/o-1'] = {'order_id': 'o-1', 'status': 'paid'}
+    orders.bodies['/api/v1/orders/o-2'] = {'order_id': 'o-2', 'status': 'pending'}
+    notifications.status = 500
+    return orders, notifications
+
+
+def fresh_cache(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(gateway, 'CACHE', cache)
+    monkeypatch.setattr(asgi, 'CACHE', cache)
+
+
+def answer(status, json, headers):
+    return status, json, {name: headers.get(name) for name in COMPARED_HEADERS}
+
+
+def wsgi_answers():
+    client = gateway.app.test_client()
+    answers = []
+    for method, path, headers, body in CALLS:
+        response = client.open(path, method=method, headers=headers, data=body, content_type='application/json' if body else None)
+        answers.append(answer(response.status_code, response.get_json(silent=True), response.headers))
+    return answers
+
+
+async def asgi_answers():
+    answers = []
+    async with asgi.app.test_app() as test_app:
+        client = test_app.test_client()
+        for method, path, headers, body in CALLS:
+            if body:
+                headers = dict(headers, **{'Content-Type': 'application/json'})
+            response = await client.open(path, method=method, headers=headers, data=body)
+            answers.append(answer(response.status_code, await response.get_json(force=True, silent=True), response.headers))
+    return answers
+
+
+def test_asgi_gateway_answers_like_the_wsgi_gateway(stubs, monkeypatch):
+    fresh_cache(monkeypatch)
+    expected = wsgi_answers()
+    fresh_cache(monkeypatch)
+    assert asyncio.run(asgi_answers()) == expected
+    # The calls exercised what they were meant to: auth failures, cache misses and hits, and a passed-through upstream 500.
+    assert [status for status, _, _ in expected] == [200, 200, 401, 401, 401, 200, 200, 200, 200, 500, 400]
+    assert [headers['X-Cache'] for _, _, headers in expected[5:9]] == ['MISS', 'HIT', 'MISS', 'MISS']
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, Counter
+
+from common.idempotency import IdempotencyStore
+
+
+def make_store(storage, **kwargs):
+    counter = Counter('idempotency_requests_total', 'lookups', ['result'], registry=CollectorRegistry())
+    return IdempotencyStore(storage, counter, **kwargs)
+
+
+class StoredResponse:
+    status_code = 201
+    headers = {'Content-Type': 'application/json'}
+
+    def get_data(self, as_text=False):
+        return '{"ok":true}'
+
+
+def test_claim_miss_then_hit_then_mismatch(storage):
+    store = make_store(storage)
+    assert store.claim('POST /orders u1 k', 'body-a') == ('miss', None)
+    store.complete('POST /orders u1 k', 'body-a', StoredResponse())
+    outcome, record = store.claim('POST /orders u1 k', 'body-a')
+    assert outcome == 'hit' and record['status'] == 201 and record['body'] == '{"ok":true}'
+    assert store.claim('POST /orders u1 k', 'body-b')[0] == 'mismatch'
+
+
+def test_released_key_can_be_claimed_again(storage):
+    store = make_store(storage)
+    store.claim('k', 'f')
+    store.release('k')
+    assert store.claim('k', 'f')[0] == 'miss'
+
+
+def test_duplicate_waits_for_the_in_flight_request(storage):
+    store = make_store(storage)
+    store.claim('k', 'f')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(store.claim('k', 'f')[0]))
+    waiter.start()
+    time.sleep(0.05)
+    store.complete('k', 'f', StoredResponse())
+    waiter.join(5)
+    assert results == ['coalesced']
+
+
+def test_expired_in_flight_claim_is_taken_over(storage):
+    store = make_store(storage, in_flight_timeout=0)
+    store.claim('k', 'f')
+    assert store.claim('k', 'f')[0] == 'miss'
@@ -0,0 +1,49 @@
+import pytest
+
+
+@pytest.fixture
+def orders(load_service, storage, monkeypatch):
+    """order-service over a fresh orders repository holding o00..o11, created at 0..11 and paid when odd."""
+    service = load_service('order-service')
+    repository = storage.repository('orders', fields=('created_at', 'status'), indexes=[('created_at',), ('status', 'created_at')])
+    repository.put_many((f'o{n:02d}', {'order_id': f'o{n:02d}', 'created_at': n, 'status': 'paid' if n % 2 else 'pending', 'total': n})
+                        for n in range(12))
+    monkeypatch.setattr(service, 'ORDERS_DB', repository)
+    return service.app.test_client()
+
+
+def walk(client, query):
+    """Every page of a listing, following next_cursor; returns the order ids and the number of pages."""
+    ids, pages, cursor = [], 0, None
+    while True:
+        body = client.get('/api/v1/orders', query_string=dict(query, **({'cursor': cursor} if cursor else {}))).get_json()
+        ids.extend(order['order_id'] for order in body['orders'])
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+def test_cursor_walk_returns_every_order_once_newest_first(orders):
+    assert walk(orders, {'limit': 5}) == ([f'o{n:02d}' for n in range(11, -1, -1)], 3)
+
+
+def test_cursor_walk_keeps_filters_and_order(orders):
+    ids, _ = walk(orders, {'limit': 2, 'status': 'paid', 'order': 'asc', 'created_after': 3, 'created_before': 10})
+    assert ids == ['o03', 'o05', 'o07', 'o09']
+
+
+def test_last_page_has_no_cursor(orders):
+    body = orders.get('/api/v1/orders', query_string={'limit': 12}).get_json()
+    assert len(body['orders']) == 12 and body['next_cursor'] is None and body['limit'] == 12
+
+
+@pytest.mark.parametrize('query', [{'cursor': 'garbage'}, {'limit': 0}, {'limit': 'ten'}, {'order': 'sideways'}, {'created_after': 'yesterday'}])
+def test_bad_listing_parameters_are_rejected(orders, query):
+    assert orders.get('/api/v1/orders', query_string=query).status_code == 400
+
+
+def test_ndjson_export_streams_every_match(orders):
+    response = orders.get('/api/v1/orders', query_string={'format': 'ndjson', 'status': 'pending'})
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(response.data.splitlines()) == 6
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+
+@pytest.fixture
+def payments(load_service, monkeypatch):
+    service = load_service('payment-service')
+    monkeypatch.setattr(service, 'PAYMENT_MAX_DELAY', 0.01)
+    monkeypatch.setattr(service, 'PAYMENT_FAILURE_RATE', 0.0)
+    return service
+
+
+@pytest.fixture
+def orders(load_service):
+    """order-service, served over HTTP so payment callbacks reach it."""
+    service = load_service('order-service')
+    server = make_server('127.0.0.1', 0, service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield service, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def wait_settled(order_service, order_ids, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while any(order_service.ORDERS_DB.get(order_id)['status'] in order_service.PENDING_STATUSES for order_id in order_ids):
+        assert time.monotonic() < deadline, 'orders were never called back'
+        time.sleep(0.01)
+
+
+def test_stale_processing_payment_is_resubmitted_and_calls_back(payments, orders):
+    order_service, url = orders
+    now = time.time()
+    order_service.ORDERS_DB.put('o-stale', {'order_id': 'o-stale', 'items': [], 'total': 5, 'status': 'payment_initiated', 'created_at': now})
+    # Left processing by a worker that exited after queueing it.
+    stale = payments.queued({'payment_id': 'p-stale', 'order_id': 'o-stale', 'amount': 5, 'currency': 'USD', 'status': 'processing',
+                             'created_at': now - payments.PAYMENT_RECOVER_AFTER - 1}, f'{url}/api/v1/orders/o-stale/payment-callback')
+    fresh = payments.queued({'payment_id': 'p-fresh', 'order_id': 'o-fresh', 'amount': 5, 'currency': 'USD', 'status': 'processing', 'created_at': now}, None)
+    payments.PAYMENTS_DB.put_many([('p-stale', stale), ('p-fresh', fresh)])
+    payments.recover_processing()
+    wait_settled(order_service, ['o-stale'])
+    assert payments.PAYMENTS_DB.get('p-stale')['status'] == 'completed'
+    order = order_service.ORDERS_DB.get('o-stale')
+    assert order['status'] == 'paid' and order['payment_id'] == 'p-stale'
+    assert payments.PAYMENTS_DB.get('p-fresh')['status'] == 'processing'
+
+
+@pytest.fixture
+def payment_server(payments, load_service, monkeypatch):
+    """payment-service served over HTTP, as the order-service's payment backend."""
+    server = make_server('127.0.0.1', 0, payments.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(load_service('order-service'), 'PAYMENT_SERVICE_URL', f'http://127.0.0.1:{server.server_port}')
+    yield payments
+    server.shutdown()
+
+
+def test_repeated_payment_batch_is_replayed_not_charged_twice(payment_server, orders, monkeypatch):
+    order_service, url = orders
+    monkeypatch.setattr(order_service, 'ORDER_SERVICE_URL', url)
+    batch = [{'order_id': f'o-batch-{n}', 'items': [], 'total': 5, 'status': 'pending', 'created_at': time.time()} for n in range(3)]
+    order_service.ORDERS_DB.put_many((order['order_id'], order) for order in batch)
+    with order_service.app.test_request_context():
+        order_service.g.request_id = 'batch'
+        first = order_service.start_payments(batch)
+        count = payment_server.PAYMENTS_DB.count()
+        second = order_service.start_payments(batch)
+    assert [order['payment_id'] for order, _ in first] == [order['payment_id'] for order, _ in second]
+    assert payment_server.PAYMENTS_DB.count() == count
+    # Each order is settled once, by its one job's callback.
+    wait_settled(order_service, [order['order_id'] for order in batch])
@@ -0,0 +1,39 @@
+import time
+
+from ratelimit import ConcurrencyLimiter, TokenBuckets, client_ip, parse_rate_limits
+
+
+def test_token_bucket_spends_burst_then_refills(storage):
+    buckets = TokenBuckets(storage)
+    assert [buckets.take('login|ip:1', 10, 3) for _ in range(3)] == [0, 0, 0]
+    wait = buckets.take('login|ip:1', 10, 3)
+    assert 0 < wait <= 0.1
+    # Buckets are per key.
+    assert buckets.take('login|ip:2', 10, 3) == 0
+    time.sleep(wait)
+    assert buckets.take('login|ip:1', 10, 3) == 0
+
+
+def test_purge_drops_only_full_buckets(storage):
+    buckets = TokenBuckets(storage)
+    buckets.take('slow', 0.001, 5)
+    buckets.take('fast', 1000, 5)
+    time.sleep(0.01)
+    buckets.purge()
+    assert buckets.buckets.get('fast') is None
+    assert buckets.buckets.get('slow') is not None
+
+
+def test_parse_rate_limits_and_client_ip():
+    assert parse_rate_limits('login=1/10,*=50/100') == {'login': (1.0, 10.0), '*': (50.0, 100.0)}
+    assert parse_rate_limits('') == {}
+    assert client_ip('10.0.0.1', '1.2.3.4, 5.6.7.8', trusted_hops=1) == '5.6.7.8'
+    assert client_ip('10.0.0.1', '1.2.3.4, 5.6.7.8', trusted_hops=0) == '10.0.0.1'
+
+
+def test_concurrency_limiter_sheds_past_the_limit():
+    limiter = ConcurrencyLimiter(1)
+    assert limiter.acquire(blocking=False)
+    assert not limiter.acquire(blocking=False)
+    limiter.release()
+    assert limiter.acquire(blocking=False) and limiter.in_flight == 1
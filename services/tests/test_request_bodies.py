@@ -0,0 +1,40 @@
+import pytest
+
+MALFORMED = [b'{not json', b'', b'[1, 2', b'"text"', b'5', b'[]', b'null']
+
+
+@pytest.mark.parametrize('service, path', [
+    ('auth-service', '/api/v1/register'),
+    ('auth-service', '/api/v1/login'),
+    ('order-service', '/api/v1/orders'),
+    ('order-service', '/api/v1/orders/batch'),
+    ('order-service', '/api/v1/orders/o-1/payment-callback'),
+    ('payment-service', '/api/v1/payments'),
+    ('payment-service', '/api/v1/payments/batch'),
+    ('notification-service', '/api/v1/notifications'),
+    ('notification-service', '/api/v1/notifications/bulk'),
+])
+def test_malformed_bodies_are_rejected_with_400(load_service, service, path):
+    client = load_service(service).app.test_client()
+    for body in MALFORMED:
+        response = client.post(path, data=body, content_type='application/json')
+        assert response.status_code == 400, (body, response.get_json())
+
+
+@pytest.mark.parametrize('body', [
+    {'items': 5},
+    {'items': 'abc'},
+    {'items': [5]},
+    {'items': [{'price': 'ten', 'quantity': 1}]},
+    {'items': [{'price': 10, 'quantity': [2]}]},
+])
+def test_order_items_are_validated(load_service, body):
+    client = load_service('order-service').app.test_client()
+    response = client.post('/api/v1/orders', json=body)
+    assert response.status_code == 400
+
+
+def test_credentials_must_be_strings(load_service):
+    client = load_service('auth-service').app.test_client()
+    for body in ({'email': 'a@example.com', 'password': 5}, {'email': ['a'], 'password': 'secret'}, {'email': '', 'password': 'secret'}):
+        assert client.post('/api/v1/login', json=body).status_code == 400
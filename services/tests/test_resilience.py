@@ -0,0 +1,29 @@
+import time
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def test_breaker_opens_fails_fast_and_closes_after_probes():
+    changes = []
+    breaker = CircuitBreaker('order', window=4, min_calls=4, failure_ratio=0.5, open_seconds=0.05, half_open_probes=2,
+                             on_state_change=lambda name, state: changes.append(state))
+    for success in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(True)
+    breaker.record(True)
+    assert changes == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker('order', window=2, min_calls=2, failure_ratio=0.5, open_seconds=0.01, half_open_probes=1)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
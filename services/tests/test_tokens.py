@@ -0,0 +1,56 @@
+import time
+import types
+
+import jwt
+import pytest
+
+import tokens
+from tokens import TokenCache, authenticate
+
+SECRET = 'test-secret-at-least-32-bytes-long'
+
+
+def token(exp, secret=SECRET, **claims):
+    return jwt.encode({'user_id': 'u-1', 'email': 'u@example.com', 'exp': exp, **claims}, secret, algorithm='HS256')
+
+
+def test_valid_token_is_verified_once_then_served_from_the_cache(monkeypatch):
+    cache = TokenCache(SECRET)
+    valid = token(time.time() + 60)
+    assert authenticate(cache, f'Bearer {valid}') == (jwt.decode(valid, SECRET, algorithms=['HS256']), None)
+    monkeypatch.setattr(jwt, 'decode', lambda *args, **kwargs: pytest.fail('cached token was decoded again'))
+    claims, error = authenticate(cache, f'Bearer {valid}')
+    assert error is None and claims['user_id'] == 'u-1'
+
+
+@pytest.mark.parametrize('header, error', [
+    (None, 'No token provided'),
+    ('Basic dXNlcjpwYXNz', 'No token provided'),
+    (f"Bearer {token(time.time() - 1)}", 'Token expired'),
+    (f"Bearer {token(time.time() + 60, secret='another-secret-at-least-32-bytes-long')}", 'Invalid token'),
+    ('Bearer not-a-jwt', 'Invalid token'),
+    (f"Bearer {jwt.encode({'user_id': 'u-1'}, SECRET, algorithm='HS256')}", 'Invalid token'),
+])
+def test_rejected_tokens(header, error):
+    assert authenticate(TokenCache(SECRET), header) == (None, error)
+
+
+def test_cached_claims_expire_with_the_token(monkeypatch):
+    cache = TokenCache(SECRET)
+    short = token(time.time() + 60)
+    assert cache.verify(short)['user_id'] == 'u-1'
+    later = time.time() + 61
+    monkeypatch.setattr(tokens, 'time', types.SimpleNamespace(time=lambda: later))
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.verify(short)
+    assert len(cache) == 0
+
+
+def test_cache_evicts_the_least_recently_used_token():
+    cache = TokenCache(SECRET, max_size=2)
+    a, b, c = (token(time.time() + 60, n=n) for n in range(3))
+    cache.verify(a)
+    cache.verify(b)
+    cache.verify(a)
+    cache.verify(c)
+    assert list(cache.entries) == [a, c]